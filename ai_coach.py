@@ -6,6 +6,9 @@ from datetime import datetime, timedelta
 import logging
 import threading
 import random
+from collections import OrderedDict
+from scan_scheduler import provider_budget
+from market_data_engine import download_histories
 
 # For voice synthesis - will use Web Speech API via JavaScript instead of pyttsx3
 # to avoid threading issues in web application
@@ -25,30 +28,124 @@ class AICoach:
             'risky': {'emoji': '⚠️', 'description': 'High risk setup'},
             'confirmed': {'emoji': '🔒', 'description': 'Pattern confirmed'}
         }
+        
+        # One download and one indicator frame per symbol, shared by every analysis of its latest bar
+        self.history_ttl = 300  # seconds a download is reused before checking for a newer bar
+        self.max_cached_results = 256
+        self._histories = OrderedDict()
+        self._results = OrderedDict()
+        self._cache_lock = threading.Lock()
+    
+    def _remember(self, cache, key, value, limit):
+        with self._cache_lock:
+            cache[key] = value
+            cache.move_to_end(key)
+            while len(cache) > limit:
+                cache.popitem(last=False)
+    
+    def get_history(self, symbol):
+        """3 months of daily bars, downloaded at most once per history_ttl"""
+        with self._cache_lock:
+            cached = self._histories.get(symbol)
+        if cached is not None and (datetime.now() - cached['fetched']).total_seconds() < self.history_ttl:
+            return cached['hist']
+        
+        provider_budget.acquire()
+        ticker = yf.Ticker(symbol)
+        hist = ticker.history(period="3mo")
+        self._remember(self._histories, symbol, {'hist': hist, 'fetched': datetime.now()}, self.max_cached_results)
+        return hist
+    
+    def _cached(self, symbol, kind, last_bar, compute):
+        """Result of compute() for this symbol's bar (see bar_key), computed once; empty or failed results are not kept"""
+        key = (symbol, kind, last_bar)
+        with self._cache_lock:
+            if key in self._results:
+                self._results.move_to_end(key)
+                return self._results[key]
+        
+        result = compute()
+        if result and not (isinstance(result, dict) and 'error' in result):
+            self._remember(self._results, key, result, self.max_cached_results)
+        return result
+    
+    def bar_key(self, hist):
+        """Identity of the latest bar; today's bar keeps its timestamp while close and volume still change"""
+        last = hist.iloc[-1]
+        return (hist.index[-1].isoformat(), float(last['Close']), float(last['Volume']))
+    
+    def build_analysis_frame(self, hist):
+        """Indicators every sub-analysis reads, computed once over the history"""
+        closes = hist['Close']
+        
+        # RSI analysis - calculate manually if ta library fails
+        try:
+            from ta.momentum import RSIIndicator
+            rsi = RSIIndicator(close=closes).rsi()
+        except:
+            # Fallback RSI calculation
+            delta = closes.diff()
+            gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
+            loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
+            rs = gain / loss
+            rsi = 100 - (100 / (1 + rs))
+        
+        returns = closes.pct_change()
+        return {
+            'hist': hist,
+            'last_bar': self.bar_key(hist),
+            'closes': closes,
+            'highs': hist['High'],
+            'lows': hist['Low'],
+            'volumes': hist['Volume'],
+            'returns': returns,
+            'rsi': rsi,
+            'sma_20': closes.rolling(20).mean(),
+            'sma_50': closes.rolling(50).mean(),
+            'volume_ma_20': hist['Volume'].rolling(20).mean(),
+            'momentum': returns.rolling(5).mean()
+        }
+    
+    def get_analysis_frame(self, symbol):
+        """Shared indicator frame for the symbol's latest bar, or None without data"""
+        hist = self.get_history(symbol)
+        if hist is None or hist.empty:
+            return None
+        return self._cached(symbol, 'frame', self.bar_key(hist), lambda: self.build_analysis_frame(hist))
     
     def analyze_setup(self, symbol):
         """Generate AI analysis of current stock setup"""
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period="3mo")
+            frame = self.get_analysis_frame(symbol)
             
-            if hist.empty:
+            if frame is None:
                 return {'error': 'No data available'}
             
+            return self._cached(symbol, 'analysis', frame['last_bar'], lambda: self._analyze_frame(symbol, frame))
+            
+        except Exception as e:
+            logging.error(f"Error analyzing setup for {symbol}: {e}")
+            return {'error': str(e)}
+    
+    def _analyze_frame(self, symbol, frame):
+        """Full setup analysis over a prepared indicator frame"""
+        try:
+            hist = frame['hist']
+            
             # Technical analysis
-            analysis = self.perform_technical_analysis(hist)
+            analysis = self.perform_technical_analysis(hist, frame)
             
             # Pattern recognition
-            pattern = self.identify_pattern(hist)
+            pattern = self.identify_pattern(hist, frame)
             
             # Historical comparison
-            historical_comp = self.get_historical_comparison(pattern)
+            historical_comp = self.get_historical_comparison(pattern, symbol)
             
             # Mood tag assignment
             mood_tag = self.assign_mood_tag(analysis, pattern)
             
             # Generate chart story
-            chart_story = self.generate_chart_story_data(hist)
+            chart_story = self.generate_chart_story_data(hist, frame)
             
             return {
                 'symbol': symbol,
@@ -65,39 +162,29 @@ class AICoach:
             logging.error(f"Error analyzing setup for {symbol}: {e}")
             return {'error': str(e)}
     
-    def perform_technical_analysis(self, hist):
+    def perform_technical_analysis(self, hist, frame=None):
         """Perform comprehensive technical analysis"""
         try:
-            current_price = hist['Close'].iloc[-1]
-            
-            # RSI analysis - calculate manually if ta library fails
-            try:
-                from ta.momentum import RSIIndicator
-                rsi_indicator = RSIIndicator(close=hist['Close'])
-                rsi = rsi_indicator.rsi().iloc[-1]
-            except:
-                # Fallback RSI calculation
-                delta = hist['Close'].diff()
-                gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
-                loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
-                rs = gain / loss
-                rsi = 100 - (100 / (1 + rs)).iloc[-1]
+            frame = frame or self.build_analysis_frame(hist)
+            current_price = frame['closes'].iloc[-1]
+            
+            rsi = frame['rsi'].iloc[-1]
             
             # Volume analysis
-            avg_volume = hist['Volume'].rolling(20).mean().iloc[-2]
-            current_volume = hist['Volume'].iloc[-1]
+            avg_volume = frame['volume_ma_20'].iloc[-2]
+            current_volume = frame['volumes'].iloc[-1]
             volume_surge = ((current_volume - avg_volume) / avg_volume * 100) if avg_volume > 0 else 0
             
             # Moving averages
-            sma_20 = hist['Close'].rolling(20).mean().iloc[-1]
-            sma_50 = hist['Close'].rolling(50).mean().iloc[-1]
+            sma_20 = frame['sma_20'].iloc[-1]
+            sma_50 = frame['sma_50'].iloc[-1]
             
             # Support/Resistance
-            recent_high = hist['High'].tail(20).max()
-            recent_low = hist['Low'].tail(20).min()
+            recent_high = frame['highs'].tail(20).max()
+            recent_low = frame['lows'].tail(20).min()
             
             # Momentum
-            momentum = hist['Close'].pct_change().rolling(5).mean().iloc[-1]
+            momentum = frame['momentum'].iloc[-1]
             
             return {
                 'rsi': round(rsi, 2) if not pd.isna(rsi) else 50,
@@ -113,21 +200,20 @@ class AICoach:
             logging.error(f"Error in technical analysis: {e}")
             return {}
     
-    def identify_pattern(self, hist):
+    def identify_pattern(self, hist, frame=None):
         """Identify chart pattern"""
         try:
             # Simple pattern identification based on price action
-            closes = hist['Close']
-            highs = hist['High']
-            lows = hist['Low']
+            frame = frame or self.build_analysis_frame(hist)
+            closes = frame['closes']
             
             # Calculate recent price action
             recent_closes = closes.tail(10)
             price_range = (recent_closes.max() - recent_closes.min()) / recent_closes.mean()
             
             # Trend analysis
-            sma_20 = closes.rolling(20).mean().iloc[-1]
-            sma_50 = closes.rolling(50).mean().iloc[-1]
+            sma_20 = frame['sma_20'].iloc[-1]
+            sma_50 = frame['sma_50'].iloc[-1]
             current_price = closes.iloc[-1]
             
             if price_range < 0.05:  # Tight consolidation
@@ -146,16 +232,14 @@ class AICoach:
             logging.error(f"Error identifying pattern: {e}")
             return 'unknown'
     
-    def get_historical_comparison(self, pattern):
+    def get_historical_comparison(self, pattern, symbol=None):
         """Get historical comparison using enhanced multi-factor scoring engine"""
         try:
-            from historical_comparison_engine import HistoricalComparisonEngine
-            
-            # Initialize the enhanced comparison engine
-            comparison_engine = HistoricalComparisonEngine()
+            # Matches come from the precomputed feature store shared by the whole process
+            from historical_comparison_engine import historical_comparison_engine as comparison_engine
             
             # Extract symbol from current analysis context
-            symbol = getattr(self, 'current_symbol', 'SPY')  # Default to SPY if no symbol set
+            symbol = symbol or getattr(self, 'current_symbol', 'SPY')  # Default to SPY if no symbol set
             
             # Find historical matches with comprehensive scoring
             matches = comparison_engine.find_historical_matches(symbol, lookback_days=504)  # 2 years
@@ -176,7 +260,8 @@ class AICoach:
             comparison_text = self._generate_comparison_text(top_match, detailed_analysis)
             
             # Generate chart data for visualization
-            chart_data = self._generate_comparison_chart_data(top_match)
+            chart_data = self._cached(top_match.symbol, 'comparison_chart', top_match.date_range,
+                                      lambda: self._generate_comparison_chart_data(top_match))
             
             return {
                 'text': comparison_text,
@@ -275,6 +360,7 @@ class AICoach:
             extended_end = end_date + timedelta(days=15)
             
             # Fetch historical data
+            provider_budget.acquire()
             ticker = yf.Ticker(match.symbol)
             hist = ticker.history(start=start_date, end=extended_end, interval="1d")
             
@@ -367,43 +453,88 @@ class AICoach:
             logging.error(f"Error generating analysis text: {e}")
             return "Analysis temporarily unavailable."
     
-    def generate_chart_story_data(self, hist):
-        """Generate chart story data for hover functionality"""
+    def generate_chart_story_data(self, hist, frame=None, bars=20):
+        """Generate chart story data for hover functionality over the last `bars` bars (all bars if None)"""
         try:
-            story_points = []
+            if hist is None or hist.empty:
+                return []
+            closes = frame['closes'] if frame else hist['Close']
+            change = frame['returns'] if frame else closes.pct_change()
             
-            # Analyze recent price action for story points
-            for i in range(max(0, len(hist) - 20), len(hist)):
-                row = hist.iloc[i]
-                date = hist.index[i].strftime('%Y-%m-%d')
-                
-                # Generate contextual comments
-                if i > 0:
-                    prev_close = hist['Close'].iloc[i-1]
-                    price_change = (row['Close'] - prev_close) / prev_close
-                    
-                    comment = ""
-                    if abs(price_change) > 0.05:  # Significant move
-                        if price_change > 0:
-                            comment = f"Strong buying at {row['Close']:.2f} - bulls taking control"
-                        else:
-                            comment = f"Heavy selling at {row['Close']:.2f} - bears in charge"
-                    elif row['High'] - row['Low'] > (row['Close'] * 0.03):  # Large range
-                        comment = f"High volatility day - indecision at {row['Close']:.2f}"
-                    
-                    if comment:
-                        story_points.append({
-                            'date': date,
-                            'price': row['Close'],
-                            'comment': comment
-                        })
-            
-            return story_points
+            # Story points are only considered in the window and need a previous close
+            keep = np.zeros(len(hist), dtype=bool)
+            keep[max(0, len(hist) - bars) if bars else 0:] = True
+            keep[0] = False
+            
+            closes, change = closes.values, change.values
+            rows, significant = self._story_rows(closes, hist['High'].values, hist['Low'].values, change, keep)
+            dates = hist.index[rows].strftime('%Y-%m-%d')
+            return [self._story_point(date, closes[i], change[i], significant[i]) for date, i in zip(dates, rows)]
             
         except Exception as e:
             logging.error(f"Error generating chart story: {e}")
             return []
     
+    def _story_rows(self, closes, highs, lows, change, keep):
+        """Rows worth a comment, found for every bar at once: big daily moves first, otherwise wide-range days"""
+        with np.errstate(invalid='ignore'):
+            significant = keep & (np.abs(change) > 0.05)  # Significant move
+            wide_range = keep & ~significant & (highs - lows > closes * 0.03)  # Large range
+        return np.flatnonzero(significant | wide_range), significant
+    
+    def _story_point(self, date, close, change, significant):
+        if not significant:
+            comment = f"High volatility day - indecision at {close:.2f}"
+        elif change > 0:
+            comment = f"Strong buying at {close:.2f} - bulls taking control"
+        else:
+            comment = f"Heavy selling at {close:.2f} - bears in charge"
+        return {
+            'date': date,
+            'price': close,
+            'comment': comment
+        }
+    
+    def generate_chart_stories(self, symbols=None, histories=None, period="1y", bars=None):
+        """Chart stories for many symbols in one pass over a stacked panel of their bars"""
+        if histories is None:
+            histories = self.fetch_universe_history(symbols or [], period)
+        
+        frames = [hist[['High', 'Low', 'Close']].assign(symbol=symbol)
+                  for symbol, hist in histories.items() if hist is not None and not hist.empty]
+        if not frames:
+            return {}
+        
+        try:
+            panel = pd.concat(frames)
+            by_symbol = panel.groupby('symbol', sort=False)
+            closes = panel['Close'].values
+            change = (panel['Close'] / by_symbol['Close'].shift(1) - 1).values
+            
+            # Each symbol's first bar has no previous close; the window counts bars back from each symbol's end
+            keep = by_symbol.cumcount().values > 0
+            if bars:
+                keep &= by_symbol.cumcount(ascending=False).values < bars
+            
+            rows, significant = self._story_rows(closes, panel['High'].values, panel['Low'].values, change, keep)
+            
+            stories = {frame['symbol'].iloc[0]: [] for frame in frames}
+            symbol_column = panel['symbol'].values
+            dates = panel.index[rows].strftime('%Y-%m-%d')
+            for date, i in zip(dates, rows):
+                stories[symbol_column[i]].append(self._story_point(date, closes[i], change[i], significant[i]))
+            
+            logging.info(f"Generated chart stories for {len(stories)} symbols ({len(rows)} story points)")
+            return stories
+            
+        except Exception as e:
+            logging.error(f"Error generating chart stories: {e}")
+            return {}
+    
+    def fetch_universe_history(self, symbols, period="1y"):
+        """Download daily bars for every symbol in batched requests"""
+        return download_histories(symbols, period)
+    
     def trigger_voice_alert(self, symbol, confidence_score):
         """Trigger voice alert for high confidence stocks"""
         try:
@@ -434,10 +565,13 @@ class AICoach:
     def generate_chart_story(self, symbol):
         """Generate chart story for specific symbol"""
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period="1mo")
+            # The story covers the last 20 bars, which the shared 3-month frame already holds
+            frame = self.get_analysis_frame(symbol)
+            if frame is None:
+                return []
             
-            return self.generate_chart_story_data(hist)
+            return self._cached(symbol, 'chart_story', frame['last_bar'],
+                                lambda: self.generate_chart_story_data(frame['hist'], frame))
             
         except Exception as e:
             logging.error(f"Error generating chart story for {symbol}: {e}")
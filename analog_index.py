@@ -0,0 +1,294 @@
+"""
+Historical Analog Index
+Nearest-neighbour index over normalized fixed-length bar windows for fast "most similar setup" queries
+"""
+
+import os
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import ta
+from numpy.lib.stride_tricks import sliding_window_view
+
+from market_data_engine import download_histories
+
+class AnalogIndex:
+    def __init__(self, index_file: str = "analog_index.npz", window: int = 20,
+                 horizons=(5, 10, 20), rsi_window: int = 14):
+        self.index_file = index_file
+        self.window = window
+        self.horizons = tuple(horizons)
+        self.rsi_window = rsi_window
+        self.warmup = rsi_window * 3  # bars before indicator values stop depending on where the fetch started
+
+        # Share of the similarity each block contributes
+        self.block_weights = {'price': 0.6, 'volume': 0.2, 'indicators': 0.2}
+
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._clear()
+
+    def _clear(self):
+        dimension = 2 * self.window + 5
+        self.embeddings = np.empty((0, dimension), dtype=np.float32)
+        self.symbols = np.empty(0, dtype='<U12')
+        self.end_dates = np.empty(0, dtype='datetime64[D]')
+        self.end_closes = np.empty(0, dtype=np.float64)
+        self.forward_returns = np.empty((0, len(self.horizons)), dtype=np.float32)
+
+    # Embeddings
+
+    def _zscore(self, windows: np.ndarray) -> np.ndarray:
+        centred = windows - windows.mean(axis=1, keepdims=True)
+        scale = centred.std(axis=1, keepdims=True)
+        return np.divide(centred, scale, out=np.zeros_like(centred), where=scale > 0)
+
+    def embed_history(self, hist: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Embedding for every complete window of one symbol's bars, with the outcome that followed"""
+        closes = hist['Close'].values.astype(float)
+        volumes = hist['Volume'].values.astype(float)
+        n = len(closes)
+        w = self.window
+        if n < w + 1:
+            return {}
+
+        # The window ending at bar t covers bars t-w+1..t; bar 0 is skipped so every bar in a window has a return
+        close_windows = sliding_window_view(closes, w)[1:]
+        volume_windows = sliding_window_view(np.log1p(volumes), w)[1:]
+        end = np.arange(w, n)
+
+        price_shape = self._zscore(np.log(close_windows))
+        volume_shape = self._zscore(volume_windows)
+
+        returns = np.diff(np.log(closes))
+        return_windows = sliding_window_view(returns, w)
+        rsi = ta.momentum.rsi(hist['Close'], window=self.rsi_window).values[end]
+        window_high = close_windows.max(axis=1)
+        window_low = close_windows.min(axis=1)
+        span = window_high - window_low
+        volume_mean = np.exp(volume_windows).mean(axis=1)
+
+        indicators = np.column_stack([
+            np.nan_to_num(rsi, nan=50.0) / 50 - 1,
+            np.tanh(np.log(close_windows[:, -1] / close_windows[:, 0]) * 5),
+            np.tanh(return_windows.std(axis=1) * 20),
+            np.divide(close_windows[:, -1] - window_low, span, out=np.full(len(span), 0.5), where=span > 0) * 2 - 1,
+            np.tanh(np.log(np.exp(volume_windows[:, -5:]).mean(axis=1) / volume_mean))
+        ])
+
+        # Scale each block to unit length, then weight so the dot product is a weighted cosine similarity
+        blocks = []
+        for name, block in (('price', price_shape), ('volume', volume_shape), ('indicators', indicators)):
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            block = np.divide(block, norms, out=np.zeros_like(block), where=norms > 0)
+            blocks.append(block * np.sqrt(self.block_weights[name]))
+        embeddings = np.hstack(blocks).astype(np.float32)
+
+        forward = np.full((len(end), len(self.horizons)), np.nan, dtype=np.float32)
+        for column, horizon in enumerate(self.horizons):
+            known = end + horizon < n
+            forward[known, column] = closes[end[known] + horizon] / closes[end[known]] - 1
+
+        valid = np.isfinite(embeddings).all(axis=1)
+        dates = hist.index.tz_localize(None) if hist.index.tz is not None else hist.index
+        return {
+            'embeddings': embeddings[valid],
+            'end_dates': dates[end[valid]].values.astype('datetime64[D]'),
+            'end_closes': closes[end[valid]],
+            'forward_returns': forward[valid]
+        }
+
+    # Building and maintenance
+
+    def build(self, symbols: List[str], period: str = "5y", histories: Optional[Dict[str, pd.DataFrame]] = None) -> int:
+        """Offline build of the whole index; returns the number of indexed windows"""
+        histories = histories if histories is not None else download_histories(symbols, period)
+        if not histories:
+            # Keep the existing data rather than replacing it with nothing
+            logging.error("No history downloaded; analog index left unchanged")
+            return len(self.symbols)
+        with self._lock:
+            self._clear()
+            self._append(histories, keep_from=0)
+            self._save()
+        logging.info(f"Built analog index: {len(self.symbols)} windows across {len(histories)} symbols")
+        return len(self.symbols)
+
+    def update(self, symbols: Optional[List[str]] = None, period: str = "6mo",
+               histories: Optional[Dict[str, pd.DataFrame]] = None) -> int:
+        """Daily incremental update: append new windows and fill in outcomes that have since become known"""
+        self.load()
+        if symbols is None:
+            symbols = sorted(set(self.symbols.tolist()))
+        histories = histories if histories is not None else download_histories(symbols, period)
+        with self._lock:
+            before = len(self.symbols)
+            self._append(histories, keep_from=self.warmup)
+            self._save()
+        logging.info(f"Updated analog index: {len(self.symbols) - before:+d} windows, {len(self.symbols)} total")
+        return len(self.symbols)
+
+    def _append(self, histories: Dict[str, pd.DataFrame], keep_from: int):
+        """Replace each symbol's rows from its first fully warmed-up window onwards"""
+        parts = {'embeddings': [self.embeddings], 'symbols': [self.symbols], 'end_dates': [self.end_dates],
+                 'end_closes': [self.end_closes], 'forward_returns': [self.forward_returns]}
+        drop = np.zeros(len(self.symbols), dtype=bool)
+
+        for symbol, hist in histories.items():
+            try:
+                embedded = self.embed_history(hist)
+            except Exception as e:
+                logging.error(f"Error embedding {symbol} for analog index: {e}")
+                continue
+            if not embedded:
+                continue
+            first = max(keep_from - self.window, 0)
+            if first >= len(embedded['end_dates']):
+                continue
+            replace_from = embedded['end_dates'][first]
+            drop |= (self.symbols == symbol) & (self.end_dates >= replace_from)
+
+            for key in ('embeddings', 'end_dates', 'end_closes', 'forward_returns'):
+                parts[key].append(embedded[key][first:])
+            parts['symbols'].append(np.full(len(embedded['end_dates']) - first, symbol, dtype='<U12'))
+
+        keep = ~np.concatenate([drop, np.zeros(sum(len(p) for p in parts['symbols'][1:]), dtype=bool)])
+        self.embeddings = np.concatenate(parts['embeddings'])[keep]
+        self.symbols = np.concatenate(parts['symbols'])[keep]
+        self.end_dates = np.concatenate(parts['end_dates'])[keep]
+        self.end_closes = np.concatenate(parts['end_closes'])[keep]
+        self.forward_returns = np.concatenate(parts['forward_returns'])[keep]
+
+    # Persistence
+
+    def _save(self):
+        """Write-then-rename so readers in other processes never load a partial index"""
+        tmp_file = f"{self.index_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_file, embeddings=self.embeddings, symbols=self.symbols, end_dates=self.end_dates,
+                 end_closes=self.end_closes, forward_returns=self.forward_returns,
+                 horizons=np.array(self.horizons), window=np.array(self.window))
+        os.replace(tmp_file, self.index_file)
+        self._loaded_mtime = os.path.getmtime(self.index_file)
+
+    def load(self) -> bool:
+        """Reload the index if another process has rebuilt it since we last read it"""
+        try:
+            mtime = os.path.getmtime(self.index_file)
+        except OSError:
+            return False
+        if mtime == self._loaded_mtime:
+            return True
+
+        with self._lock:
+            try:
+                with np.load(self.index_file) as data:
+                    if int(data['window']) != self.window or tuple(data['horizons']) != self.horizons:
+                        logging.warning("Analog index was built with different settings; rebuild required")
+                        return False
+                    self.embeddings = data['embeddings']
+                    self.symbols = data['symbols']
+                    self.end_dates = data['end_dates']
+                    self.end_closes = data['end_closes']
+                    self.forward_returns = data['forward_returns']
+                self._loaded_mtime = mtime
+                return True
+            except Exception as e:
+                logging.error(f"Error loading analog index: {e}")
+                return False
+
+    # Queries
+
+    def query(self, embedding: np.ndarray, k: int = 20, exclude_symbol: Optional[str] = None,
+              exclude_after: Optional[np.datetime64] = None) -> List[Dict]:
+        """The k most similar indexed windows to an embedding"""
+        self.load()
+        embeddings, symbols, end_dates = self.embeddings, self.symbols, self.end_dates
+        if len(embeddings) == 0:
+            return []
+
+        similarity = embeddings @ embedding.astype(np.float32)
+        if exclude_symbol is not None and exclude_after is not None:
+            # Windows overlapping the query window are the query itself, not analogs
+            similarity[(symbols == exclude_symbol) & (end_dates > exclude_after)] = -np.inf
+
+        k = min(k, len(similarity))
+        top = np.argpartition(-similarity, k - 1)[:k]
+        top = top[np.argsort(-similarity[top])]
+
+        matches = []
+        for row in top:
+            if not np.isfinite(similarity[row]):
+                continue
+            matches.append({
+                'symbol': str(symbols[row]),
+                'end_date': str(end_dates[row]),
+                'similarity': float(similarity[row]),
+                'end_close': float(self.end_closes[row]),
+                'forward_returns': {
+                    f'{horizon}d': (None if np.isnan(value) else float(value))
+                    for horizon, value in zip(self.horizons, self.forward_returns[row])
+                }
+            })
+        return matches
+
+    def find_similar_setups(self, symbol: str, k: int = 20, hist: Optional[pd.DataFrame] = None) -> Dict:
+        """Most similar historical setups to a symbol's latest window, with their outcome statistics"""
+        self.load()
+        indexed = np.flatnonzero(self.symbols == symbol)
+        if hist is None and len(indexed):
+            # The symbol's latest window is already embedded in the index
+            row = indexed[np.argmax(self.end_dates[indexed])]
+            embedding, query_end = self.embeddings[row], self.end_dates[row]
+        else:
+            if hist is None:
+                hist = download_histories([symbol], "6mo").get(symbol)
+            embedded = self.embed_history(hist) if hist is not None and not hist.empty else {}
+            if not embedded:
+                return {'symbol': symbol, 'matches': [], 'outcomes': {}}
+            embedding, query_end = embedded['embeddings'][-1], embedded['end_dates'][-1]
+
+        exclude_after = query_end - np.timedelta64(2 * self.window, 'D')
+        matches = self.query(embedding, k, exclude_symbol=symbol, exclude_after=exclude_after)
+        return {
+            'symbol': symbol,
+            'window_end': str(query_end),
+            'matches': matches,
+            'outcomes': self.summarize_outcomes(matches)
+        }
+
+    def summarize_outcomes(self, matches: List[Dict]) -> Dict:
+        """Median forward return and hit rate across matches, per horizon"""
+        outcomes = {}
+        for horizon in self.horizons:
+            values = [m['forward_returns'][f'{horizon}d'] for m in matches
+                      if m['forward_returns'][f'{horizon}d'] is not None]
+            if values:
+                outcomes[f'{horizon}d'] = {
+                    'median_return': float(np.median(values)),
+                    'win_rate': float(np.mean(np.array(values) > 0)),
+                    'samples': len(values)
+                }
+        return outcomes
+
+    def get_stats(self) -> Dict:
+        self.load()
+        return {
+            'windows': int(len(self.symbols)),
+            'symbols': int(len(np.unique(self.symbols))),
+            'window_length': self.window,
+            'latest_window': str(self.end_dates.max()) if len(self.end_dates) else None,
+            'updated_at': datetime.fromtimestamp(self._loaded_mtime).isoformat() if self._loaded_mtime else None
+        }
+
+# Global instance
+analog_index = AnalogIndex()
+
+if __name__ == "__main__":
+    # Offline build over the scanner's market universe
+    from stock_scanner import StockScanner
+    logging.basicConfig(level=logging.INFO)
+    analog_index.build(StockScanner().get_comprehensive_market_universe(1000))
@@ -4,208 +4,341 @@ Continuously scans entire US stock market in background without affecting site p
 """
 
 import threading
-import time
 import logging
 import queue
 from datetime import datetime, timedelta
 from market_data_engine import MarketDataEngine
 from stock_scanner import StockScanner
+from leader_election import LeaderElection
+from scan_journal import ScanJournal
+from scan_scheduler import scan_scheduler, ScanJob, next_time_at, OVERLAP_SKIP, OVERLAP_COALESCE
+from analog_index import analog_index
+from historical_comparison_engine import historical_comparison_engine
+from fundamentals_cache import fundamentals_cache
+from forecasting_engine import ForecastingEngine
+from pattern_evolution_tracker import PatternEvolutionTracker
 import json
 import os
+import hashlib
+from types import MappingProxyType
+
+class ResultsSnapshot:
+    """Immutable, versioned view of all scan results; replaced wholesale, never mutated in place"""
+    
+    def __init__(self, version: int, results: dict, etags: dict):
+        self.version = version
+        self.results = MappingProxyType(results)
+        self.etags = MappingProxyType(etags)
+        self.created_at = datetime.now()
+        
+        # Content-derived so every worker process agrees on the tag for the same results
+        combined = '|'.join(f"{key}:{etags[key]}" for key in sorted(etags))
+        self.etag = hashlib.sha1(combined.encode('utf-8')).hexdigest()
+    
+    @staticmethod
+    def entry_etag(entry: dict) -> str:
+        return hashlib.sha1(json.dumps(entry, sort_keys=True, default=str).encode('utf-8')).hexdigest()
+    
+    def with_results(self, updates: dict) -> 'ResultsSnapshot':
+        """Copy-on-write: a new snapshot with the given scan entries replaced"""
+        results = dict(self.results)
+        etags = dict(self.etags)
+        for scan_key, entry in updates.items():
+            results[scan_key] = entry
+            etags[scan_key] = self.entry_etag(entry)
+        return ResultsSnapshot(self.version + 1, results, etags)
+    
+    def etag_for(self, scan_type: str = 'all') -> str:
+        if scan_type == 'all':
+            return self.etag
+        return self.etags.get(scan_type, 'empty')
 
 class BackgroundScanner:
     def __init__(self):
         self.market_engine = MarketDataEngine()
-        self.stock_scanner = StockScanner()
+        # Per-symbol analyses are shared with every other scheduled job
+        self.stock_scanner = StockScanner(shared_results=scan_scheduler.results)
+        self.forecasting_engine = ForecastingEngine()
+        self.pattern_tracker = PatternEvolutionTracker()
         self.is_running = False
         self.scan_queue = queue.Queue()
-        self.results_cache = {}
         self.last_full_scan = None
         
+        # Readers take self.snapshot without locking; writers build a new snapshot
+        # under the publish lock and swap the reference in one assignment
+        self.snapshot = ResultsSnapshot(0, {}, {})
+        self._publish_lock = threading.Lock()
+        
         # Scan intervals (in seconds)
         self.quick_scan_interval = 60  # 1 minute
         self.market_scan_interval = 300  # 5 minutes
         self.full_scan_interval = 1800  # 30 minutes
         
-        # Results storage
-        self.results_file = "scan_results.json"
+        self.market_segments = ['large_cap', 'tech', 'small_cap', 'biotech', 'crypto']
+        self.segment_index = 0
+        
+        # Results storage: append-only journal, latest snapshot per scan type indexed for O(1) loads
+        self.journal = ScanJournal()
+        self.legacy_results_file = "scan_results.json"
+        self.journal_mtime = None
         self.load_cached_results()
         
+        # Only the elected leader process scans; followers read the shared journal
+        self.leader = LeaderElection()
+        
         logging.info("Background Scanner initialized")
     
+    @property
+    def results_cache(self):
+        """Read-only mapping of the current snapshot's scan results"""
+        return self.snapshot.results
+    
+    def publish_results(self, updates: dict) -> ResultsSnapshot:
+        """Publish a new snapshot with the given scan entries; published entries must not be mutated"""
+        with self._publish_lock:
+            self.snapshot = self.snapshot.with_results(updates)
+            return self.snapshot
+    
     def load_cached_results(self):
-        """Load previously cached scan results"""
+        """Load the latest journaled snapshot for every scan type"""
         try:
-            if os.path.exists(self.results_file):
-                with open(self.results_file, 'r') as f:
-                    self.results_cache = json.load(f)
-                logging.info(f"Loaded {len(self.results_cache)} cached scan results")
+            self.journal_mtime = self.journal.index_mtime()
+            self.publish_results(self.journal.load_latest())
+            
+            if not self.results_cache and os.path.exists(self.legacy_results_file):
+                self._import_legacy_results()
+            
+            self._update_last_full_scan()
+            logging.info(f"Loaded {len(self.results_cache)} cached scan results")
         except Exception as e:
             logging.warning(f"Could not load cached results: {e}")
-            self.results_cache = {}
     
-    def save_results(self):
-        """Save scan results to file"""
+    def _import_legacy_results(self):
+        """Serve the old single-file scan_results.json until the leader journals fresh scans"""
+        with open(self.legacy_results_file, 'r') as f:
+            self.publish_results(json.load(f))
+        logging.info(f"Loaded {len(self.results_cache)} scan results from {self.legacy_results_file}")
+    
+    def _update_last_full_scan(self):
+        full_scan = self.results_cache.get('full_scan', {})
+        if full_scan.get('timestamp'):
+            self.last_full_scan = datetime.fromisoformat(full_scan['timestamp'])
+    
+    def refresh_from_store(self):
+        """Follower processes pick up snapshots the leader has journaled since the last read"""
+        if self.leader.is_leader:
+            return
+        try:
+            mtime = self.journal.index_mtime()
+            if mtime is None or mtime == self.journal_mtime:
+                return
+            self.publish_results(self.journal.load_latest())
+            self.journal_mtime = mtime
+            self._update_last_full_scan()
+        except Exception as e:
+            logging.debug(f"Could not refresh shared scan results: {e}")
+    
+    def save_results(self, scan_key: str):
+        """Append the latest snapshot for a scan type to the results journal"""
         try:
-            with open(self.results_file, 'w') as f:
-                json.dump(self.results_cache, f)
+            self.journal.append(scan_key, self.snapshot.results[scan_key])
         except Exception as e:
-            logging.error(f"Could not save scan results: {e}")
+            logging.error(f"Could not save {scan_key} results: {e}")
     
     def start_background_scanning(self):
-        """Start background scanning threads"""
+        """Start background scanning if this process wins the leader election"""
         if self.is_running:
             return
         
         self.is_running = True
         
-        # Start different scanning threads
-        quick_thread = threading.Thread(target=self._quick_scan_loop, daemon=True)
-        market_thread = threading.Thread(target=self._market_scan_loop, daemon=True)
-        full_thread = threading.Thread(target=self._full_scan_loop, daemon=True)
+        if self.leader.try_acquire():
+            self._start_scan_threads()
+        else:
+            logging.info(f"Scanner leader is process {self.leader.current_leader_pid()}; "
+                         f"this worker will serve shared scan results")
+            self.leader.wait_for_leadership(self._start_scan_threads)
+    
+    def _start_scan_threads(self):
+        """Register the background scan jobs with the shared scheduler in the leader process"""
+        if not self.is_running:
+            return
         
-        quick_thread.start()
-        market_thread.start()
-        full_thread.start()
+        scan_scheduler.register(ScanJob(
+            'quick_scan', self._quick_scan_job, self.quick_scan_interval,
+            satisfied_by=['forced_quick_scan'], cost=50, overlap=OVERLAP_SKIP
+        ))
+        scan_scheduler.register(ScanJob(
+            'market_scan', self._market_scan_job, self.market_scan_interval,
+            cost=40, overlap=OVERLAP_SKIP
+        ))
+        scan_scheduler.register(ScanJob(
+            'full_scan', self._full_scan_job, self.full_scan_interval,
+            satisfied_by=['forced_comprehensive_scan'], cost=220, overlap=OVERLAP_COALESCE
+        ))
+        # Extend the analog index with the day's bars once the session has closed
+        scan_scheduler.register(ScanJob(
+            'analog_index_update', analog_index.update, 24 * 60 * 60,
+            cost=1, first_run=next_time_at(16, 30), overlap=OVERLAP_SKIP
+        ))
+        # Bulk-refresh ticker.info fundamentals before the open, when the provider is quiet
+        scan_scheduler.register(ScanJob(
+            'fundamentals_refresh', fundamentals_cache.refresh, 24 * 60 * 60,
+            cost=1, first_run=next_time_at(5, 0), overlap=OVERLAP_SKIP
+        ))
+        # Refresh the historical comparison feature store and the outcomes that have become known
+        scan_scheduler.register(ScanJob(
+            'historical_features_update', historical_comparison_engine.update, 24 * 60 * 60,
+            cost=1, first_run=next_time_at(16, 40), overlap=OVERLAP_SKIP
+        ))
+        # Re-simulate stored forecasts from the closing bar so forecast pages never compute inline
+        scan_scheduler.register(ScanJob(
+            'forecast_batch', self.forecasting_engine.update_stored_forecasts, 24 * 60 * 60,
+            cost=1, first_run=next_time_at(16, 20), overlap=OVERLAP_SKIP
+        ))
+        # Universe pattern scan served by /api/patterns/universe-scan
+        scan_scheduler.register(ScanJob(
+            'pattern_universe_scan', self.pattern_tracker.update_universe_scan, 24 * 60 * 60,
+            cost=1, first_run=next_time_at(16, 50), overlap=OVERLAP_SKIP
+        ))
+        scan_scheduler.start()
         
         logging.info("Background scanning started")
     
     def stop_background_scanning(self):
         """Stop background scanning"""
         self.is_running = False
-        self.save_results()
+        for job_name in ('quick_scan', 'market_scan', 'full_scan', 'analog_index_update',
+                         'historical_features_update', 'fundamentals_refresh', 'forecast_batch',
+                         'pattern_universe_scan'):
+            scan_scheduler.unregister(job_name)
+        if self.leader.is_leader:
+            self.leader.release()
         logging.info("Background scanning stopped")
     
-    def _quick_scan_loop(self):
+    def _quick_scan_job(self):
         """Quick scan of high-volume stocks every minute"""
-        while self.is_running:
-            try:
-                # Scan top 50 most active stocks
-                results = self.market_engine.quick_market_scan(50)
-                
-                # Filter for interesting stocks
-                filtered_results = []
-                for stock in results:
-                    if (abs(stock.get('price_change', 0)) > 2 or 
-                        stock.get('volume_spike', 0) > 1.5):
-                        filtered_results.append(stock)
-                
-                # Update cache
-                self.results_cache['quick_scan'] = {
-                    'timestamp': datetime.now().isoformat(),
-                    'results': filtered_results,
-                    'total_scanned': len(results)
-                }
-                
-                logging.info(f"Quick scan completed: {len(filtered_results)} interesting stocks found")
-                
-            except Exception as e:
-                logging.error(f"Quick scan error: {e}")
-            
-            time.sleep(self.quick_scan_interval)
+        # Scan top 50 most active stocks
+        results = self.market_engine.quick_market_scan(50)
+        
+        # Filter for interesting stocks
+        filtered_results = []
+        for stock in results:
+            if (abs(stock.get('price_change', 0)) > 2 or 
+                stock.get('volume_spike', 0) > 1.5):
+                filtered_results.append(stock)
+        
+        # Update cache
+        scan_key = 'quick_scan'
+        snapshot = self.publish_results({scan_key: {
+            'timestamp': datetime.now().isoformat(),
+            'results': filtered_results,
+            'total_scanned': len(results)
+        }})
+        
+        self.save_results(scan_key)
+        
+        logging.info(f"Quick scan completed: {len(filtered_results)} interesting stocks found")
+        return snapshot.results[scan_key]
     
-    def _market_scan_loop(self):
-        """Market segment scan every 5 minutes"""
-        segments = ['large_cap', 'tech', 'small_cap', 'biotech', 'crypto']
-        segment_index = 0
-        
-        while self.is_running:
-            try:
-                current_segment = segments[segment_index]
-                results = self.market_engine.scan_market_segment(current_segment, 100)
-                
-                # Analyze with stock scanner
-                analyzed_results = []
-                for stock_data in results[:20]:  # Limit to prevent overload
-                    symbol = stock_data['symbol']
-                    analysis = self.stock_scanner.analyze_stock(symbol)
-                    if analysis and analysis.get('confidence_score', 0) > 25:
-                        analyzed_results.append(analysis)
-                
-                # Update cache
-                self.results_cache[f'{current_segment}_scan'] = {
-                    'timestamp': datetime.now().isoformat(),
-                    'results': analyzed_results,
-                    'total_scanned': len(results)
-                }
-                
-                logging.info(f"{current_segment} scan completed: {len(analyzed_results)} opportunities found")
-                
-                # Move to next segment
-                segment_index = (segment_index + 1) % len(segments)
-                
-            except Exception as e:
-                logging.error(f"Market scan error: {e}")
-            
-            time.sleep(self.market_scan_interval)
+    def _market_scan_job(self):
+        """Market segment scan every 5 minutes, rotating through segments"""
+        current_segment = self.market_segments[self.segment_index]
+        results = self.market_engine.scan_market_segment(current_segment, 100)
+        
+        # Analyze with stock scanner
+        analyzed_results = []
+        for stock_data in results[:20]:  # Limit to prevent overload
+            symbol = stock_data['symbol']
+            analysis = self.stock_scanner.analyze_stock(symbol)
+            if analysis and analysis.get('confidence_score', 0) > 25:
+                analyzed_results.append(analysis)
+        
+        # Update cache
+        scan_key = f'{current_segment}_scan'
+        snapshot = self.publish_results({scan_key: {
+            'timestamp': datetime.now().isoformat(),
+            'results': analyzed_results,
+            'total_scanned': len(results)
+        }})
+        
+        self.save_results(scan_key)
+        
+        logging.info(f"{current_segment} scan completed: {len(analyzed_results)} opportunities found")
+        
+        # Move to next segment
+        self.segment_index = (self.segment_index + 1) % len(self.market_segments)
+        return snapshot.results[scan_key]
     
-    def _full_scan_loop(self):
+    def _full_scan_job(self):
         """Full market scan every 30 minutes"""
-        while self.is_running:
-            try:
-                # Comprehensive market scan
-                all_movers = self.market_engine.get_market_movers("comprehensive")
-                
-                # Get top opportunities from each category
-                top_gainers = all_movers['gainers'][:10]
-                top_losers = all_movers['losers'][:10]
-                volume_leaders = all_movers['volume_leaders'][:10]
-                
-                # Combine and analyze top picks
-                top_picks = []
-                all_candidates = top_gainers + volume_leaders
-                
-                for stock_data in all_candidates:
-                    symbol = stock_data['symbol']
-                    analysis = self.stock_scanner.analyze_stock(symbol)
-                    if analysis and analysis.get('confidence_score', 0) > 30:
-                        top_picks.append(analysis)
-                
-                # Sort by confidence
-                top_picks.sort(key=lambda x: x.get('confidence_score', 0), reverse=True)
-                
-                # Update cache
-                self.results_cache['full_scan'] = {
-                    'timestamp': datetime.now().isoformat(),
-                    'top_picks': top_picks[:15],
-                    'market_movers': {
-                        'gainers': top_gainers,
-                        'losers': top_losers,
-                        'volume_leaders': volume_leaders
-                    },
-                    'total_scanned': all_movers['total_scanned']
-                }
-                
-                self.last_full_scan = datetime.now()
-                
-                # Save results to file
-                self.save_results()
-                
-                logging.info(f"Full scan completed: {len(top_picks)} top picks identified from {all_movers['total_scanned']} stocks")
-                
-            except Exception as e:
-                logging.error(f"Full scan error: {e}")
-            
-            time.sleep(self.full_scan_interval)
+        # Comprehensive market scan
+        all_movers = self.market_engine.get_market_movers("comprehensive")
+        
+        # Get top opportunities from each category
+        top_gainers = all_movers['gainers'][:10]
+        top_losers = all_movers['losers'][:10]
+        volume_leaders = all_movers['volume_leaders'][:10]
+        
+        # Combine and analyze top picks
+        top_picks = []
+        all_candidates = top_gainers + volume_leaders
+        
+        for stock_data in all_candidates:
+            symbol = stock_data['symbol']
+            analysis = self.stock_scanner.analyze_stock(symbol)
+            if analysis and analysis.get('confidence_score', 0) > 30:
+                top_picks.append(analysis)
+        
+        # Sort by confidence
+        top_picks.sort(key=lambda x: x.get('confidence_score', 0), reverse=True)
+        
+        # Update cache
+        snapshot = self.publish_results({'full_scan': {
+            'timestamp': datetime.now().isoformat(),
+            'top_picks': top_picks[:15],
+            'market_movers': {
+                'gainers': top_gainers,
+                'losers': top_losers,
+                'volume_leaders': volume_leaders
+            },
+            'total_scanned': all_movers.get('total_scanned', 0)
+        }})
+        
+        self.last_full_scan = datetime.now()
+        
+        # Journal the snapshot and fold closed segments together
+        self.save_results('full_scan')
+        self.journal.compact()
+        
+        logging.info(f"Full scan completed: {len(top_picks)} top picks identified from {all_movers.get('total_scanned', 0)} stocks")
+        return snapshot.results['full_scan']
+    
+    def get_snapshot(self) -> ResultsSnapshot:
+        """Current results snapshot, refreshed from the shared journal in follower processes"""
+        self.refresh_from_store()
+        return self.snapshot
     
     def get_latest_results(self, scan_type: str = 'all'):
         """Get latest scan results"""
+        snapshot = self.get_snapshot()
         if scan_type == 'all':
-            return self.results_cache
+            return dict(snapshot.results)
         else:
-            return self.results_cache.get(scan_type, {})
+            return snapshot.results.get(scan_type, {})
     
-    def get_top_opportunities(self, limit: int = 10):
-        """Get current top trading opportunities"""
+    def get_top_opportunities(self, limit: int = 10, snapshot: ResultsSnapshot = None):
+        """Get current top trading opportunities, from the given snapshot when the caller already holds one"""
+        snapshot = snapshot or self.get_snapshot()
         opportunities = []
         
         # Get from full scan if available
-        full_scan = self.results_cache.get('full_scan', {})
+        full_scan = snapshot.results.get('full_scan', {})
         if full_scan and 'top_picks' in full_scan:
             opportunities.extend(full_scan['top_picks'])
         
         # Add from quick scan
-        quick_scan = self.results_cache.get('quick_scan', {})
+        quick_scan = snapshot.results.get('quick_scan', {})
         if quick_scan and 'results' in quick_scan:
             for stock in quick_scan['results']:
                 if stock['symbol'] not in [opp['symbol'] for opp in opportunities]:
@@ -220,23 +353,27 @@ class BackgroundScanner:
     
     def get_market_overview(self):
         """Get comprehensive market overview"""
+        snapshot = self.get_snapshot()
         overview = {
             'last_updated': datetime.now().isoformat(),
             'scan_status': 'active' if self.is_running else 'stopped',
+            'scan_role': 'leader' if self.leader.is_leader else 'follower',
             'total_opportunities': 0,
             'sectors_scanned': 0,
-            'last_full_scan': self.last_full_scan.isoformat() if self.last_full_scan else None
+            'last_full_scan': self.last_full_scan.isoformat() if self.last_full_scan else None,
+            'results_version': snapshot.version,
+            'results_etag': snapshot.etag
         }
         
         # Count opportunities across all scans
-        for scan_key, scan_data in self.results_cache.items():
+        for scan_key, scan_data in snapshot.results.items():
             if 'results' in scan_data:
                 overview['total_opportunities'] += len(scan_data['results'])
             elif 'top_picks' in scan_data:
                 overview['total_opportunities'] += len(scan_data['top_picks'])
         
         # Count scanned sectors
-        sector_scans = [key for key in self.results_cache.keys() if key.endswith('_scan')]
+        sector_scans = [key for key in snapshot.results.keys() if key.endswith('_scan')]
         overview['sectors_scanned'] = len(sector_scans)
         
         # Get cache stats
@@ -259,11 +396,13 @@ class BackgroundScanner:
                 scan_key = f'forced_{scan_type}_scan'
             
             # Store results
-            self.results_cache[scan_key] = {
+            snapshot = self.publish_results({scan_key: {
                 'timestamp': datetime.now().isoformat(),
                 'results': results,
                 'forced': True
-            }
+            }})
+            # Lets the matching scheduled scan skip its next run
+            scan_scheduler.results.put(scan_key, snapshot.results[scan_key])
             
             logging.info(f"Forced {scan_type} scan completed")
             return results
@@ -274,27 +413,34 @@ class BackgroundScanner:
     
     def clear_cache(self):
         """Clear all cached results"""
-        self.results_cache = {}
+        with self._publish_lock:
+            self.snapshot = ResultsSnapshot(self.snapshot.version + 1, {}, {})
         self.market_engine.clear_cache()
-        if os.path.exists(self.results_file):
-            os.remove(self.results_file)
+        # Journal history is kept for analysis; only the latest pointers are reset
+        self.journal.reset_latest()
+        if os.path.exists(self.legacy_results_file):
+            os.remove(self.legacy_results_file)
         logging.info("All caches cleared")
     
     def get_performance_stats(self):
         """Get scanner performance statistics"""
         stats = {
             'is_running': self.is_running,
+            'is_leader': self.leader.is_leader,
+            'leader_pid': self.leader.current_leader_pid(),
             'scan_intervals': {
                 'quick_scan': f"{self.quick_scan_interval}s",
                 'market_scan': f"{self.market_scan_interval}s", 
                 'full_scan': f"{self.full_scan_interval}s"
             },
             'cached_scans': len(self.results_cache),
+            'results_version': self.snapshot.version,
             'last_full_scan': self.last_full_scan.isoformat() if self.last_full_scan else 'Never'
         }
         
-        # Add market engine stats
+        # Add market engine and scheduler stats
         stats.update(self.market_engine.get_cache_stats())
+        stats['scheduler'] = scan_scheduler.get_stats()
         
         return stats
 
@@ -0,0 +1,236 @@
+"""
+Forecast Evaluation
+Walk-forward replay of ForecastingEngine over years of bars, scoring scenario probabilities and price bands
+"""
+
+import os
+import json
+import time
+import logging
+import zlib
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import ta
+from numpy.lib.stride_tricks import sliding_window_view
+
+from forecasting_engine import ForecastingEngine
+
+class ForecastEvaluator:
+    def __init__(self, engine: Optional[ForecastingEngine] = None, lookback: int = 63, step: int = 5,
+                 n_paths: int = 500, days: Optional[int] = None, seed: int = 0):
+        self.engine = engine or ForecastingEngine()
+        self.lookback = lookback  # bars the engine sees (3 months of dailies)
+        self.step = step  # bars between forecast origins
+        self.n_paths = n_paths
+        self.days = days or self.engine.forecast_days
+        self.seed = seed
+        self.path_types = self.engine.path_types
+        self.bands = {'p5-p95': ('p5', 'p95', 0.90), 'p25-p75': ('p25', 'p75', 0.50)}
+
+    # Per-symbol replay
+
+    def _origins(self, n: int) -> np.ndarray:
+        """Forecast origins with a full lookback behind them and the whole horizon realized after them"""
+        return np.arange(self.lookback - 1, n - self.days, self.step)
+
+    def rule_probabilities(self, rsi: np.ndarray, volume_ratio: np.ndarray, momentum: np.ndarray) -> np.ndarray:
+        """The retired rule-based path probabilities, for many origins at once; columns follow engine.path_types"""
+        # Sole copy of the rules ForecastingEngine used before Monte Carlo scenarios replaced them,
+        # kept as the baseline the simulated probabilities are scored against
+        raw = {
+            'momentum': np.select([(rsi < 70) & (volume_ratio > 1.5) & (momentum > 0), (rsi > 80) | (volume_ratio < 1)],
+                                  [0.4, 0.1], 0.25),
+            'breakdown': np.select([(rsi > 70) | (momentum < -0.02), rsi < 30], [0.4, 0.1], 0.25),
+            'retest': np.where((rsi > 30) & (rsi < 70) & (np.abs(momentum) > 0.01), 0.3, 0.2),
+            'sideways': np.where((rsi > 40) & (rsi < 60) & (np.abs(momentum) < 0.005), 0.4, 0.15)
+        }
+        probabilities = np.stack([raw[path_type] for path_type in self.path_types], axis=1)
+        return np.round(probabilities / probabilities.sum(axis=1, keepdims=True), 3)
+
+    def _one_hot(self, scenarios: np.ndarray) -> np.ndarray:
+        return np.stack([scenarios == path_type for path_type in self.path_types], axis=-1).astype(float)
+
+    def _simulate_bootstrap(self, log_returns: np.ndarray, origins: np.ndarray, rng) -> np.ndarray:
+        """Bootstrapped log-return paths for every origin in one draw: (origins, paths, days)"""
+        windows = sliding_window_view(log_returns, self.lookback - 1)[origins - (self.lookback - 1)]
+        picks = rng.integers(0, windows.shape[1], size=(len(origins), self.n_paths, self.days))
+        return np.take_along_axis(windows, picks.reshape(len(origins), -1), axis=1).reshape(picks.shape)
+
+    def _simulate_per_origin(self, hist: pd.DataFrame, origins: np.ndarray, rng) -> np.ndarray:
+        """Return models that carry volatility state (GARCH) are fitted and simulated origin by origin"""
+        draws = np.empty((len(origins), self.n_paths, self.days))
+        for row, t in enumerate(origins):
+            model = self.engine.fit_return_model(hist.iloc[t + 1 - self.lookback:t + 1])
+            draws[row], _ = self.engine.simulate_log_returns(model, rng, self.n_paths, self.days)
+        return draws
+
+    def evaluate_history(self, symbol: str, hist: pd.DataFrame) -> Optional[Dict[str, np.ndarray]]:
+        """Predicted probabilities, realized scenarios and band hits for every origin of one symbol"""
+        closes = hist['Close'].values.astype(float)
+        volumes = hist['Volume'].values.astype(float)
+        origins = self._origins(len(closes))
+        if not len(origins):
+            return None
+
+        rng = np.random.default_rng([self.seed, zlib.crc32(symbol.encode('utf-8'))])
+        log_returns = np.diff(np.log(closes))
+
+        # Scenario probabilities from the simulated distribution, as simulate_forecast derives them
+        if self.engine.simulation_method == 'garch':
+            draws = self._simulate_per_origin(hist, origins, rng)
+        else:
+            draws = self._simulate_bootstrap(log_returns, origins, rng)
+        start_prices = closes[origins]
+        paths = start_prices[:, None, None] * np.exp(np.cumsum(draws, axis=2))
+
+        window_returns = sliding_window_view(log_returns, self.lookback - 1)[origins - (self.lookback - 1)]
+        daily_volatility = window_returns.std(axis=1)
+        simulated = self._one_hot(self.engine.classify_scenarios(
+            paths, start_prices[:, None], daily_volatility[:, None])).mean(axis=1)
+
+        # What actually happened over the horizon, labelled by the same rule
+        realized_paths = sliding_window_view(closes[1:], self.days)[origins]
+        realized = self._one_hot(self.engine.classify_scenarios(realized_paths, start_prices, daily_volatility))
+
+        # The rule-based probabilities the page showed before the simulation engine, from the same indicator inputs
+        close_series = pd.Series(closes)
+        rsi = ta.momentum.rsi(close_series).values[origins]
+        average_volume = pd.Series(volumes).rolling(20).mean().shift(1).values[origins]
+        volume_ratio = np.where(average_volume > 0, volumes[origins] / np.where(average_volume > 0, average_volume, 1), 1.0)
+        momentum = close_series.pct_change().rolling(5).mean().values[origins]
+        rules = self.rule_probabilities(rsi, volume_ratio, momentum)
+
+        # Band coverage of the realized closes, day by day
+        quantiles = np.quantile(paths, [0.05, 0.25, 0.75, 0.95], axis=1)
+        band_hits = {
+            'p5-p95': (realized_paths >= quantiles[0]) & (realized_paths <= quantiles[3]),
+            'p25-p75': (realized_paths >= quantiles[1]) & (realized_paths <= quantiles[2])
+        }
+
+        return {
+            'simulated': simulated,
+            'rules': rules,
+            'realized': realized,
+            'band_hits': band_hits
+        }
+
+    def _evaluate_histories(self, histories: Dict) -> Dict[str, Dict[str, np.ndarray]]:
+        results = {}
+        for symbol, hist in histories.items():
+            try:
+                if hist is None or hist.empty:
+                    continue
+                result = self.evaluate_history(symbol, hist)
+                if result:
+                    results[symbol] = result
+            except Exception as e:
+                logging.error(f"Error evaluating forecasts for {symbol}: {e}")
+        return results
+
+    # Scoring
+
+    def brier_score(self, probabilities: np.ndarray, outcomes: np.ndarray) -> float:
+        """Multi-category Brier score: mean over origins of the squared error summed across scenarios"""
+        return float(np.mean(np.sum((probabilities - outcomes) ** 2, axis=1)))
+
+    def score(self, results: Dict[str, Dict[str, np.ndarray]]) -> Dict:
+        if not results:
+            return {'origins': 0}
+
+        simulated = np.concatenate([r['simulated'] for r in results.values()])
+        rules = np.concatenate([r['rules'] for r in results.values()])
+        realized = np.concatenate([r['realized'] for r in results.values()])
+        base_rate = np.full_like(realized, 1 / len(self.path_types))
+
+        coverage = {}
+        for band, (_, _, nominal) in self.bands.items():
+            hits = np.concatenate([r['band_hits'][band] for r in results.values()])
+            coverage[band] = {
+                'nominal': nominal,
+                'overall': round(float(hits.mean()), 3),
+                'by_day': [round(float(v), 3) for v in hits.mean(axis=0)]
+            }
+
+        scenarios = {}
+        for column, path_type in enumerate(self.path_types):
+            scenarios[path_type] = {
+                'realized_rate': round(float(realized[:, column].mean()), 3),
+                'mean_simulated_probability': round(float(simulated[:, column].mean()), 3),
+                'mean_rule_probability': round(float(rules[:, column].mean()), 3),
+                'brier_simulated': round(float(np.mean((simulated[:, column] - realized[:, column]) ** 2)), 4),
+                'brier_rules': round(float(np.mean((rules[:, column] - realized[:, column]) ** 2)), 4)
+            }
+
+        return {
+            'origins': int(len(realized)),
+            'brier_score': {
+                'simulated': round(self.brier_score(simulated, realized), 4),
+                'rules': round(self.brier_score(rules, realized), 4),
+                'uniform': round(self.brier_score(base_rate, realized), 4)
+            },
+            'scenarios': scenarios,
+            'band_coverage': coverage
+        }
+
+    # Entry point
+
+    def run(self, symbols: Optional[List[str]] = None, histories: Optional[Dict] = None,
+            period: str = "5y", workers: Optional[int] = None) -> Dict:
+        """Walk-forward evaluation over a universe"""
+        started = time.time()
+        if histories is None:
+            histories = self.engine.fetch_universe_history(symbols or [], period)
+        workers = workers if workers is not None else (os.cpu_count() or 1)
+
+        if workers > 1 and len(histories) > workers:
+            results = self._evaluate_parallel(histories, workers)
+        else:
+            results = self._evaluate_histories(histories)
+
+        report = self.score(results)
+        duration = time.time() - started
+        logging.info(f"Forecast evaluation: {report['origins']} forecasts over {len(results)} symbols in {duration:.1f}s")
+
+        return {
+            'symbols': len(results),
+            'days': self.days,
+            'step': self.step,
+            'n_paths': self.n_paths,
+            'method': self.engine.simulation_method,
+            **report,
+            'duration_seconds': round(duration, 2),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+
+    def _evaluate_parallel(self, histories: Dict, workers: int) -> Dict[str, Dict[str, np.ndarray]]:
+        """Shard the universe across a process pool"""
+        symbols = list(histories)
+        shards = [{symbol: histories[symbol] for symbol in symbols[k::workers]} for k in range(workers)]
+        settings = (self.engine.simulation_method, self.lookback, self.step, self.n_paths, self.days, self.seed)
+
+        results = {}
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for shard in executor.map(_evaluation_shard, shards, [settings] * workers):
+                    results.update(shard)
+        except Exception as e:
+            logging.error(f"Parallel forecast evaluation failed, evaluating in-process: {e}")
+            return self._evaluate_histories(histories)
+
+        return {symbol: results[symbol] for symbol in symbols if symbol in results}
+
+def _evaluation_shard(histories, settings):
+    """Process pool entry point: evaluate one shard of the universe"""
+    simulation_method, lookback, step, n_paths, days, seed = settings
+    evaluator = ForecastEvaluator(ForecastingEngine(simulation_method=simulation_method),
+                                  lookback=lookback, step=step, n_paths=n_paths, days=days, seed=seed)
+    return evaluator._evaluate_histories(histories)
+
+if __name__ == "__main__":
+    # Offline evaluation over the scanner's market universe
+    from stock_scanner import StockScanner
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(ForecastEvaluator().run(StockScanner().get_comprehensive_market_universe(500)), indent=2))
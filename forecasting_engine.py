@@ -4,54 +4,314 @@ import pandas as pd
 import ta
 from datetime import datetime, timedelta
 import logging
+import os
+import zlib
+import threading
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
+from market_data_engine import download_histories
 
 class ForecastingEngine:
-    def __init__(self):
+    def __init__(self, n_paths=2000, simulation_method='bootstrap'):
         self.forecast_days = 5
         self.path_types = ['momentum', 'retest', 'breakdown', 'sideways']
+        
+        # Monte Carlo settings
+        self.n_paths = n_paths
+        self.simulation_method = simulation_method  # 'bootstrap' or 'garch'
+        self.band_quantiles = [0.05, 0.25, 0.5, 0.75, 0.95]
+        self.garch_params = {'alpha': 0.08, 'beta': 0.90}  # GARCH(1,1) persistence; omega targets the sample variance
+        self.ewma_lambda = 0.94  # for filtering historical returns into standardized residuals
+        self.scenario_threshold = 0.5  # scenario cut-offs in units of the horizon's volatility
+        
+        # Simulations kept per symbol so further horizons slice or extend them instead of redrawing
+        self.max_cached_simulations = 64
+        self.simulation_ttl = 300  # seconds a simulation may be reused without checking for a newer bar
+        self._simulations = OrderedDict()
+        self._simulation_lock = threading.Lock()
     
-    def generate_spaghetti_model(self, symbol):
+    def generate_spaghetti_model(self, symbol, hist=None, seed=None):
         """Generate 3-5 probable price paths for the stock"""
+        forecast = self.simulate_forecast(symbol, hist=hist, seed=seed)
+        return forecast['paths'] if forecast else []
+    
+    def simulate_forecast(self, symbol, hist=None, days=None, n_paths=None, seed=None):
+        """Monte Carlo forecast: quantile bands, scenario probabilities and the four-path summary"""
+        days = days or self.forecast_days
+        forecast = self.simulate_horizons(symbol, [days], hist=hist, n_paths=n_paths, seed=seed)
+        if not forecast:
+            return None
+        
+        view = forecast.pop('horizons')[days]
+        return {**forecast, 'days': days, **view}
+    
+    def simulate_horizons(self, symbol, horizons, hist=None, n_paths=None, seed=None):
+        """Forecasts for several horizons sliced out of one simulation run"""
         try:
-            # Get stock data
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period="3mo")
-            
-            if hist.empty:
-                return []
-            
-            current_price = hist['Close'].iloc[-1]
+            horizons = sorted({int(h) for h in horizons if int(h) > 0})
+            if not horizons:
+                return None
             
-            # Calculate volatility and trend metrics
-            volatility = hist['Close'].pct_change().std() * np.sqrt(252)  # Annualized
+            simulation = self.get_simulation(symbol, max(horizons), hist=hist, n_paths=n_paths, seed=seed)
+            if simulation is None:
+                return None
             
-            # Generate paths
-            paths = []
+            current_price = simulation['current_price']
+            # One cumulative sum over the longest horizon; every shorter horizon is a column prefix of it
+            prices = current_price * np.exp(np.cumsum(simulation['log_returns'][:, :max(horizons)], axis=1))
             
-            # 1. Momentum Extension Path
-            momentum_path = self.generate_momentum_path(hist, current_price, volatility)
-            paths.append(momentum_path)
-            
-            # 2. Retest and Run Path
-            retest_path = self.generate_retest_path(hist, current_price, volatility)
-            paths.append(retest_path)
-            
-            # 3. Breakdown Path
-            breakdown_path = self.generate_breakdown_path(hist, current_price, volatility)
-            paths.append(breakdown_path)
-            
-            # 4. Sideways Fade Path
-            sideways_path = self.generate_sideways_path(hist, current_price, volatility)
-            paths.append(sideways_path)
-            
-            # Calculate probabilities based on current market conditions
-            paths = self.calculate_path_probabilities(paths, hist)
-            
-            return paths
+            return {
+                'symbol': symbol,
+                'current_price': round(current_price, 2),
+                'last_bar': simulation['last_bar'],
+                'n_paths': int(prices.shape[0]),
+                'seed': int(simulation['seed']),
+                'method': simulation['model']['method'],
+                'horizons': {days: self._horizon_view(simulation, prices[:, :days]) for days in horizons}
+            }
             
         except Exception as e:
             logging.error(f"Error generating spaghetti model for {symbol}: {e}")
-            return []
+            return None
+    
+    def _horizon_view(self, simulation, prices):
+        """Bands, scenario probabilities and the four-path summary for one horizon's price block"""
+        current_price = simulation['current_price']
+        scenarios = self.classify_scenarios(prices, current_price, simulation['model']['daily_volatility'])
+        # The scripted fallback for an empty scenario draws from its own stream so it never shifts the simulation
+        paths = self.summarize_scenarios(simulation['hist'], prices, scenarios, current_price,
+                                         np.random.default_rng(simulation['seed']))
+        
+        final_returns = prices[:, -1] / current_price - 1
+        return {
+            'bands': self.quantile_bands(prices),
+            'scenario_probabilities': {path['type']: path['probability'] for path in paths},
+            'expected_return': round(float(final_returns.mean()), 4),
+            'probability_up': round(float((final_returns > 0).mean()), 3),
+            'paths': paths
+        }
+    
+    def get_simulation(self, symbol, days, hist=None, n_paths=None, seed=None):
+        """Cached simulation for the symbol's latest bar covering at least `days`, drawing or extending as needed"""
+        n_paths = n_paths or self.n_paths
+        with self._simulation_lock:
+            simulation = self._simulations.get(symbol)
+        
+        if simulation is not None and hist is None and seed in (None, simulation['seed']):
+            # Reuse without a download while the cached draw is for the latest session
+            if simulation['n_paths'] == n_paths and (datetime.now() - simulation['created']).total_seconds() < self.simulation_ttl:
+                return self.extend_simulation(symbol, days - simulation['days']) if days > simulation['days'] else simulation
+        
+        if hist is None:
+            ticker = yf.Ticker(symbol)
+            hist = ticker.history(period="3mo")
+        if hist.empty or len(hist) < 10:
+            return None
+        
+        last_bar = hist.index[-1].isoformat()
+        seed = self.default_seed(symbol, hist) if seed is None else seed
+        if (simulation is not None and simulation['last_bar'] == last_bar and simulation['seed'] == seed
+                and simulation['n_paths'] == n_paths and simulation['model']['method'] == self.simulation_method):
+            return self.extend_simulation(symbol, days - simulation['days']) if days > simulation['days'] else simulation
+        
+        model = self.fit_return_model(hist)
+        rng = np.random.default_rng(seed)
+        log_returns, variance = self.simulate_log_returns(model, rng, n_paths, days)
+        simulation = {
+            'symbol': symbol,
+            'last_bar': last_bar,
+            'seed': seed,
+            'n_paths': n_paths,
+            'days': days,
+            'current_price': float(hist['Close'].iloc[-1]),
+            'hist': hist.tail(30),  # enough for the support/resistance levels in the summary
+            'model': model,
+            'rng': rng,
+            'variance': variance,
+            'log_returns': log_returns,
+            'created': datetime.now()
+        }
+        
+        with self._simulation_lock:
+            self._simulations[symbol] = simulation
+            self._simulations.move_to_end(symbol)
+            while len(self._simulations) > self.max_cached_simulations:
+                self._simulations.popitem(last=False)
+        return simulation
+    
+    def extend_simulation(self, symbol, days):
+        """Append `days` more steps to a cached simulation, continuing its random stream and volatility state"""
+        with self._simulation_lock:
+            simulation = self._simulations.get(symbol)
+            if simulation is None:
+                return None
+            if days <= 0:
+                return simulation
+            
+            log_returns, variance = self.simulate_log_returns(
+                simulation['model'], simulation['rng'], simulation['n_paths'], days, simulation['variance']
+            )
+            # Replace rather than mutate so readers holding the previous dict keep a consistent view
+            simulation = {
+                **simulation,
+                'log_returns': np.concatenate((simulation['log_returns'], log_returns), axis=1),
+                'variance': variance,
+                'days': simulation['days'] + days
+            }
+            self._simulations[symbol] = simulation
+            return simulation
+    
+    def fetch_universe_history(self, symbols, period="3mo"):
+        """Download daily bars for every symbol in batched requests"""
+        return download_histories(symbols, period)
+    
+    def forecast_universe(self, symbols=None, histories=None, workers=None, period="3mo"):
+        """Simulate forecasts for many symbols from one batched download, sharded across a process pool"""
+        if histories is None:
+            histories = self.fetch_universe_history(symbols, period)
+        workers = workers if workers is not None else (os.cpu_count() or 1)
+        
+        if workers > 1 and len(histories) > workers:
+            symbols = list(histories)
+            shards = [{symbol: histories[symbol] for symbol in symbols[k::workers]} for k in range(workers)]
+            settings = (self.n_paths, self.simulation_method)
+            try:
+                forecasts = {}
+                with ProcessPoolExecutor(max_workers=workers) as executor:
+                    for result in executor.map(_forecast_shard, shards, [settings] * workers):
+                        forecasts.update(result)
+                return forecasts
+            except Exception as e:
+                logging.error(f"Parallel forecasting failed, forecasting in-process: {e}")
+        
+        return self._forecast_histories(histories)
+    
+    def _forecast_histories(self, histories):
+        forecasts = {}
+        for symbol, hist in histories.items():
+            forecast = self.simulate_forecast(symbol, hist=hist)
+            if forecast:
+                forecasts[symbol] = forecast
+        return forecasts
+    
+    def forecast_symbols(self, scan_lookback_days=2):
+        """Tracked stocks plus everything the scanners surfaced recently (requires an application context)"""
+        from models import Stock, ScanResult
+        
+        since = datetime.utcnow() - timedelta(days=scan_lookback_days)
+        tracked = [row.symbol for row in Stock.query.with_entities(Stock.symbol).filter(Stock.is_tracked.is_(True))]
+        scanned = [row.symbol for row in ScanResult.query.with_entities(ScanResult.symbol)
+                   .filter(ScanResult.created_at >= since).distinct()]
+        return sorted(set(tracked) | set(scanned))
+    
+    def store_forecasts(self, forecasts):
+        """Bulk-write forecasts to forecast_paths, replacing each symbol's previous paths"""
+        from models import ForecastPath
+        
+        rows = [row for forecast in forecasts.values() for row in ForecastPath.rows_from_forecast(forecast)]
+        return ForecastPath.bulk_upsert(rows)
+    
+    def update_stored_forecasts(self, symbols=None, workers=None):
+        """Batch job: forecast every tracked and recently scanned symbol from the latest bars and store the results"""
+        from app import app
+        
+        try:
+            with app.app_context():
+                symbols = symbols if symbols is not None else self.forecast_symbols()
+                forecasts = self.forecast_universe(symbols, workers=workers)
+                stored = self.store_forecasts(forecasts)
+            logging.info(f"Stored forecasts for {len(forecasts)} of {len(symbols)} symbols ({stored} paths)")
+            return {'symbols': len(symbols), 'forecasts': len(forecasts), 'paths': stored}
+        except Exception as e:
+            logging.error(f"Error updating stored forecasts: {e}")
+            return None
+    
+    def default_seed(self, symbol, hist):
+        """Stable seed per symbol and last bar, so the same data always draws the same paths"""
+        return zlib.crc32(f"{symbol}:{hist.index[-1].date().isoformat()}".encode('utf-8'))
+    
+    def fit_return_model(self, hist):
+        """Historical log returns plus the volatility state needed to simulate from them"""
+        log_returns = np.diff(np.log(hist['Close'].values.astype(float)))
+        log_returns = log_returns[np.isfinite(log_returns)]
+        sample_variance = max(float(log_returns.var()), 1e-12)
+        
+        # EWMA variance filter: residuals are returns divided by the volatility prevailing when they happened
+        variances = np.empty(len(log_returns))
+        variance = sample_variance
+        for t, r in enumerate(log_returns):
+            variances[t] = variance
+            variance = self.ewma_lambda * variance + (1 - self.ewma_lambda) * r * r
+        residuals = (log_returns - log_returns.mean()) / np.sqrt(variances)
+        
+        return {
+            'method': self.simulation_method,
+            'returns': log_returns,
+            'mean': float(log_returns.mean()),
+            'residuals': residuals,
+            'variance': variance,
+            'sample_variance': sample_variance,
+            'daily_volatility': float(np.sqrt(sample_variance))
+        }
+    
+    def simulate_log_returns(self, model, rng, n_paths, days, variance=None):
+        """Draw an (n_paths, days) block of daily log returns; returns it with each path's closing variance"""
+        # Draws are laid out day-major, so extending a simulation consumes the stream exactly as one longer draw would
+        if model['method'] != 'garch':
+            # Plain bootstrap: every step resampled from the observed returns in one call
+            return rng.choice(model['returns'], size=(days, n_paths)).T, None
+        
+        # Filtered historical simulation: bootstrapped residuals scaled by a GARCH(1,1) variance recursion
+        alpha, beta = self.garch_params['alpha'], self.garch_params['beta']
+        omega = model['sample_variance'] * (1 - alpha - beta)
+        shocks = rng.choice(model['residuals'], size=(days, n_paths)).T
+        variance = np.full(n_paths, model['variance']) if variance is None else variance.copy()
+        
+        log_returns = np.empty((n_paths, days))
+        for day in range(days):
+            log_returns[:, day] = model['mean'] + np.sqrt(variance) * shocks[:, day]
+            variance = omega + alpha * (log_returns[:, day] - model['mean']) ** 2 + beta * variance
+        return log_returns, variance
+    
+    def quantile_bands(self, prices):
+        """Per-day price quantiles across the simulated paths"""
+        quantiles = np.quantile(prices, self.band_quantiles, axis=0)
+        return {f"p{int(q * 100)}": [round(float(v), 2) for v in values]
+                for q, values in zip(self.band_quantiles, quantiles)}
+    
+    def classify_scenarios(self, prices, current_price, daily_volatility):
+        """Label each path momentum, retest, breakdown or sideways from its final move and deepest pullback"""
+        horizon_move = self.scenario_threshold * daily_volatility * np.sqrt(prices.shape[-1])
+        final_return = np.log(prices[..., -1] / current_price)
+        pullback = np.log(np.minimum(prices.min(axis=-1), current_price) / current_price)
+        
+        scenarios = np.full(final_return.shape, 'sideways', dtype=object)
+        scenarios[final_return < -horizon_move] = 'breakdown'
+        scenarios[(final_return > 0) & (pullback <= -horizon_move)] = 'retest'
+        scenarios[(final_return > horizon_move) & (pullback > -horizon_move)] = 'momentum'
+        return scenarios
+    
+    def summarize_scenarios(self, hist, prices, scenarios, current_price, rng=None):
+        """The four-path view: each scenario's share of paths and its median path as the targets"""
+        volatility = hist['Close'].pct_change().std() * np.sqrt(252)  # Annualized
+        
+        paths = [
+            self.generate_momentum_path(hist, current_price, volatility),
+            self.generate_retest_path(hist, current_price, volatility),
+            self.generate_breakdown_path(hist, current_price, volatility),
+            self.generate_sideways_path(hist, current_price, volatility, rng)
+        ]
+        
+        for path in paths:
+            members = prices[scenarios == path['type']]
+            path['probability'] = round(len(members) / len(prices), 3)
+            if len(members):
+                path['targets'] = [round(float(v), 2) for v in np.median(members, axis=0)]
+            elif len(path['targets']) != prices.shape[1]:
+                path['targets'] = [round(float(v), 2) for v in np.median(prices, axis=0)]
+            path['risk_zones'] = [round(float(v), 2) for v in path['risk_zones']]
+        
+        return paths
     
     def generate_momentum_path(self, hist, current_price, volatility):
         """Generate momentum extension scenario"""
@@ -126,15 +386,16 @@ class ForecastingEngine:
             'description': 'Support breakdown with continued selling'
         }
     
-    def generate_sideways_path(self, hist, current_price, volatility):
+    def generate_sideways_path(self, hist, current_price, volatility, rng=None):
         """Generate sideways consolidation scenario"""
         targets = []
         price = current_price
+        rng = rng or np.random.default_rng()
         
         # Create oscillating pattern around current price
         for day in range(self.forecast_days):
             # Random walk with mean reversion
-            random_factor = np.random.uniform(-1, 1)
+            random_factor = rng.uniform(-1, 1)
             daily_move = volatility * 0.01 * random_factor * 0.5  # Reduced volatility
             price *= (1 + daily_move)
             targets.append(round(price, 2))
@@ -148,69 +409,6 @@ class ForecastingEngine:
             'description': 'Range-bound consolidation pattern'
         }
     
-    def calculate_path_probabilities(self, paths, hist):
-        """Calculate probabilities based on current market conditions"""
-        try:
-            # Calculate technical indicators
-            rsi = ta.momentum.RSIIndicator(hist['Close']).rsi().iloc[-1]
-            
-            # Volume analysis
-            avg_volume = hist['Volume'].rolling(20).mean().iloc[-2]
-            current_volume = hist['Volume'].iloc[-1]
-            volume_ratio = current_volume / avg_volume if avg_volume > 0 else 1
-            
-            # Price momentum
-            returns = hist['Close'].pct_change().dropna()
-            momentum = returns.rolling(5).mean().iloc[-1]
-            
-            # Adjust probabilities based on conditions
-            for path in paths:
-                if path['type'] == 'momentum':
-                    # Higher probability if RSI not overbought and good volume
-                    if rsi < 70 and volume_ratio > 1.5 and momentum > 0:
-                        path['probability'] = 0.4
-                    elif rsi > 80 or volume_ratio < 1:
-                        path['probability'] = 0.1
-                    else:
-                        path['probability'] = 0.25
-                        
-                elif path['type'] == 'breakdown':
-                    # Higher probability if RSI oversold or negative momentum
-                    if rsi > 70 or momentum < -0.02:
-                        path['probability'] = 0.4
-                    elif rsi < 30:
-                        path['probability'] = 0.1
-                    else:
-                        path['probability'] = 0.25
-                        
-                elif path['type'] == 'retest':
-                    # Higher probability in trending markets
-                    if 30 < rsi < 70 and abs(momentum) > 0.01:
-                        path['probability'] = 0.3
-                    else:
-                        path['probability'] = 0.2
-                        
-                elif path['type'] == 'sideways':
-                    # Higher probability in low volatility, neutral RSI
-                    if 40 < rsi < 60 and abs(momentum) < 0.005:
-                        path['probability'] = 0.4
-                    else:
-                        path['probability'] = 0.15
-            
-            # Normalize probabilities to sum to 1
-            total_prob = sum(path['probability'] for path in paths)
-            for path in paths:
-                path['probability'] = round(path['probability'] / total_prob, 3)
-            
-            return paths
-            
-        except Exception as e:
-            logging.error(f"Error calculating probabilities: {e}")
-            # Return equal probabilities if calculation fails
-            for path in paths:
-                path['probability'] = 0.25
-            return paths
-    
     def find_support_level(self, hist, current_price):
         """Find nearest support level"""
         try:
@@ -246,3 +444,8 @@ class ForecastingEngine:
         except Exception as e:
             logging.error(f"Error finding resistance level: {e}")
             return current_price * 1.05
+
+def _forecast_shard(histories, settings):
+    """Process pool entry point: forecast one shard of the universe"""
+    n_paths, simulation_method = settings
+    return ForecastingEngine(n_paths, simulation_method)._forecast_histories(histories)
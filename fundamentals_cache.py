@@ -0,0 +1,170 @@
+"""
+Fundamentals Cache
+Daily-refreshed ticker.info fundamentals in the database, so request paths never call the provider's info endpoint
+"""
+
+import math
+import time
+import logging
+import threading
+from datetime import datetime, timedelta
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+import yfinance as yf
+
+from scan_scheduler import provider_budget
+
+class FundamentalsCache:
+    def __init__(self, ttl_hours: int = 20, max_workers: int = 8, universe_size: int = 1000):
+        self.ttl = timedelta(hours=ttl_hours)  # a little under a day, so each nightly refresh picks every symbol up
+        self.max_workers = max_workers
+        self.universe_size = universe_size
+        self._queued = set()  # symbols this process has already queued, so repeated misses write once
+        self._queue_lock = threading.Lock()
+
+    # Request path: database reads only
+
+    def get_many(self, symbols: List[str]) -> Dict[str, Dict]:
+        """{symbol: info-shaped dict} from the store; unknown symbols are queued for the next refresh and come back empty"""
+        from models import StockFundamentals
+
+        symbols = list(dict.fromkeys(symbols))
+        if not symbols:
+            return {}
+        try:
+            records = StockFundamentals.for_symbols(symbols)
+            missing = [symbol for symbol in symbols if symbol not in records]
+            if missing:
+                self._queue_missing(missing)
+            return {symbol: records[symbol].to_info() if symbol in records else {} for symbol in symbols}
+        except Exception as e:
+            logging.error(f"Error reading cached fundamentals: {e}")
+            return {symbol: {} for symbol in symbols}
+
+    def get(self, symbol: str) -> Dict:
+        return self.get_many([symbol]).get(symbol, {})
+
+    def _queue_missing(self, symbols: List[str]):
+        """Placeholder rows with no fetch time, which the refresh treats as stale"""
+        from app import db
+        from models import StockFundamentals
+
+        with self._queue_lock:
+            symbols = [symbol for symbol in symbols if symbol not in self._queued]
+            self._queued.update(symbols)
+        if not symbols:
+            return
+
+        # Own connection and transaction, so a miss never commits or rolls back the request's session
+        try:
+            with db.engine.begin() as connection:
+                connection.execute(StockFundamentals.__table__.insert(),
+                                   [{'symbol': symbol, 'fetched_at': None} for symbol in symbols])
+        except Exception as e:
+            # e.g. another process queued the same symbol first; a later miss retries
+            with self._queue_lock:
+                self._queued.difference_update(symbols)
+            logging.warning(f"Could not queue fundamentals for {symbols}: {e}")
+
+    # Off-peak refresh
+
+    def row_from_info(self, symbol: str, info: Dict) -> Dict:
+        """Column values from a ticker.info payload; non-numeric or non-finite numbers are stored as None"""
+        from models import StockFundamentals
+
+        def number(value):
+            try:
+                value = float(value)
+            except (TypeError, ValueError):
+                return None
+            return value if math.isfinite(value) else None
+
+        row = {'symbol': symbol, 'fetched_at': datetime.utcnow()}
+        for key, column in StockFundamentals.info_fields.items():
+            value = info.get(key)
+            if column == 'name':
+                row[column] = (value or info.get('shortName') or None)
+                row[column] = row[column][:200] if row[column] else None
+            elif column in ('sector', 'industry'):
+                row[column] = value[:50 if column == 'sector' else 100] if isinstance(value, str) and value else None
+            elif column == 'current_price':
+                row[column] = number(value if value is not None else info.get('regularMarketPrice'))
+            else:
+                row[column] = number(value)
+        if row['market_cap'] is not None:
+            row['market_cap'] = int(row['market_cap'])
+        return row
+
+    def fetch_fundamentals(self, symbol: str) -> Optional[Dict]:
+        """One ticker.info lookup under the provider budget"""
+        try:
+            provider_budget.acquire()
+            info = yf.Ticker(symbol).info
+            return self.row_from_info(symbol, info) if info else None
+        except Exception as e:
+            logging.warning(f"Error fetching fundamentals for {symbol}: {e}")
+            return None
+
+    def refresh_symbols(self) -> List[str]:
+        """Stale, never-fetched and queued symbols, plus the scan universe and tracked stocks not stored yet"""
+        from models import StockFundamentals, Stock
+        from stock_scanner import StockScanner
+
+        cutoff = datetime.utcnow() - self.ttl
+        fresh = {symbol for (symbol,) in StockFundamentals.query.with_entities(StockFundamentals.symbol)
+                 .filter(StockFundamentals.fetched_at >= cutoff).all()}
+        stored = {symbol for (symbol,) in StockFundamentals.query.with_entities(StockFundamentals.symbol).all()}
+        tracked = {symbol for (symbol,) in Stock.query.with_entities(Stock.symbol).all()}
+        universe = set(StockScanner().get_comprehensive_market_universe(self.universe_size))
+        return sorted((stored | tracked | universe) - fresh)
+
+    def refresh(self, symbols: Optional[List[str]] = None) -> Optional[Dict]:
+        """Batch job: look up fundamentals concurrently, store them and copy name/sector/market cap onto Stock rows"""
+        from app import app
+        from models import StockFundamentals
+
+        started = time.time()
+        try:
+            with app.app_context():
+                symbols = symbols if symbols is not None else self.refresh_symbols()
+                with ThreadPoolExecutor(max_workers=self.max_workers) as executor:
+                    rows = [row for row in executor.map(self.fetch_fundamentals, symbols) if row]
+                stored = StockFundamentals.bulk_upsert(rows)
+                updated = self.update_stock_metadata(rows)
+            logging.info(f"Refreshed fundamentals for {stored} of {len(symbols)} symbols "
+                         f"({updated} stock rows updated) in {time.time() - started:.1f}s")
+            return {'symbols': len(symbols), 'stored': stored, 'stocks_updated': updated}
+        except Exception as e:
+            logging.error(f"Error refreshing fundamentals: {e}")
+            return None
+
+    def update_stock_metadata(self, rows: List[Dict]) -> int:
+        """Universe metadata on Stock rows follows the refreshed fundamentals"""
+        from models import Stock
+        from app import db
+
+        by_symbol = {row['symbol']: row for row in rows}
+        if not by_symbol:
+            return 0
+        try:
+            stocks = Stock.query.filter(Stock.symbol.in_(list(by_symbol))).all()
+            for stock in stocks:
+                row = by_symbol[stock.symbol]
+                stock.name = row['name'] or stock.name
+                stock.sector = row['sector'] or stock.sector
+                stock.market_cap = row['market_cap'] if row['market_cap'] is not None else stock.market_cap
+            db.session.commit()
+            return len(stocks)
+        except Exception as e:
+            db.session.rollback()
+            logging.error(f"Error updating stock metadata: {e}")
+            return 0
+
+# Global instance
+fundamentals_cache = FundamentalsCache()
+
+if __name__ == "__main__":
+    # Offline bulk load of the whole universe
+    logging.basicConfig(level=logging.INFO)
+    print(fundamentals_cache.refresh())
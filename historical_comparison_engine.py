@@ -0,0 +1,469 @@
+"""
+Historical Comparison Engine
+Multi-factor historical pattern matching over a precomputed per-window feature store
+"""
+
+import os
+import threading
+import logging
+from datetime import datetime
+from types import MappingProxyType
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import ta
+from numpy.lib.stride_tricks import sliding_window_view
+
+from market_data_engine import download_histories
+
+class HistoricalMatch:
+    """One historical window that resembles the query window, with its factor scores and what followed"""
+
+    def __init__(self, symbol: str, date_range: str, composite_score: float, price_correlation: float,
+                 volume_correlation: float, technical_score: float, pattern_match_score: float,
+                 news_sentiment_score: float, market_condition_score: float, confidence_level: str,
+                 key_metrics: Dict, outcome: Dict):
+        self.symbol = symbol
+        self.date_range = date_range
+        self.composite_score = composite_score
+        self.price_correlation = price_correlation
+        self.volume_correlation = volume_correlation
+        self.technical_score = technical_score
+        self.pattern_match_score = pattern_match_score
+        self.news_sentiment_score = news_sentiment_score
+        self.market_condition_score = market_condition_score
+        self.confidence_level = confidence_level
+        self.key_metrics = key_metrics
+        self.outcome = outcome
+
+    def to_dict(self) -> Dict:
+        return dict(self.__dict__)
+
+class HistoricalComparisonEngine:
+    def __init__(self, store_file: str = "historical_features.npz", window: int = 20, outcome_days: int = 10,
+                 benchmark: str = "SPY"):
+        self.store_file = store_file
+        self.window = window
+        self.outcome_days = outcome_days
+        self.benchmark = benchmark
+        self.warmup = 100  # bars before RSI/MACD/ATR values stop depending on where the fetch started
+
+        # Share of the composite similarity each factor contributes; the vector blocks follow this order
+        self.factor_weights = {'price': 0.35, 'volume': 0.15, 'technical': 0.2, 'pattern': 0.15, 'market': 0.15}
+        self.factor_sizes = {'price': window, 'volume': window, 'technical': 6, 'pattern': 6, 'market': 4}
+        self.metric_names = ['rsi', 'window_return', 'volatility', 'volume_ratio', 'market_return']
+        self.confidence_levels = [(0.9, 'very_high'), (0.8, 'high'), (0.7, 'medium'), (0.0, 'low')]
+        self.outcome_thresholds = [(8, 'strong_bullish'), (3, 'bullish'), (-3, 'sideways'), (-8, 'bearish')]
+
+        self._lock = threading.Lock()
+        self._loaded_mtime = None
+        self._clear()
+
+    def _clear(self):
+        dimension = sum(self.factor_sizes.values())
+        self._set_arrays({
+            'features': np.empty((0, dimension), dtype=np.float32),
+            'metrics': np.empty((0, len(self.metric_names)), dtype=np.float32),
+            'symbols': np.empty(0, dtype='<U12'),
+            'start_dates': np.empty(0, dtype='datetime64[D]'),
+            'end_dates': np.empty(0, dtype='datetime64[D]'),
+            # Outcome over the following outcome_days bars, in percent; NaN until those bars exist
+            'outcomes': np.empty((0, 3), dtype=np.float32)
+        })
+
+    def _set_arrays(self, arrays: Dict[str, np.ndarray]):
+        """Publish a new store in one assignment; readers take self.store once per query and never see a mix"""
+        self.store = MappingProxyType(dict(arrays))
+
+    # Feature vectors
+
+    def _zscore(self, windows: np.ndarray) -> np.ndarray:
+        centred = windows - windows.mean(axis=1, keepdims=True)
+        scale = centred.std(axis=1, keepdims=True)
+        return np.divide(centred, scale, out=np.zeros_like(centred), where=scale > 0)
+
+    def _dates(self, hist: pd.DataFrame) -> pd.DatetimeIndex:
+        index = hist.index.tz_localize(None) if hist.index.tz is not None else hist.index
+        return index.normalize()
+
+    def market_frame(self, benchmark_hist: Optional[pd.DataFrame]) -> Optional[pd.DataFrame]:
+        """Market-condition features per date from the benchmark's bars"""
+        if benchmark_hist is None or len(benchmark_hist) < self.window + 1:
+            return None
+        closes = benchmark_hist['Close'].astype(float)
+        log_returns = np.log(closes).diff()
+        frame = pd.DataFrame({
+            'trend': np.tanh(np.log(closes / closes.shift(self.window)) * 10),
+            'volatility': np.tanh(log_returns.rolling(self.window).std() * 50),
+            'vs_sma50': np.tanh(np.log(closes / closes.rolling(50).mean()) * 10),
+            'rsi': ta.momentum.rsi(closes) / 50 - 1,
+            'market_return': np.log(closes / closes.shift(self.window))
+        })
+        frame.index = self._dates(benchmark_hist)
+        return frame
+
+    def embed_history(self, hist: pd.DataFrame, market: Optional[pd.DataFrame] = None) -> Dict[str, np.ndarray]:
+        """Normalized feature vector for every complete window of one symbol's bars, with the outcome that followed"""
+        closes = hist['Close'].values.astype(float)
+        highs = hist['High'].values.astype(float)
+        lows = hist['Low'].values.astype(float)
+        volumes = hist['Volume'].values.astype(float)
+        n = len(closes)
+        w = self.window
+        if n < w + 1:
+            return {}
+
+        # The window ending at bar t covers bars t-w+1..t; bar 0 is skipped so every bar in a window has a return
+        close_windows = sliding_window_view(closes, w)[1:]
+        volume_windows = sliding_window_view(np.log1p(volumes), w)[1:]
+        return_windows = sliding_window_view(np.diff(np.log(closes)), w)
+        end = np.arange(w, n)
+        last = close_windows[:, -1]
+
+        # Technical: momentum, trend and volatility indicators at the window's last bar
+        close_series = hist['Close'].astype(float)
+        rsi = ta.momentum.rsi(close_series).values[end]
+        macd_diff = ta.trend.macd_diff(close_series).values[end]
+        sma_20 = close_series.rolling(20).mean().values[end]
+        sma_50 = close_series.rolling(50).mean().values[end]
+        bollinger = ta.volatility.bollinger_pband(close_series).values[end]
+        atr = ta.volatility.average_true_range(hist['High'].astype(float), hist['Low'].astype(float),
+                                               close_series).values[end]
+        technical = np.column_stack([
+            np.nan_to_num(rsi, nan=50.0) / 50 - 1,
+            np.tanh(np.nan_to_num(macd_diff / last) * 100),
+            np.tanh(np.nan_to_num(np.log(last / sma_20)) * 10),
+            np.tanh(np.nan_to_num(np.log(last / sma_50)) * 5),
+            np.clip(np.nan_to_num(bollinger, nan=0.5) * 2 - 1, -2, 2) / 2,
+            np.tanh(np.nan_to_num(atr / last) * 20)
+        ])
+
+        # Pattern: shape of the window - trend strength, range position, pullback, tightening, swing structure
+        window_high = close_windows.max(axis=1)
+        window_low = close_windows.min(axis=1)
+        span = window_high - window_low
+        volatility = return_windows.std(axis=1)
+        window_return = np.log(last / close_windows[:, 0])
+        chunk = w // 4
+        segments = close_windows[:, w - 4 * chunk:].reshape(len(end), 4, chunk)
+        recent_span = close_windows[:, -5:].max(axis=1) - close_windows[:, -5:].min(axis=1)
+        pattern = np.column_stack([
+            np.tanh(np.divide(window_return, volatility * np.sqrt(w), out=np.zeros(len(end)), where=volatility > 0)),
+            np.divide(last - window_low, span, out=np.full(len(span), 0.5), where=span > 0) * 2 - 1,
+            np.tanh(np.log(last / window_high) * 10),
+            np.divide(recent_span, span, out=np.ones(len(span)), where=span > 0) * 2 - 1,
+            (np.diff(segments.min(axis=2), axis=1) > 0).mean(axis=1) * 2 - 1,
+            (np.diff(segments.max(axis=2), axis=1) > 0).mean(axis=1) * 2 - 1
+        ])
+
+        dates = self._dates(hist)
+        end_dates = dates[end]
+        if market is not None:
+            market_rows = market.reindex(end_dates)
+            market_block = np.nan_to_num(market_rows[['trend', 'volatility', 'vs_sma50', 'rsi']].values)
+            market_return = market_rows['market_return'].values
+        else:
+            market_block = np.zeros((len(end), self.factor_sizes['market']))
+            market_return = np.full(len(end), np.nan)
+
+        # Scale each block to unit length, then weight so the dot product is a weighted cosine similarity
+        blocks = []
+        raw_blocks = {
+            'price': self._zscore(np.log(close_windows)),
+            'volume': self._zscore(volume_windows),
+            'technical': technical,
+            'pattern': pattern,
+            'market': market_block
+        }
+        for name in self.factor_weights:
+            block = raw_blocks[name]
+            norms = np.linalg.norm(block, axis=1, keepdims=True)
+            block = np.divide(block, norms, out=np.zeros_like(block), where=norms > 0)
+            blocks.append(block * np.sqrt(self.factor_weights[name]))
+        features = np.hstack(blocks).astype(np.float32)
+
+        volume_mean = np.exp(volume_windows).mean(axis=1)
+        metrics = np.column_stack([
+            np.nan_to_num(rsi, nan=50.0),
+            window_return * 100,
+            volatility * 100,
+            np.divide(np.exp(volume_windows[:, -5:]).mean(axis=1), volume_mean, out=np.ones(len(end)),
+                      where=volume_mean > 0),
+            market_return * 100
+        ]).astype(np.float32)
+
+        # Outcome: close-to-close return and the best/worst intraday excursion over the following bars
+        outcomes = np.full((len(end), 3), np.nan, dtype=np.float32)
+        known = end + self.outcome_days < n
+        if known.any():
+            ahead = end[known][:, None] + np.arange(1, self.outcome_days + 1)
+            base = closes[end[known]]
+            outcomes[known, 0] = (closes[end[known] + self.outcome_days] / base - 1) * 100
+            outcomes[known, 1] = (highs[ahead].max(axis=1) / base - 1) * 100
+            outcomes[known, 2] = (lows[ahead].min(axis=1) / base - 1) * 100
+
+        valid = np.isfinite(features).all(axis=1)
+        return {
+            'features': features[valid],
+            'metrics': metrics[valid],
+            'start_dates': dates[end - w + 1][valid].values.astype('datetime64[D]'),
+            'end_dates': end_dates[valid].values.astype('datetime64[D]'),
+            'outcomes': outcomes[valid]
+        }
+
+    # Building and maintenance
+
+    def build(self, symbols: List[str], period: str = "3y", histories: Optional[Dict[str, pd.DataFrame]] = None) -> int:
+        """Offline build of the whole feature store; returns the number of stored windows"""
+        if histories is None:
+            histories = download_histories(sorted(set(symbols) | {self.benchmark}), period)
+        if not histories:
+            # Keep the existing data rather than replacing it with nothing
+            logging.error("No history downloaded; historical feature store left unchanged")
+            return len(self.store['symbols'])
+        with self._lock:
+            self._clear()
+            self._append(histories, keep_from=0)
+            self._save()
+        logging.info(f"Built historical feature store: {len(self.store['symbols'])} windows across {len(histories)} symbols")
+        return len(self.store['symbols'])
+
+    def update(self, symbols: Optional[List[str]] = None, period: str = "1y",
+               histories: Optional[Dict[str, pd.DataFrame]] = None) -> int:
+        """Nightly incremental update: append new windows and fill in outcomes that have since become known"""
+        self.load()
+        if symbols is None:
+            symbols = sorted(set(self.store['symbols'].tolist()))
+        if histories is None:
+            histories = download_histories(sorted(set(symbols) | {self.benchmark}), period)
+        with self._lock:
+            before = len(self.store['symbols'])
+            self._append(histories, keep_from=self.warmup)
+            self._save()
+        total = len(self.store['symbols'])
+        logging.info(f"Updated historical feature store: {total - before:+d} windows, {total} total")
+        return total
+
+    def _append(self, histories: Dict[str, pd.DataFrame], keep_from: int):
+        """Replace each symbol's rows from its first fully warmed-up window onwards"""
+        store = self.store
+        market = self.market_frame(histories.get(self.benchmark))
+        parts = {key: [value] for key, value in store.items()}
+        drop = np.zeros(len(store['symbols']), dtype=bool)
+
+        for symbol, hist in histories.items():
+            try:
+                embedded = self.embed_history(hist, market)
+            except Exception as e:
+                logging.error(f"Error computing historical features for {symbol}: {e}")
+                continue
+            if not embedded:
+                continue
+            first = max(keep_from - self.window, 0)
+            if first >= len(embedded['end_dates']):
+                continue
+            drop |= (store['symbols'] == symbol) & (store['end_dates'] >= embedded['end_dates'][first])
+
+            for key, value in embedded.items():
+                parts[key].append(value[first:])
+            parts['symbols'].append(np.full(len(embedded['end_dates']) - first, symbol, dtype='<U12'))
+
+        keep = ~np.concatenate([drop, np.zeros(sum(len(p) for p in parts['symbols'][1:]), dtype=bool)])
+        self._set_arrays({key: np.concatenate(value)[keep] for key, value in parts.items()})
+
+    # Persistence
+
+    def _save(self):
+        """Write-then-rename so readers in other processes never load a partial store"""
+        tmp_file = f"{self.store_file}.{os.getpid()}.tmp.npz"
+        np.savez(tmp_file, **self.store, window=np.array(self.window), outcome_days=np.array(self.outcome_days))
+        os.replace(tmp_file, self.store_file)
+        self._loaded_mtime = os.path.getmtime(self.store_file)
+
+    def load(self) -> bool:
+        """Reload the store if another process has rebuilt it since we last read it"""
+        try:
+            mtime = os.path.getmtime(self.store_file)
+        except OSError:
+            return False
+        if mtime == self._loaded_mtime:
+            return True
+
+        with self._lock:
+            try:
+                with np.load(self.store_file) as data:
+                    if int(data['window']) != self.window or int(data['outcome_days']) != self.outcome_days:
+                        logging.warning("Historical feature store was built with different settings; rebuild required")
+                        return False
+                    self._set_arrays({key: data[key] for key in self.store})
+                self._loaded_mtime = mtime
+                return True
+            except Exception as e:
+                logging.error(f"Error loading historical feature store: {e}")
+                return False
+
+    # Matching
+
+    def _query_features(self, store, symbol: str) -> Optional[Dict]:
+        """The symbol's latest window: from the store when present, otherwise computed from a fresh download"""
+        indexed = np.flatnonzero(store['symbols'] == symbol)
+        if len(indexed):
+            row = indexed[np.argmax(store['end_dates'][indexed])]
+            return {'features': store['features'][row], 'end_date': store['end_dates'][row]}
+
+        histories = download_histories([symbol, self.benchmark], "1y")
+        hist = histories.get(symbol)
+        embedded = self.embed_history(hist, self.market_frame(histories.get(self.benchmark))) if hist is not None else {}
+        if not embedded:
+            return None
+        return {'features': embedded['features'][-1], 'end_date': embedded['end_dates'][-1]}
+
+    def _factor_scores(self, features: np.ndarray, query: np.ndarray) -> Dict[str, np.ndarray]:
+        """Per-factor cosine similarity for a few rows, from the slices of the weighted vectors"""
+        scores = {}
+        offset = 0
+        for name, size in self.factor_sizes.items():
+            block = slice(offset, offset + size)
+            scores[name] = (features[:, block] @ query[block]) / self.factor_weights[name]
+            offset += size
+        return scores
+
+    def _confidence_level(self, score: float) -> str:
+        return next(level for threshold, level in self.confidence_levels if score >= threshold)
+
+    def classify_outcome(self, total_return: float) -> str:
+        for threshold, outcome in self.outcome_thresholds:
+            if total_return >= threshold:
+                return outcome
+        return 'strong_bearish'
+
+    def find_historical_matches(self, symbol: str, lookback_days: int = 504, top_k: int = 20) -> List[HistoricalMatch]:
+        """Windows from the last lookback_days trading days most similar to the symbol's latest window"""
+        try:
+            self.load()
+            store = self.store
+            features, symbols, end_dates = store['features'], store['symbols'], store['end_dates']
+            query = self._query_features(store, symbol)
+            if query is None or len(features) == 0:
+                return []
+
+            # Candidates: windows with a known outcome inside the lookback, excluding the query's own recent windows
+            latest = end_dates.max()
+            candidates = np.isfinite(store['outcomes'][:, 0]) & (
+                end_dates >= latest - np.timedelta64(int(lookback_days * 365 / 252), 'D'))
+            candidates &= ~((symbols == symbol) &
+                            (end_dates > query['end_date'] - np.timedelta64(2 * self.window, 'D')))
+            rows = np.flatnonzero(candidates)
+            if not len(rows):
+                return []
+
+            query_vector = query['features'].astype(np.float32)
+            similarity = features[rows] @ query_vector
+
+            # Neighbouring windows of one symbol are near-duplicates; keep the best per non-overlapping stretch
+            k = min(top_k * 10, len(rows))
+            best = np.argpartition(-similarity, k - 1)[:k]
+            best = best[np.argsort(-similarity[best])]
+            chosen = []
+            for candidate in best:
+                row = rows[candidate]
+                if any(symbols[other] == symbols[row] and
+                       abs(end_dates[other] - end_dates[row]) < np.timedelta64(2 * self.window, 'D')
+                       for other in chosen):
+                    continue
+                chosen.append(row)
+                if len(chosen) == top_k:
+                    break
+
+            chosen = np.array(chosen)
+            factors = self._factor_scores(features[chosen], query_vector)
+            composite = (1 + features[chosen] @ query_vector) / 2
+
+            matches = []
+            for i, row in enumerate(chosen):
+                total_return, max_gain, max_loss = (float(v) for v in store['outcomes'][row])
+                metrics = store['metrics'][row]
+                matches.append(HistoricalMatch(
+                    symbol=str(symbols[row]),
+                    date_range=f"{store['start_dates'][row]} to {end_dates[row]}",
+                    composite_score=float(composite[i]),
+                    price_correlation=float(max(factors['price'][i], 0.0)),
+                    volume_correlation=float(max(factors['volume'][i], 0.0)),
+                    technical_score=float((1 + factors['technical'][i]) / 2),
+                    pattern_match_score=float((1 + factors['pattern'][i]) / 2),
+                    news_sentiment_score=0.5,  # no news history in the store; neutral and left out of the composite
+                    market_condition_score=float((1 + factors['market'][i]) / 2),
+                    confidence_level=self._confidence_level(float(composite[i])),
+                    key_metrics={name: (None if np.isnan(value) else round(float(value), 2))
+                                 for name, value in zip(self.metric_names, metrics)},
+                    outcome={
+                        'outcome': self.classify_outcome(total_return),
+                        'total_return': round(total_return, 2),
+                        'max_gain': round(max_gain, 2),
+                        'max_loss': round(max_loss, 2),
+                        'days': self.outcome_days
+                    }
+                ))
+            return matches
+
+        except Exception as e:
+            logging.error(f"Error finding historical matches for {symbol}: {e}")
+            return []
+
+    def get_detailed_analysis(self, matches: List[HistoricalMatch]) -> Dict:
+        """Outcome distribution across matches, weighted by similarity"""
+        if not matches:
+            return {'total_matches': 0, 'predictions': {}}
+
+        weights = np.array([m.composite_score for m in matches])
+        returns = np.array([m.outcome['total_return'] for m in matches])
+        labels = [m.outcome['outcome'] for m in matches]
+
+        predictions = {}
+        for outcome in [label for _, label in self.outcome_thresholds] + ['strong_bearish']:
+            members = np.array([label == outcome for label in labels])
+            if members.any():
+                predictions[outcome] = {
+                    'probability': round(float(weights[members].sum() / weights.sum()), 3),
+                    'count': int(members.sum()),
+                    'average_return': round(float(returns[members].mean()), 2)
+                }
+        predictions['most_likely_outcome'] = max(
+            (key for key in predictions), key=lambda key: predictions[key]['probability'])
+        predictions['expected_return'] = round(float(np.average(returns, weights=weights)), 2)
+
+        confidence_distribution = {}
+        for m in matches:
+            confidence_distribution[m.confidence_level] = confidence_distribution.get(m.confidence_level, 0) + 1
+
+        return {
+            'total_matches': len(matches),
+            'average_score': round(float(weights.mean()), 3),
+            'predictions': predictions,
+            'win_rate': round(float((returns > 0).mean()), 3),
+            'average_max_gain': round(float(np.mean([m.outcome['max_gain'] for m in matches])), 2),
+            'average_max_loss': round(float(np.mean([m.outcome['max_loss'] for m in matches])), 2),
+            'confidence_distribution': confidence_distribution,
+            'outcome_days': self.outcome_days
+        }
+
+    def get_stats(self) -> Dict:
+        self.load()
+        store = self.store
+        return {
+            'windows': int(len(store['symbols'])),
+            'symbols': int(len(np.unique(store['symbols']))),
+            'window_length': self.window,
+            'latest_window': str(store['end_dates'].max()) if len(store['end_dates']) else None,
+            'updated_at': datetime.fromtimestamp(self._loaded_mtime).isoformat() if self._loaded_mtime else None
+        }
+
+# Global instance
+historical_comparison_engine = HistoricalComparisonEngine()
+
+if __name__ == "__main__":
+    # Offline build over the scanner's market universe
+    from stock_scanner import StockScanner
+    logging.basicConfig(level=logging.INFO)
+    historical_comparison_engine.build(StockScanner().get_comprehensive_market_universe(1000))
@@ -0,0 +1,247 @@
+"""
+Insight Service
+Cached, rate-budgeted and concurrent generation of recommendation insights with a deterministic fallback
+"""
+
+import os
+import json
+import time
+import hashlib
+import threading
+import logging
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, List, Optional
+
+from scan_scheduler import ProviderBudget
+
+class TemplateInsightBackend:
+    """Deterministic insight text from the normalized inputs; no network"""
+    name = 'template'
+
+    def generate(self, inputs: Dict, prompt: str) -> str:
+        technical = inputs['technical_bucket']
+        if technical >= 75:
+            watch = "Technical setup is strong; watch for volume confirming any breakout."
+        elif technical >= 60:
+            watch = "Trend is constructive; watch the 20-day average as support."
+        else:
+            watch = "Technicals are mixed; wait for momentum to confirm before adding."
+        return (f"Strong recommendation based on {inputs['reason']}. "
+                f"Fits a {inputs['risk_tolerance']} {inputs['trading_style'].replace('_', ' ')} approach. {watch}")
+
+class StubInsightBackend:
+    """Local stand-in for the LLM with configurable latency, for load-testing the recommendation flow"""
+    name = 'stub'
+
+    def __init__(self, latency: float = 0.5):
+        self.latency = latency
+        self.calls = 0
+        self._lock = threading.Lock()
+
+    def generate(self, inputs: Dict, prompt: str) -> str:
+        with self._lock:
+            self.calls += 1
+        time.sleep(self.latency)
+        digest = hashlib.sha1(prompt.encode('utf-8')).hexdigest()[:8]
+        return (f"[stub {digest}] {inputs['symbol']} scores {inputs['technical_bucket']}/100 technically and "
+                f"{inputs['fundamental_bucket']}/100 fundamentally for a {inputs['risk_tolerance']} trader.")
+
+class OpenAIInsightBackend:
+    """Chat completion per prompt"""
+    name = 'openai'
+
+    def __init__(self, model: str = "gpt-4o", api_key: Optional[str] = None):
+        import openai
+        self.model = model  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
+        self.client = openai.OpenAI(api_key=api_key or os.environ.get("OPENAI_API_KEY"))
+
+    def generate(self, inputs: Dict, prompt: str) -> str:
+        response = self.client.chat.completions.create(
+            model=self.model,
+            messages=[{"role": "user", "content": prompt}],
+            max_tokens=150,
+            temperature=0.7
+        )
+        return response.choices[0].message.content.strip()
+
+def default_backend():
+    """Backend named by INSIGHT_BACKEND (openai, stub or template); templates when OpenAI is not configured"""
+    name = os.environ.get('INSIGHT_BACKEND', 'openai').lower()
+    if name == 'stub':
+        return StubInsightBackend(latency=float(os.environ.get('INSIGHT_STUB_LATENCY', '0.5')))
+    if name == 'openai' and os.environ.get('OPENAI_API_KEY'):
+        try:
+            return OpenAIInsightBackend()
+        except Exception as e:
+            logging.error(f"Could not initialize OpenAI insight backend: {e}")
+    return TemplateInsightBackend()
+
+class InsightService:
+    def __init__(self, backend=None, max_workers: int = 8, calls_per_minute: int = 60,
+                 cache_dir: str = "insight_cache", ttl: int = 4 * 60 * 60, budget_timeout: float = 5.0):
+        self.backend = backend or default_backend()
+        self.fallback = TemplateInsightBackend()
+        self.max_workers = max_workers
+        self.budget = ProviderBudget(calls_per_minute=calls_per_minute)
+        self.budget_timeout = budget_timeout  # seconds to wait for the budget before answering from the template
+        self.cache_dir = cache_dir
+        self.ttl = ttl  # matches the recommendations' refresh interval
+
+        self.max_memory_entries = 1024
+        self._memory = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0, 'backend_calls': 0, 'fallbacks': 0}
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    # Normalized inputs and content addressing
+
+    def _bucket(self, value, step: float) -> Optional[float]:
+        try:
+            return round(round(float(value) / step) * step, 2)
+        except (TypeError, ValueError):
+            return None
+
+    def insight_inputs(self, recommendation: Dict, user_profile: Dict) -> Dict:
+        """The prompt's inputs, rounded so the same setup for the same kind of trader maps to one key"""
+        price = recommendation.get('current_price') or 0
+        return {
+            'symbol': recommendation['symbol'],
+            'sector': recommendation.get('sector', 'Unknown'),
+            'price_bucket': float(f"{float(price):.3g}") if price else 0.0,
+            'technical_bucket': int(self._bucket(recommendation.get('technical_score', 50), 5) or 50),
+            'fundamental_bucket': int(self._bucket(recommendation.get('fundamental_score', 50), 5) or 50),
+            'pe_bucket': self._bucket(recommendation.get('pe_ratio'), 1),
+            'beta_bucket': self._bucket(recommendation.get('beta'), 0.1),
+            'risk_tolerance': user_profile.get('risk_tolerance', 'moderate'),
+            'trading_style': user_profile.get('trading_style', 'swing'),
+            'preferred_sectors': sorted(user_profile.get('preferred_sectors', [])),
+            'reason': recommendation.get('recommendation_reason', 'balanced opportunity').replace('Recommended due to ', '')
+        }
+
+    def cache_key(self, inputs: Dict) -> str:
+        payload = json.dumps(inputs, sort_keys=True, default=str)
+        return hashlib.sha1(f"{self.backend.name}:{payload}".encode('utf-8')).hexdigest()
+
+    def build_prompt(self, inputs: Dict) -> str:
+        return f"""
+            Analyze this stock recommendation for a trader:
+
+            Stock: {inputs['symbol']}
+            Sector: {inputs['sector']}
+            Current Price: ${inputs['price_bucket']:.2f}
+            Technical Score: {inputs['technical_bucket']}/100
+            Fundamental Score: {inputs['fundamental_bucket']}/100
+            P/E Ratio: {inputs['pe_bucket'] if inputs['pe_bucket'] is not None else 'N/A'}
+            Beta: {inputs['beta_bucket'] if inputs['beta_bucket'] is not None else 'N/A'}
+
+            User Profile:
+            Risk Tolerance: {inputs['risk_tolerance']}
+            Trading Style: {inputs['trading_style']}
+            Preferred Sectors: {', '.join(inputs['preferred_sectors'])}
+
+            Provide a concise 2-3 sentence insight explaining why this stock fits the user's profile and what to watch for. Focus on actionable insights.
+            """
+
+    # Cache
+
+    def _cache_file(self, key: str) -> str:
+        return os.path.join(self.cache_dir, f"{key}.json")
+
+    def _cached(self, key: str) -> Optional[str]:
+        with self._lock:
+            entry = self._memory.get(key)
+        if entry is None:
+            try:
+                with open(self._cache_file(key), 'r') as f:
+                    entry = json.load(f)
+            except (OSError, ValueError):
+                return None
+        if time.time() - entry['cached_at'] >= self.ttl:
+            return None
+        self._remember(key, entry)
+        return entry['insight']
+
+    def _remember(self, key: str, entry: Dict):
+        with self._lock:
+            self._memory[key] = entry
+            self._memory.move_to_end(key)
+            while len(self._memory) > self.max_memory_entries:
+                self._memory.popitem(last=False)
+
+    def _store(self, key: str, insight: str):
+        entry = {'insight': insight, 'backend': self.backend.name, 'cached_at': time.time()}
+        self._remember(key, entry)
+        tmp_file = f"{self._cache_file(key)}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(entry, f)
+            os.replace(tmp_file, self._cache_file(key))
+        except OSError as e:
+            logging.warning(f"Could not persist insight cache entry: {e}")
+
+    # Generation
+
+    def _count(self, stat: str, amount: int = 1):
+        with self._lock:
+            self.stats[stat] += amount
+
+    def _generate(self, inputs: Dict, key: str) -> str:
+        """One backend call under the rate budget; the template answers when the budget or the backend fails"""
+        if self.backend.name == 'template':
+            return self.fallback.generate(inputs, '')
+        if not self.budget.acquire(timeout=self.budget_timeout):
+            self._count('fallbacks')
+            logging.warning(f"Insight budget exhausted; using template for {inputs['symbol']}")
+            return self.fallback.generate(inputs, '')
+        try:
+            self._count('backend_calls')
+            insight = self.backend.generate(inputs, self.build_prompt(inputs))
+            self._store(key, insight)
+            return insight
+        except Exception as e:
+            self._count('fallbacks')
+            logging.error(f"Error generating AI insight: {e}")
+            return self.fallback.generate(inputs, '')
+
+    def generate(self, recommendation: Dict, user_profile: Dict) -> str:
+        return self.generate_many([recommendation], user_profile)[0]
+
+    def generate_many(self, recommendations: List[Dict], user_profile: Dict) -> List[str]:
+        """Insights for several recommendations: cache hits first, then the distinct misses concurrently"""
+        inputs = [self.insight_inputs(rec, user_profile) for rec in recommendations]
+        keys = [self.cache_key(item) for item in inputs]
+
+        results = {}
+        pending = {}
+        for key, item in zip(keys, inputs):
+            if key in results or key in pending:
+                continue
+            cached = self._cached(key)
+            if cached is not None:
+                results[key] = cached
+            else:
+                pending[key] = item
+        self._count('hits', len(results))
+        self._count('misses', len(pending))
+
+        if pending:
+            workers = min(self.max_workers, len(pending))
+            with ThreadPoolExecutor(max_workers=workers) as executor:
+                futures = {key: executor.submit(self._generate, item, key) for key, item in pending.items()}
+                for key, future in futures.items():
+                    results[key] = future.result()
+
+        return [results[key] for key in keys]
+
+    def get_stats(self) -> Dict:
+        return {
+            'backend': self.backend.name,
+            **self.stats,
+            'memory_entries': len(self._memory),
+            'budget': self.budget.get_stats()
+        }
+
+# Global instance
+insight_service = InsightService()
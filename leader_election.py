@@ -0,0 +1,84 @@
+"""
+Scanner Leader Election
+Ensures exactly one worker process runs background scanning when the app is served by several processes
+"""
+
+import fcntl
+import os
+import threading
+import time
+import logging
+from typing import Callable, Optional
+
+class LeaderElection:
+    def __init__(self, lock_file: str = "scanner_leader.lock", retry_interval: int = 30):
+        self.lock_file = lock_file
+        self.retry_interval = retry_interval  # Seconds between follower attempts to take over
+        self._lock_handle = None
+        self._standby_thread = None
+        self._guard = threading.Lock()
+
+    @property
+    def is_leader(self) -> bool:
+        """Whether this process currently holds the leader lock"""
+        return self._lock_handle is not None
+
+    def try_acquire(self) -> bool:
+        """Try to become leader without blocking"""
+        with self._guard:
+            if self._lock_handle is not None:
+                return True
+
+            handle = open(self.lock_file, 'a+')
+            try:
+                # The OS releases the lock automatically if this process dies
+                fcntl.flock(handle.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except OSError:
+                handle.close()
+                return False
+
+            handle.seek(0)
+            handle.truncate()
+            handle.write(str(os.getpid()))
+            handle.flush()
+            self._lock_handle = handle
+
+            logging.info(f"Process {os.getpid()} elected scanner leader")
+            return True
+
+    def release(self):
+        """Give up leadership so another process can take over"""
+        with self._guard:
+            if self._lock_handle is None:
+                return
+            try:
+                fcntl.flock(self._lock_handle.fileno(), fcntl.LOCK_UN)
+            finally:
+                self._lock_handle.close()
+                self._lock_handle = None
+            logging.info(f"Process {os.getpid()} released scanner leadership")
+
+    def current_leader_pid(self) -> Optional[int]:
+        """PID recorded by the current leader, if any"""
+        try:
+            with open(self.lock_file, 'r') as f:
+                content = f.read().strip()
+            return int(content) if content else None
+        except (OSError, ValueError):
+            return None
+
+    def wait_for_leadership(self, on_elected: Callable[[], None]):
+        """Keep retrying in the background and call on_elected once this process becomes leader"""
+        if self._standby_thread and self._standby_thread.is_alive():
+            return
+
+        def _standby_loop():
+            while not self.try_acquire():
+                time.sleep(self.retry_interval)
+            try:
+                on_elected()
+            except Exception as e:
+                logging.error(f"Error starting leader duties: {e}")
+
+        self._standby_thread = threading.Thread(target=_standby_loop, daemon=True)
+        self._standby_thread.start()
@@ -16,6 +16,35 @@ import pickle
 import os
 from typing import List, Dict, Tuple, Optional
 import queue
+from scan_scheduler import provider_budget
+
+def download_histories(symbols: List[str], period: str = "3mo", chunk_size: int = 100) -> Dict[str, pd.DataFrame]:
+    """Daily bars for many symbols through batched yf.download requests, charged to the provider budget per symbol"""
+    histories = {}
+    symbols = list(dict.fromkeys(symbols or []))
+    chunk_size = max(1, min(chunk_size, provider_budget.calls_per_minute))
+    
+    for start in range(0, len(symbols), chunk_size):
+        chunk = symbols[start:start + chunk_size]
+        # yf.download fetches each ticker separately, so a chunk costs one call per symbol
+        provider_budget.acquire(calls=len(chunk))
+        try:
+            data = yf.download(chunk, period=period, interval="1d", group_by='ticker',
+                               auto_adjust=True, threads=True, progress=False)
+        except Exception as e:
+            logging.error(f"Error downloading history for {len(chunk)} symbols: {e}")
+            continue
+        
+        for symbol in chunk:
+            try:
+                hist = data[symbol] if isinstance(data.columns, pd.MultiIndex) else data
+                hist = hist.dropna(subset=['Close'])
+                if not hist.empty:
+                    histories[symbol] = hist
+            except KeyError:
+                logging.warning(f"No history returned for {symbol}")
+    
+    return histories
 
 class MarketDataEngine:
     def __init__(self):
@@ -165,7 +194,8 @@ class MarketDataEngine:
             return cached_data
         
         try:
-            # Rate limiting
+            # Rate limiting against the shared provider budget
+            provider_budget.acquire()
             time.sleep(self.rate_limit_delay)
             
             # Fetch data
@@ -4,6 +4,59 @@ from flask_login import UserMixin
 from werkzeug.security import generate_password_hash, check_password_hash
 import secrets
 
+def upsert_rows(model, rows, key_columns, batch_size=500):
+    """Insert or update rows keyed on a unique constraint with one statement per batch"""
+    # A statement may touch each key only once, so the last row per key wins
+    rows = list({tuple(row[column] for column in key_columns): row for row in rows}.values())
+    if not rows:
+        return 0
+    
+    dialect = db.session.get_bind().dialect.name
+    if dialect == 'postgresql':
+        from sqlalchemy.dialects.postgresql import insert
+    elif dialect == 'sqlite':
+        from sqlalchemy.dialects.sqlite import insert
+        # Stay under SQLite's bound-parameter limit on older builds
+        batch_size = min(batch_size, max(1, 999 // len(rows[0])))
+    else:
+        return merge_rows(model, rows, key_columns)
+    
+    try:
+        for start in range(0, len(rows), batch_size):
+            stmt = insert(model).values(rows[start:start + batch_size])
+            stmt = stmt.on_conflict_do_update(
+                index_elements=list(key_columns),
+                set_={column: stmt.excluded[column] for column in rows[0]
+                      if column not in key_columns}
+            )
+            db.session.execute(stmt)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
+
+def merge_rows(model, rows, key_columns):
+    """Portable fallback: one lookup query and one commit for the whole batch"""
+    try:
+        symbols = {row['symbol'] for row in rows}
+        existing = {
+            tuple(getattr(record, column) for column in key_columns): record
+            for record in model.query.filter(model.symbol.in_(symbols)).all()
+        }
+        for row in rows:
+            record = existing.get(tuple(row[column] for column in key_columns))
+            if record is None:
+                db.session.add(model(**row))
+            else:
+                for column, value in row.items():
+                    setattr(record, column, value)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return len(rows)
+
 class User(UserMixin, db.Model):
     __tablename__ = 'users'
     
@@ -143,6 +196,14 @@ class StockRecommendation(db.Model):
     expires_at = db.Column(db.DateTime)
 
 class PatternEvolution(db.Model):
+    # Existing databases need the two newer columns, duplicate (symbol, pattern_type) rows removed keeping the
+    # most recently updated one, the unique constraint and the latest-per-symbol index; db.create_all() does not alter tables:
+    #   ALTER TABLE pattern_evolution ADD COLUMN support_resistance_strength FLOAT, ADD COLUMN timing_confidence FLOAT;
+    #   DELETE FROM pattern_evolution a USING pattern_evolution b
+    #     WHERE a.symbol = b.symbol AND a.pattern_type = b.pattern_type
+    #       AND (a.updated_at < b.updated_at OR (a.updated_at = b.updated_at AND a.id < b.id));
+    #   ALTER TABLE pattern_evolution ADD CONSTRAINT uq_pattern_evolution_symbol_pattern_type UNIQUE (symbol, pattern_type);
+    #   CREATE INDEX ix_pattern_evolution_symbol_updated_at ON pattern_evolution (symbol, updated_at);
     __tablename__ = 'pattern_evolution'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -159,12 +220,14 @@ class PatternEvolution(db.Model):
     volatility_trend = db.Column(db.Float)
     volume_trend = db.Column(db.Float)
     momentum_change = db.Column(db.Float)
+    support_resistance_strength = db.Column(db.Float)
     
     # Prediction metrics
     estimated_days_to_breakout = db.Column(db.Integer)
     breakout_probability_5_days = db.Column(db.Float)
     breakout_probability_10_days = db.Column(db.Float)
     direction_bias = db.Column(db.Float)  # 0-1 (bearish to bullish)
+    timing_confidence = db.Column(db.Float)
     
     # Key levels
     resistance_level = db.Column(db.Float)
@@ -177,8 +240,116 @@ class PatternEvolution(db.Model):
     # Timestamps
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
     updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('symbol', 'pattern_type', name='uq_pattern_evolution_symbol_pattern_type'),
+        db.Index('ix_pattern_evolution_symbol_updated_at', 'symbol', 'updated_at'),
+    )
+    
+    @classmethod
+    def latest_per_symbol(cls):
+        """Subquery of the most recently updated evolution id for each symbol"""
+        rank = db.func.row_number().over(
+            partition_by=cls.symbol,
+            order_by=(cls.updated_at.desc(), cls.id.desc())
+        ).label('rank')
+        ranked = db.session.query(cls.id.label('id'), rank).subquery()
+        return db.session.query(ranked.c.id).filter(ranked.c.rank == 1).subquery()
+    
+    @classmethod
+    def latest_with_stocks(cls, tracked_only=False):
+        """(stock, latest evolution) pairs for every stock that has one, in a single query"""
+        latest = cls.latest_per_symbol()
+        query = db.session.query(Stock, cls).join(cls, cls.symbol == Stock.symbol).join(latest, latest.c.id == cls.id)
+        if tracked_only:
+            query = query.filter(Stock.is_tracked.is_(True))
+        return query.order_by(Stock.id).all()
+
+    @staticmethod
+    def rows_from_evolution(symbol, evolution_data):
+        """Column values for each pattern in a PatternEvolutionTracker report"""
+        rows = []
+        now = datetime.utcnow()
+        for pattern in evolution_data.get('patterns', []):
+            breakout_pred = pattern['breakout_prediction']
+            evolution = pattern['evolution']
+            rows.append({
+                'symbol': symbol,
+                'pattern_type': pattern['pattern_type'],
+                'confidence_score': float(pattern['confidence']),
+                'stage': pattern['current_stage'],
+                'completion_percentage': float(pattern['completion_percentage']),
+                'time_in_pattern': int(pattern['time_in_pattern']),
+                'volatility_trend': float(evolution.get('volatility_trend', 0)),
+                'volume_trend': float(evolution.get('volume_trend', 0)),
+                'momentum_change': float(evolution.get('momentum_change', 0)),
+                'support_resistance_strength': float(evolution.get('support_resistance_strength', 0)),
+                'estimated_days_to_breakout': int(breakout_pred.get('estimated_days_to_breakout', 7)),
+                'breakout_probability_5_days': float(breakout_pred.get('breakout_probability_next_5_days', 0)),
+                'breakout_probability_10_days': float(breakout_pred.get('breakout_probability_next_10_days', 0)),
+                'direction_bias': float(breakout_pred.get('direction_bias', 0.5)),
+                'timing_confidence': float(breakout_pred.get('timing_confidence', 0.5)),
+                'pattern_data': breakout_pred.get('key_levels', {}),
+                'updated_at': now
+            })
+        return rows
+    
+    @classmethod
+    def bulk_upsert(cls, rows, batch_size=500):
+        """Insert or update evolution rows keyed on (symbol, pattern_type) with one statement per batch"""
+        return upsert_rows(cls, rows, ('symbol', 'pattern_type'), batch_size)
+
+class PatternState(db.Model):
+    __tablename__ = 'pattern_states'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(10), nullable=False, unique=True, index=True)
+    
+    # {'last_bar': iso timestamp, 'patterns': {pattern_type: candidate advanced bar by bar}}
+    state = db.Column(db.JSON)
+    
+    updated_at = db.Column(db.DateTime, default=datetime.utcnow, onupdate=datetime.utcnow)
+
+class PatternStageEvent(db.Model):
+    __tablename__ = 'pattern_stage_events'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(10), nullable=False, index=True)
+    pattern_type = db.Column(db.String(50), nullable=False)
+    from_stage = db.Column(db.String(30))  # None when the pattern is first detected
+    to_stage = db.Column(db.String(30), nullable=False)  # includes 'breakout', 'breakdown', 'expired'
+    confidence = db.Column(db.Float)
+    bar_date = db.Column(db.DateTime, nullable=False)  # bar on which the transition happened
+    created_at = db.Column(db.DateTime, default=datetime.utcnow)
+
+class PatternScan(db.Model):
+    __tablename__ = 'pattern_scans'
+    
+    id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(10), nullable=False, unique=True)
+    patterns = db.Column(db.JSON)  # active patterns from PatternEvolutionTracker.scan_universe, possibly empty
+    scanned_at = db.Column(db.DateTime, nullable=False)  # shared by every row of one universe scan
+    
+    @classmethod
+    def replace_scan(cls, rows, batch_size=500):
+        """Store one universe scan and drop symbols the scan no longer covers"""
+        stored = upsert_rows(cls, rows, ('symbol',), batch_size)
+        if rows:
+            try:
+                cls.query.filter(cls.scanned_at < rows[0]['scanned_at']).delete(synchronize_session=False)
+                db.session.commit()
+            except Exception:
+                db.session.rollback()
+                raise
+        return stored
 
 class ForecastPath(db.Model):
+    # Existing databases need path_data, bands and last_bar added and duplicate (symbol, path_type)
+    # rows removed before the unique constraint can be created; db.create_all() does not alter tables:
+    #   ALTER TABLE forecast_paths ADD COLUMN path_data JSON, ADD COLUMN bands JSON, ADD COLUMN last_bar TIMESTAMP;
+    #   DELETE FROM forecast_paths a USING forecast_paths b
+    #     WHERE a.symbol = b.symbol AND a.path_type = b.path_type AND a.id < b.id;
+    #   ALTER TABLE forecast_paths ADD CONSTRAINT uq_forecast_paths_symbol_path_type UNIQUE (symbol, path_type);
     __tablename__ = 'forecast_paths'
     
     id = db.Column(db.Integer, primary_key=True)
@@ -188,7 +359,101 @@ class ForecastPath(db.Model):
     price_targets = db.Column(db.JSON)  # Array of price points
     timeframe_days = db.Column(db.Integer, default=5)
     risk_zones = db.Column(db.JSON)
+    path_data = db.Column(db.JSON)  # the path as generate_spaghetti_model returns it
+    bands = db.Column(db.JSON)  # forecast-wide quantile bands, repeated on each path row
+    last_bar = db.Column(db.DateTime)  # bar the forecast was simulated from
     created_at = db.Column(db.DateTime, default=datetime.utcnow)
+    
+    __table_args__ = (
+        db.UniqueConstraint('symbol', 'path_type', name='uq_forecast_paths_symbol_path_type'),
+    )
+    
+    @staticmethod
+    def rows_from_forecast(forecast):
+        """Column values for each path of a ForecastingEngine.simulate_forecast result"""
+        now = datetime.utcnow()
+        last_bar = datetime.fromisoformat(forecast['last_bar']).replace(tzinfo=None)
+        return [{
+            'symbol': forecast['symbol'],
+            'path_type': path['type'],
+            'probability': float(path['probability']),
+            'price_targets': path['targets'],
+            'timeframe_days': int(forecast['days']),
+            'risk_zones': path['risk_zones'],
+            'path_data': path,
+            'bands': forecast['bands'],
+            'last_bar': last_bar,
+            'created_at': now
+        } for path in forecast['paths']]
+    
+    @classmethod
+    def bulk_upsert(cls, rows, batch_size=500):
+        """Replace each symbol's stored paths, keyed on (symbol, path_type)"""
+        return upsert_rows(cls, rows, ('symbol', 'path_type'), batch_size)
+    
+    @classmethod
+    def latest_paths(cls, symbol, max_age=None, min_session=None):
+        """Stored four-path forecast for a symbol in generate_spaghetti_model's format, or None if missing or stale"""
+        records = cls.query.filter_by(symbol=symbol).order_by(cls.id).all()
+        if not records:
+            return None
+        if max_age is not None and min(record.created_at for record in records) < datetime.utcnow() - max_age:
+            return None
+        if min_session is not None and any(record.last_bar is None or record.last_bar.date() < min_session
+                                           for record in records):
+            return None
+        return [record.path_data or {
+            'type': record.path_type,
+            'probability': record.probability,
+            'targets': record.price_targets,
+            'risk_zones': record.risk_zones
+        } for record in records]
+
+class StockFundamentals(db.Model):
+    __tablename__ = 'stock_fundamentals'
+
+    id = db.Column(db.Integer, primary_key=True)
+    symbol = db.Column(db.String(10), nullable=False, unique=True)
+    name = db.Column(db.String(200))
+    sector = db.Column(db.String(50))
+    industry = db.Column(db.String(100))
+    market_cap = db.Column(db.BigInteger)
+    beta = db.Column(db.Float)
+    trailing_pe = db.Column(db.Float)
+    debt_to_equity = db.Column(db.Float)
+    return_on_equity = db.Column(db.Float)
+    earnings_growth = db.Column(db.Float)
+    current_price = db.Column(db.Float)
+    fetched_at = db.Column(db.DateTime)  # None until the refresh job has looked the symbol up
+
+    # Column for each ticker.info key the app reads
+    info_fields = {
+        'longName': 'name',
+        'sector': 'sector',
+        'industry': 'industry',
+        'marketCap': 'market_cap',
+        'beta': 'beta',
+        'trailingPE': 'trailing_pe',
+        'debtToEquity': 'debt_to_equity',
+        'returnOnEquity': 'return_on_equity',
+        'earningsGrowth': 'earnings_growth',
+        'currentPrice': 'current_price'
+    }
+
+    def to_info(self):
+        """Stored values under their ticker.info keys; missing values are left out so .get defaults apply"""
+        info = {key: getattr(self, column) for key, column in self.info_fields.items()}
+        return {key: value for key, value in info.items() if value is not None}
+
+    @classmethod
+    def bulk_upsert(cls, rows, batch_size=500):
+        """Insert or refresh fundamentals keyed on symbol"""
+        return upsert_rows(cls, rows, ('symbol',), batch_size)
+
+    @classmethod
+    def for_symbols(cls, symbols):
+        """{symbol: record} for the symbols that have been stored, in one query"""
+        return {record.symbol: record for record in cls.query.filter(cls.symbol.in_(list(symbols))).all()}
 
 class AIAnalysis(db.Model):
     __tablename__ = 'ai_analysis'
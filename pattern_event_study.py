@@ -0,0 +1,332 @@
+"""
+Pattern Event Study
+Replay the pattern detectors over years of bars and score their breakout predictions against what happened next
+"""
+
+import os
+import json
+import time
+import logging
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+import pandas as pd
+import ta
+from numpy.lib.stride_tricks import sliding_window_view
+
+from pattern_evolution_tracker import PatternEvolutionTracker
+from pattern_sweep import PatternParameterSweep
+
+class PatternEventStudy:
+    def __init__(self, tracker: Optional[PatternEvolutionTracker] = None, horizons=(5, 10, 20),
+                 lookback: int = 126, breakout_window: int = 5):
+        self.tracker = tracker or PatternEvolutionTracker()
+        self.sweep = PatternParameterSweep(self.tracker, horizons)
+        self.horizons = tuple(horizons)
+        self.lookback = lookback  # bars the live tracker sees (6 months of dailies)
+        self.breakout_window = breakout_window  # bars breakout_probability_next_5_days refers to
+        self.price_confirmation = self.tracker.breakout_signals['price_confirmation']
+        self.calibration_buckets = np.linspace(0.0, 1.0, 11)
+
+    # Replay
+
+    def _stack(self, histories: Dict, symbols: List[str], length: int) -> Dict[str, np.ndarray]:
+        return {field: self.tracker._stack_histories(histories, symbols, field, length)
+                for field in ('Close', 'High', 'Low', 'Volume')}
+
+    def _replay_histories(self, histories: Dict, pattern_types: List[str]) -> List[Dict]:
+        """Every distinct detection in the histories, with the live prediction and the realized outcome"""
+        symbols = [symbol for symbol, hist in histories.items() if hist is not None and not hist.empty]
+        if not symbols:
+            return []
+
+        length = max(len(histories[symbol]) for symbol in symbols)
+        matrices = self._stack(histories, symbols, length)
+
+        # Detection onsets for every symbol and bar in one array pass per detector, using the live thresholds
+        onsets = {}
+        for pattern_type in pattern_types:
+            _, _, _, first_index, min_bars = self.tracker.pattern_scans[pattern_type]
+            if length < min_bars:
+                continue
+            try:
+                metrics = getattr(self.sweep, f"_metrics_{pattern_type}")(matrices)
+                mask = self.sweep._detection_mask(pattern_type, metrics, self.sweep.live_parameters[pattern_type])
+                onsets[pattern_type] = self.sweep.detection_onsets(mask)
+            except Exception as e:
+                logging.error(f"Error replaying {pattern_type}: {e}")
+
+        events = []
+        for row, symbol in enumerate(symbols):
+            hist = histories[symbol]
+            padding = length - len(hist)
+            for pattern_type, pattern_onsets in onsets.items():
+                first_index = self.tracker.pattern_scans[pattern_type][3]
+                candidates = np.flatnonzero(pattern_onsets[row]) + first_index - padding
+                try:
+                    events.extend(self._symbol_events(symbol, hist, pattern_type, candidates))
+                except Exception as e:
+                    logging.error(f"Error replaying {pattern_type} for {symbol}: {e}")
+
+        return events
+
+    def _symbol_events(self, symbol: str, hist: pd.DataFrame, pattern_type: str, candidates: np.ndarray) -> List[Dict]:
+        """Predictions as the live tracker would have made them on each detection bar, then the outcomes"""
+        _, build, fields, _, _ = self.tracker.pattern_scans[pattern_type]
+        lag = self.sweep.detection_lags[pattern_type]
+        arrays = {field: hist[field].values for field in ('Close', 'High', 'Low', 'Volume')}
+        frame = None
+
+        events = []
+        for i in candidates:
+            k = int(i) + lag
+            # The tracker only ever sees the trailing lookback window ending at the detection bar
+            start = max(0, k + 1 - self.lookback)
+            visible = hist.iloc[start:k + 1]
+
+            pattern = getattr(self.tracker, build)(visible, *[arrays[field][start:k + 1] for field in fields], int(i) - start)
+            if not pattern:
+                continue
+
+            frame = frame or self._symbol_frame(hist)
+            features = self._features_at(frame, visible, start, k)
+            evolution = self.tracker.calculate_pattern_evolution(visible, pattern, features)
+            prediction = self.tracker.predict_breakout_timing(visible, pattern, evolution, features)
+            levels = prediction.get('key_levels') or {}
+            current_price = features['current_price']
+
+            events.append({
+                'symbol': symbol,
+                'pattern_type': pattern_type,
+                'bar': k,
+                'date': hist.index[k].isoformat(),
+                'confidence': float(pattern['confidence']),
+                'predicted_breakout_5d': float(prediction['breakout_probability_next_5_days']),
+                'direction_bias': float(prediction['direction_bias']),
+                'resistance': float(levels.get('resistance', current_price * 1.02)),
+                'support': float(levels.get('support', current_price * 0.98))
+            })
+
+        self._attach_outcomes(events, arrays['Close'])
+        return events
+
+    def _symbol_frame(self, hist: pd.DataFrame) -> Dict[str, np.ndarray]:
+        """Rolling series over the symbol's whole history, computed once and sliced per detection"""
+        closes = hist['Close']
+        volumes = hist['Volume']
+        returns = closes.pct_change()
+        trend_slope, trend_r_squared = self.tracker._rolling_linregress(closes.values, 20)
+        return {
+            'returns': returns.values,
+            'volatility_10': returns.rolling(10).std().values,
+            'volatility_50': returns.rolling(50).std().values,
+            'rsi': ta.momentum.rsi(closes).values,
+            'high_volume': (volumes > volumes.rolling(20).mean() * 1.5).values,
+            'recent_trend': trend_slope / closes.values[:len(trend_slope)] * 20 * trend_r_squared
+        }
+
+    def _features_at(self, frame: Dict[str, np.ndarray], visible: pd.DataFrame, start: int, k: int) -> Dict:
+        """The tracker's build_feature_frame for bars start..k, read from the symbol-wide series.
+
+        Rolling values are only taken where the visible window alone would have produced them, so every
+        feature matches the truncated computation except RSI, which arrives already warmed up.
+        """
+        end = k + 1
+        closes = visible['Close'].values
+        highs = visible['High'].values
+        lows = visible['Low'].values
+        volumes = visible['Volume'].values
+
+        returns = frame['returns'][start:end].copy()
+        returns[0] = np.nan
+        volatility_10 = frame['volatility_10'][start:end].copy()
+        volatility_10[:10] = np.nan
+        volatility_50 = frame['volatility_50'][start + 50:end]
+        high_volume = frame['high_volume'][start:end].copy()
+        high_volume[:19] = False
+
+        if end - start >= 20:
+            recent_trend = frame['recent_trend'][k - 19]
+        else:
+            recent_trend = self.tracker.calculate_recent_trend(visible, 20)
+
+        return {
+            'index': visible.index,
+            'closes': closes,
+            'highs': highs,
+            'lows': lows,
+            'volumes': volumes,
+            'returns': returns,
+            'volatility_10': volatility_10,
+            'historical_volatility': volatility_50.mean() if volatility_50.size else np.nan,
+            'rsi': frame['rsi'][start:end],
+            'current_price': closes[-1],
+            'volume_ma_10': volumes[-10:].mean(),
+            'volume_ma_30': volumes[-30:].mean(),
+            'range_5': highs[-5:].max() - lows[-5:].min(),
+            'range_30': highs[-30:].max() - lows[-30:].min(),
+            'high_20': highs[-20:].max(),
+            'low_20': lows[-20:].min(),
+            'volume_resistance': highs[high_volume].max() if high_volume.any() else None,
+            'volume_support': lows[high_volume].min() if high_volume.any() else None,
+            'recent_trend': recent_trend
+        }
+
+    def _attach_outcomes(self, events: List[Dict], closes: np.ndarray):
+        """Forward returns and breakout realization for a symbol's events, as array operations"""
+        if not events:
+            return
+
+        bars = np.array([event['bar'] for event in events])
+        forward = self.sweep.forward_returns(closes)
+
+        # Closes on the breakout_window bars after each bar; NaN past the end of the data
+        padded = np.concatenate((closes[1:], np.full(self.breakout_window, np.nan)))
+        ahead = sliding_window_view(padded, self.breakout_window)[bars]
+        resistance = np.array([event['resistance'] for event in events])[:, None] * (1 + self.price_confirmation)
+        support = np.array([event['support'] for event in events])[:, None] * (1 - self.price_confirmation)
+
+        complete = ~np.isnan(ahead).any(axis=1)
+        up = ahead > resistance
+        down = ahead < support
+        first_up = np.where(up.any(axis=1), up.argmax(axis=1), self.breakout_window)
+        first_down = np.where(down.any(axis=1), down.argmax(axis=1), self.breakout_window)
+
+        for e, event in enumerate(events):
+            for horizon, values in forward.items():
+                value = values[bars[e]]
+                event[f'return_{horizon}d'] = None if np.isnan(value) else round(float(value), 5)
+            if not complete[e]:
+                event['breakout_5d'] = None
+                event['breakout_direction'] = None
+                continue
+            event['breakout_5d'] = bool(first_up[e] < self.breakout_window or first_down[e] < self.breakout_window)
+            if not event['breakout_5d']:
+                event['breakout_direction'] = None
+            else:
+                event['breakout_direction'] = 'up' if first_up[e] <= first_down[e] else 'down'
+
+    # Scoring
+
+    def _return_stats(self, values: np.ndarray) -> Dict:
+        values = values[~np.isnan(values)]
+        if not values.size:
+            return {'count': 0, 'mean_return': None, 'median_return': None, 'win_rate': None}
+        return {
+            'count': int(values.size),
+            'mean_return': round(float(values.mean()), 5),
+            'median_return': round(float(np.median(values)), 5),
+            'win_rate': round(float((values > 0).mean()), 3)
+        }
+
+    def score_events(self, events: List[Dict]) -> Dict:
+        """Forward-return statistics and calibration of the 5-day breakout probability"""
+        if not events:
+            return {'events': 0}
+
+        frame = pd.DataFrame(events)
+        summary = {
+            'events': len(frame),
+            'forward_returns': {},
+        }
+        for horizon in self.horizons:
+            summary['forward_returns'][f'{horizon}d'] = self._return_stats(
+                frame[f'return_{horizon}d'].astype(float).values)
+
+        scored = frame[frame['breakout_5d'].notna()]
+        if scored.empty:
+            return summary
+
+        predicted = scored['predicted_breakout_5d'].values.astype(float)
+        realized = scored['breakout_5d'].values.astype(float)
+        buckets = np.clip(np.digitize(predicted, self.calibration_buckets[1:-1]), 0, len(self.calibration_buckets) - 2)
+
+        calibration = []
+        for b in np.unique(buckets):
+            in_bucket = buckets == b
+            calibration.append({
+                'bucket': f"{self.calibration_buckets[b]:.1f}-{self.calibration_buckets[b + 1]:.1f}",
+                'count': int(in_bucket.sum()),
+                'mean_predicted': round(float(predicted[in_bucket].mean()), 3),
+                'realized_rate': round(float(realized[in_bucket].mean()), 3)
+            })
+
+        directions = scored['breakout_direction']
+        summary.update({
+            'scored_events': int(len(scored)),
+            'mean_predicted_breakout_5d': round(float(predicted.mean()), 3),
+            'realized_breakout_rate_5d': round(float(realized.mean()), 3),
+            'upside_breakout_rate_5d': round(float((directions == 'up').mean()), 3),
+            'downside_breakout_rate_5d': round(float((directions == 'down').mean()), 3),
+            'brier_score': round(float(np.mean((predicted - realized) ** 2)), 4),
+            'calibration': calibration
+        })
+        return summary
+
+    # Entry point
+
+    def run(self, symbols: Optional[List[str]] = None, histories: Optional[Dict] = None,
+            pattern_types: Optional[List[str]] = None, period: str = "5y",
+            workers: Optional[int] = None, include_events: bool = False) -> Dict:
+        """Backtest the detectors over a universe; results per pattern type and overall"""
+        started = time.time()
+        if histories is None:
+            histories = self.tracker.fetch_universe_history(symbols or [], period)
+        pattern_types = pattern_types or list(self.tracker.pattern_scans)
+        workers = workers if workers is not None else (os.cpu_count() or 1)
+
+        if workers > 1 and len(histories) > workers:
+            events = self._replay_parallel(histories, pattern_types, workers)
+        else:
+            events = self._replay_histories(histories, pattern_types)
+        order = {symbol: position for position, symbol in enumerate(histories)}
+        events.sort(key=lambda event: (order[event['symbol']], event['bar'], event['pattern_type']))
+
+        by_pattern = {}
+        for pattern_type in pattern_types:
+            by_pattern[pattern_type] = self.score_events([e for e in events if e['pattern_type'] == pattern_type])
+
+        duration = time.time() - started
+        logging.info(f"Pattern event study: {len(events)} detections over {len(histories)} symbols in {duration:.1f}s")
+
+        report = {
+            'symbols': len(histories),
+            'horizons': list(self.horizons),
+            'overall': self.score_events(events),
+            'by_pattern': by_pattern,
+            'duration_seconds': round(duration, 2),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+        if include_events:
+            report['events'] = events
+        return report
+
+    def _replay_parallel(self, histories: Dict, pattern_types: List[str], workers: int) -> List[Dict]:
+        """Shard the universe across a process pool"""
+        symbols = list(histories)
+        shards = [{symbol: histories[symbol] for symbol in symbols[k::workers]} for k in range(workers)]
+        settings = (self.horizons, self.lookback, self.breakout_window)
+
+        events = []
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for shard_events in executor.map(_event_study_shard, shards, [pattern_types] * workers, [settings] * workers):
+                    events.extend(shard_events)
+        except Exception as e:
+            logging.error(f"Parallel event study failed, replaying in-process: {e}")
+            return self._replay_histories(histories, pattern_types)
+
+        return events
+
+def _event_study_shard(histories, pattern_types, settings):
+    """Process pool entry point: replay one shard of the universe"""
+    horizons, lookback, breakout_window = settings
+    study = PatternEventStudy(horizons=horizons, lookback=lookback, breakout_window=breakout_window)
+    return study._replay_histories(histories, pattern_types)
+
+if __name__ == "__main__":
+    # Offline backtest over the scanner's market universe
+    from stock_scanner import StockScanner
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(PatternEventStudy().run(StockScanner().get_comprehensive_market_universe(500)), indent=2))
@@ -1,5 +1,6 @@
 import yfinance as yf
 import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
 import pandas as pd
 import ta
 from datetime import datetime, timedelta
@@ -7,6 +8,13 @@ import logging
 from scipy import stats
 from sklearn.metrics.pairwise import cosine_similarity
 import json
+import os
+from concurrent.futures import ProcessPoolExecutor
+from market_data_engine import download_histories
+from pattern_result_cache import PatternResultCache
+
+# Bump when detector or evolution logic changes so cached results are recomputed
+PATTERN_LOGIC_VERSION = 1
 
 class PatternEvolutionTracker:
     def __init__(self):
@@ -45,60 +53,122 @@ class PatternEvolutionTracker:
             }
         }
         
+        # pattern type -> (screen, exact check, fields, first candidate index, minimum bars)
+        self.pattern_scans = {
+            'bull_flag': ('_screen_bull_flag', '_build_bull_flag', ('Close', 'Volume'), 20, 36),
+            'cup_and_handle': ('_screen_cup_and_handle', '_build_cup_and_handle', ('Close',), 30, 50),
+            'ascending_triangle': ('_screen_ascending_triangle', '_build_ascending_triangle', ('High', 'Low'), 20, 21),
+            'descending_triangle': ('_screen_descending_triangle', '_build_descending_triangle', ('High', 'Low'), 20, 21),
+            'symmetrical_triangle': ('_screen_symmetrical_triangle', '_build_symmetrical_triangle', ('High', 'Low'), 15, 16)
+        }
+        
         self.breakout_signals = {
             'volume_confirmation': 1.5,    # 50% above average
             'price_confirmation': 0.02,    # 2% beyond resistance/support
             'momentum_threshold': 0.6,     # RSI or similar
             'pattern_maturity': 0.8        # 80% pattern completion
         }
+        
+        # Results only change when a new bar arrives or the templates change
+        self.result_cache = PatternResultCache()
+        self.template_version = PatternResultCache.template_version(
+            PATTERN_LOGIC_VERSION, self.pattern_templates, self.breakout_signals
+        )
 
-    def track_pattern_evolution(self, symbol, pattern_type=None):
+    def track_pattern_evolution(self, symbol, pattern_type=None, hist=None):
         """Track how a pattern is evolving and predict breakout timing"""
         try:
-            # Get extended historical data
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period="6mo", interval="1d")
+            # Get extended historical data unless the caller already has it
+            if hist is None:
+                cached = self.result_cache.get_current(symbol, pattern_type, self.template_version)
+                if cached is not None:
+                    return cached
+                
+                ticker = yf.Ticker(symbol)
+                hist = ticker.history(period="6mo", interval="1d")
             
             if hist.empty:
                 return None
             
+            cached = self.result_cache.get(symbol, pattern_type, hist.index[-1], self.template_version)
+            if cached is not None:
+                return cached
+            
             # Detect active patterns
             if pattern_type:
                 patterns = [self.analyze_specific_pattern(hist, pattern_type)]
             else:
                 patterns = self.detect_all_patterns(hist)
             
-            evolution_data = []
-            
-            for pattern in patterns:
-                if pattern and pattern['confidence'] > 0.6:
-                    evolution = self.calculate_pattern_evolution(hist, pattern)
-                    breakout_prediction = self.predict_breakout_timing(hist, pattern, evolution)
-                    
-                    evolution_data.append({
-                        'pattern_type': pattern['type'],
-                        'confidence': pattern['confidence'],
-                        'evolution': evolution,
-                        'breakout_prediction': breakout_prediction,
-                        'current_stage': pattern.get('stage', 'unknown'),
-                        'completion_percentage': pattern.get('completion', 0),
-                        'time_in_pattern': pattern.get('duration', 0)
-                    })
-            
-            # Convert all data to JSON-serializable types
-            serialized_data = {
-                'symbol': symbol,
-                'timestamp': datetime.now().isoformat(),
-                'patterns': self._serialize_patterns(evolution_data),
-                'overall_breakout_probability': float(self.calculate_overall_breakout_probability(evolution_data))
-            }
-            
-            return serialized_data
+            report = self.build_evolution_report(symbol, hist, patterns)
+            self.result_cache.put(symbol, pattern_type, hist.index[-1], self.template_version, report)
+            return report
             
         except Exception as e:
             logging.error(f"Error tracking pattern evolution for {symbol}: {e}")
             return None
 
+    def track_universe_evolution(self, symbols, pattern_types=None, period="6mo", workers=None, histories=None):
+        """Track pattern evolution for many symbols from one batched download and one universe scan"""
+        cache_key = ','.join(sorted(pattern_types)) if pattern_types else None
+        if histories is None:
+            histories = self.fetch_universe_history(self.stale_symbols(symbols, cache_key), period)
+        
+        reports = {}
+        to_scan = {}
+        for symbol in symbols:
+            hist = histories.get(symbol)
+            if hist is None or hist.empty:
+                cached = self.result_cache.get_current(symbol, cache_key, self.template_version)
+            else:
+                cached = self.result_cache.get(symbol, cache_key, hist.index[-1], self.template_version)
+                if cached is None:
+                    to_scan[symbol] = hist
+            if cached is not None:
+                reports[symbol] = cached
+        
+        universe_patterns = self.scan_universe(histories=to_scan, pattern_types=pattern_types, workers=workers)
+        for symbol, patterns in universe_patterns.items():
+            try:
+                hist = histories[symbol]
+                reports[symbol] = self.build_evolution_report(symbol, hist, patterns)
+                self.result_cache.put(symbol, cache_key, hist.index[-1], self.template_version, reports[symbol])
+            except Exception as e:
+                logging.error(f"Error tracking pattern evolution for {symbol}: {e}")
+        return reports
+
+    def stale_symbols(self, symbols, pattern_type=None):
+        """Symbols without cached results for the latest session, i.e. the ones worth downloading"""
+        return self.result_cache.stale_symbols(symbols, pattern_type, self.template_version)
+
+    def build_evolution_report(self, symbol, hist, patterns):
+        """Evolution and breakout prediction for each detected pattern, in JSON-serializable form"""
+        evolution_data = []
+        features = self.build_feature_frame(hist)
+        
+        for pattern in patterns:
+            if pattern and pattern['confidence'] > 0.6:
+                evolution = self.calculate_pattern_evolution(hist, pattern, features)
+                breakout_prediction = self.predict_breakout_timing(hist, pattern, evolution, features)
+                
+                evolution_data.append({
+                    'pattern_type': pattern['type'],
+                    'confidence': pattern['confidence'],
+                    'evolution': evolution,
+                    'breakout_prediction': breakout_prediction,
+                    'current_stage': pattern.get('stage', 'unknown'),
+                    'completion_percentage': pattern.get('completion', 0),
+                    'time_in_pattern': pattern.get('duration', 0)
+                })
+        
+        # Convert all data to JSON-serializable types
+        return {
+            'symbol': symbol,
+            'timestamp': datetime.now().isoformat(),
+            'patterns': self._serialize_patterns(evolution_data),
+            'overall_breakout_probability': float(self.calculate_overall_breakout_probability(evolution_data))
+        }
+
     def _serialize_patterns(self, patterns):
         """Convert patterns data to JSON-serializable format"""
         serialized = []
@@ -163,263 +233,520 @@ class PatternEvolutionTracker:
         
         return patterns
 
+    def _prefix_sums(self, values):
+        """Cumulative sums along the last axis with a leading zero"""
+        zeros = np.zeros(values.shape[:-1] + (1,))
+        return np.concatenate((zeros, np.cumsum(values, axis=-1)), axis=-1)
+
+    def _rolling_linregress(self, values, window):
+        """Slope and R-squared of a least-squares line over every sliding window along the last axis; NaN where a window has gaps"""
+        y = np.asarray(values, dtype=float)
+        n = y.shape[-1]
+        count = n - window + 1
+        if count < 1:
+            empty = np.empty(y.shape[:-1] + (0,))
+            return empty, empty
+        
+        # Centring keeps the cumulative sums well conditioned; slope and R-squared are shift invariant
+        missing = np.isnan(y)
+        present = np.maximum((~missing).sum(axis=-1, keepdims=True), 1)
+        filled = np.where(missing, 0.0, y)
+        y = np.where(missing, 0.0, filled - filled.sum(axis=-1, keepdims=True) / present)
+        positions = np.arange(n, dtype=float)
+        
+        cum_y = self._prefix_sums(y)
+        cum_yy = self._prefix_sums(y * y)
+        cum_iy = self._prefix_sums(positions * y)
+        cum_missing = self._prefix_sums(missing.astype(float))
+        
+        window_y = cum_y[..., window:] - cum_y[..., :count]
+        window_yy = cum_yy[..., window:] - cum_yy[..., :count]
+        # Shift global positions so x runs 0..window-1 inside each window
+        window_xy = (cum_iy[..., window:] - cum_iy[..., :count]) - np.arange(count) * window_y
+        has_gap = (cum_missing[..., window:] - cum_missing[..., :count]) > 0
+        
+        x_mean = (window - 1) / 2
+        ss_x = window * (window ** 2 - 1) / 12
+        ss_xy = window_xy - x_mean * window_y
+        ss_y = window_yy - window_y ** 2 / window
+        
+        slopes = np.where(has_gap, np.nan, ss_xy / ss_x)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            r_squared = np.clip(np.where(ss_y > 0, ss_xy ** 2 / (ss_x * ss_y), 0.0), 0.0, 1.0)
+        return slopes, np.where(has_gap, np.nan, r_squared)
+
+    def _slope_tolerance(self, values):
+        """Bound on round-off in rolling slopes; screening is loosened by this much and survivors re-checked exactly"""
+        values = np.abs(np.asarray(values, dtype=float))
+        return 1e-9 * (np.where(np.isnan(values), 0.0, values).max(axis=-1, keepdims=True, initial=0.0) + 1.0)
+
+    def _detect_pattern(self, hist, pattern_type):
+        """Screen every window of one history at once, then confirm candidates in order with the exact check"""
+        screen, build, fields, first_index, min_bars = self.pattern_scans[pattern_type]
+        if len(hist) < min_bars:
+            return None
+        
+        arrays = [hist[field].values for field in fields]
+        candidates = getattr(self, screen)(*arrays)
+        for i in np.flatnonzero(candidates) + first_index:
+            pattern = getattr(self, build)(hist, *arrays, i)
+            if pattern:
+                return pattern
+        
+        return None
+
     def detect_bull_flag(self, hist):
         """Detect bull flag pattern with evolution tracking"""
         try:
-            closes = hist['Close'].values
-            volumes = hist['Volume'].values
-            highs = hist['High'].values
-            lows = hist['Low'].values
-            
-            # Look for flagpole (strong upward move)
-            for i in range(20, len(closes) - 15):
-                # Check for flagpole
-                flagpole_start = i - 20
-                flagpole_end = i
-                
-                flagpole_gain = (closes[flagpole_end] - closes[flagpole_start]) / closes[flagpole_start]
-                
-                if flagpole_gain > 0.15:  # 15% minimum gain
-                    # Look for flag consolidation
-                    flag_period = closes[flagpole_end:flagpole_end + 15]
-                    if len(flag_period) < 5:
-                        continue
-                    
-                    flag_high = max(flag_period)
-                    flag_low = min(flag_period)
-                    flag_range = (flag_high - flag_low) / flag_high
-                    
-                    # Check consolidation criteria
-                    if flag_range < 0.08:  # Tight consolidation
-                        volume_trend = self.calculate_volume_trend(volumes[flagpole_end:flagpole_end + 10])
-                        
-                        pattern = {
-                            'type': 'bull_flag',
-                            'start_date': hist.index[flagpole_start].isoformat(),
-                            'flagpole_end': hist.index[flagpole_end].isoformat(),
-                            'current_date': hist.index[-1].isoformat(),
-                            'flagpole_gain': float(flagpole_gain),
-                            'consolidation_range': float(flag_range),
-                            'volume_declining': bool(volume_trend < -0.1),
-                            'confidence': float(self.calculate_bull_flag_confidence(flagpole_gain, flag_range, volume_trend)),
-                            'stage': self.determine_flag_stage(hist.index[flagpole_end:], flag_period),
-                            'completion': float(min(len(flag_period) / 15, 1.0)),
-                            'duration': int(len(flag_period))
-                        }
-                        
-                        if pattern['confidence'] > 0.6:
-                            return pattern
-            
-            return None
-            
+            return self._detect_pattern(hist, 'bull_flag')
         except Exception as e:
             logging.error(f"Error detecting bull flag: {e}")
             return None
 
+    def _screen_bull_flag(self, closes, volumes):
+        """Flagpole ends from index 20 whose windows could hold a bull flag"""
+        closes = np.asarray(closes, dtype=float)
+        n = closes.shape[-1]
+        
+        # Flagpole ends at i for i in 20..n-16; the flag is the 15 closes from i
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flagpole_gain = (closes[..., 20:n - 15] - closes[..., :n - 35]) / closes[..., :n - 35]
+            flag_windows = sliding_window_view(closes, 15, axis=-1)[..., 20:n - 15, :]
+            flag_high = flag_windows.max(axis=-1)
+            flag_range = (flag_high - flag_windows.min(axis=-1)) / flag_high
+        
+        slopes, r_squared = self._rolling_linregress(volumes, 10)
+        volume_trend = (slopes * r_squared)[..., 20:n - 15]
+        tolerance = self._slope_tolerance(volumes)
+        
+        # Upper bound of calculate_bull_flag_confidence
+        confidence = (np.minimum(flagpole_gain * 100, 40) +
+                      np.maximum(0, 30 - (flag_range * 1000)) +
+                      np.where(volume_trend < -0.05 + tolerance, 30, np.where(volume_trend < tolerance, 15, 0)))
+        
+        return (flagpole_gain > 0.15) & (flag_range < 0.08) & (confidence / 100 > 0.6)
+
+    def _build_bull_flag(self, hist, closes, volumes, i):
+        """Exact bull flag check and pattern dict for a flagpole ending at index i"""
+        flagpole_start = i - 20
+        flagpole_end = i
+        
+        flagpole_gain = (closes[flagpole_end] - closes[flagpole_start]) / closes[flagpole_start]
+        flag_period = closes[flagpole_end:flagpole_end + 15]
+        
+        flag_high = max(flag_period)
+        flag_low = min(flag_period)
+        flag_range = (flag_high - flag_low) / flag_high
+        
+        volume_trend = self.calculate_volume_trend(volumes[flagpole_end:flagpole_end + 10])
+        
+        pattern = {
+            'type': 'bull_flag',
+            'start_date': hist.index[flagpole_start].isoformat(),
+            'flagpole_end': hist.index[flagpole_end].isoformat(),
+            'current_date': hist.index[-1].isoformat(),
+            'flagpole_gain': float(flagpole_gain),
+            'consolidation_range': float(flag_range),
+            'volume_declining': bool(volume_trend < -0.1),
+            'confidence': float(self.calculate_bull_flag_confidence(flagpole_gain, flag_range, volume_trend)),
+            'stage': self.determine_flag_stage(hist.index[flagpole_end:], flag_period),
+            'completion': float(min(len(flag_period) / 15, 1.0)),
+            'duration': int(len(flag_period))
+        }
+        
+        return pattern if pattern['confidence'] > 0.6 else None
+
     def detect_cup_and_handle(self, hist):
         """Detect cup and handle pattern"""
         try:
-            closes = hist['Close'].values
-            
-            if len(closes) < 50:
-                return None
-            
-            # Look for cup formation (U-shaped recovery)
-            for i in range(30, len(closes) - 20):
-                cup_start = i - 30
-                cup_end = i
-                
-                cup_data = closes[cup_start:cup_end]
-                cup_high = max(cup_data)
-                cup_low = min(cup_data)
-                cup_depth = (cup_high - cup_low) / cup_high
-                
-                # Check if it's a valid cup depth
-                if 0.12 <= cup_depth <= 0.35:
-                    # Check for U-shape (rounding bottom)
-                    low_index = np.argmin(cup_data) + cup_start
-                    
-                    # Look for handle formation
-                    handle_start = cup_end
-                    handle_data = closes[handle_start:handle_start + 15]
-                    
-                    if len(handle_data) > 5:
-                        handle_high = max(handle_data)
-                        handle_low = min(handle_data)
-                        handle_depth = (handle_high - handle_low) / handle_high
-                        
-                        if handle_depth < 0.15:  # Shallow handle
-                            pattern = {
-                                'type': 'cup_and_handle',
-                                'start_date': hist.index[cup_start],
-                                'cup_end': hist.index[cup_end],
-                                'current_date': hist.index[-1],
-                                'cup_depth': cup_depth,
-                                'handle_depth': handle_depth,
-                                'confidence': self.calculate_cup_handle_confidence(cup_depth, handle_depth, len(cup_data)),
-                                'stage': 'handle_formation' if len(handle_data) < 15 else 'mature',
-                                'completion': min(len(handle_data) / 15, 1.0),
-                                'duration': len(cup_data) + len(handle_data)
-                            }
-                            
-                            if pattern['confidence'] > 0.6:
-                                return pattern
-            
-            return None
-            
+            return self._detect_pattern(hist, 'cup_and_handle')
         except Exception as e:
             logging.error(f"Error detecting cup and handle: {e}")
             return None
 
+    def _screen_cup_and_handle(self, closes):
+        """Cup ends from index 30 whose windows could hold a cup and handle"""
+        closes = np.asarray(closes, dtype=float)
+        n = closes.shape[-1]
+        
+        # Cup is the 30 closes before i, handle the 15 closes from i, for i in 30..n-21
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cup_windows = sliding_window_view(closes, 30, axis=-1)[..., :n - 50, :]
+            cup_high = cup_windows.max(axis=-1)
+            cup_depth = (cup_high - cup_windows.min(axis=-1)) / cup_high
+            
+            handle_windows = sliding_window_view(closes, 15, axis=-1)[..., 30:n - 20, :]
+            handle_high = handle_windows.max(axis=-1)
+            handle_depth = (handle_high - handle_windows.min(axis=-1)) / handle_high
+        
+        # calculate_cup_handle_confidence with a full 30-day cup
+        confidence = (np.where((cup_depth >= 0.15) & (cup_depth <= 0.25), 40, 25) +
+                      np.where(handle_depth < 0.10, 30, 20) + 30)
+        
+        return (cup_depth >= 0.12) & (cup_depth <= 0.35) & (handle_depth < 0.15) & (confidence / 100 > 0.6)
+
+    def _build_cup_and_handle(self, hist, closes, i):
+        """Exact cup and handle check and pattern dict for a cup ending at index i"""
+        cup_start = i - 30
+        cup_end = i
+        
+        cup_data = closes[cup_start:cup_end]
+        cup_high = max(cup_data)
+        cup_low = min(cup_data)
+        cup_depth = (cup_high - cup_low) / cup_high
+        
+        handle_data = closes[cup_end:cup_end + 15]
+        handle_high = max(handle_data)
+        handle_low = min(handle_data)
+        handle_depth = (handle_high - handle_low) / handle_high
+        
+        pattern = {
+            'type': 'cup_and_handle',
+            'start_date': hist.index[cup_start],
+            'cup_end': hist.index[cup_end],
+            'current_date': hist.index[-1],
+            'cup_depth': cup_depth,
+            'handle_depth': handle_depth,
+            'confidence': self.calculate_cup_handle_confidence(cup_depth, handle_depth, len(cup_data)),
+            'stage': 'handle_formation' if len(handle_data) < 15 else 'mature',
+            'completion': min(len(handle_data) / 15, 1.0),
+            'duration': len(cup_data) + len(handle_data)
+        }
+        
+        return pattern if pattern['confidence'] > 0.6 else None
+
+    def _touch_counts(self, windows, tolerance=0.02, side='resistance'):
+        """Vectorised find_resistance_touches / find_support_touches counts for every window"""
+        if side == 'resistance':
+            level = windows.max(axis=-1, keepdims=True) * (1 - tolerance)
+            return (windows >= level).sum(axis=-1)
+        level = windows.min(axis=-1, keepdims=True) * (1 + tolerance)
+        return (windows <= level).sum(axis=-1)
+
+    def _triangle_confidence_bound(self, touch_counts, slope_strength):
+        """Vectorised calculate_triangle_confidence"""
+        return (np.minimum(touch_counts * 10, 40) +
+                np.minimum(np.abs(slope_strength) * 10000, 30) +
+                np.where(touch_counts >= 3, 30, np.where(touch_counts >= 2, 20, 0))) / 100
+
     def detect_ascending_triangle(self, hist):
         """Detect ascending triangle pattern"""
         try:
-            highs = hist['High'].values
-            lows = hist['Low'].values
-            closes = hist['Close'].values
-            
-            if len(closes) < 20:
-                return None
-            
-            # Look for horizontal resistance and ascending support
-            for i in range(20, len(closes)):
-                period_data = closes[i-20:i]
-                period_highs = highs[i-20:i]
-                period_lows = lows[i-20:i]
-                
-                # Find resistance level (horizontal)
-                resistance_touches = self.find_resistance_touches(period_highs)
-                
-                # Find support trend (ascending)
-                support_slope = self.calculate_support_slope(period_lows)
-                
-                if len(resistance_touches) >= 2 and support_slope > 0:
-                    convergence = self.calculate_triangle_convergence(period_highs, period_lows)
-                    
-                    pattern = {
-                        'type': 'ascending_triangle',
-                        'start_date': hist.index[i-20],
-                        'current_date': hist.index[-1],
-                        'resistance_level': np.mean([period_highs[j] for j in resistance_touches]),
-                        'support_slope': support_slope,
-                        'convergence_progress': convergence,
-                        'confidence': self.calculate_triangle_confidence(resistance_touches, support_slope),
-                        'stage': 'building' if convergence < 0.8 else 'apex_approaching',
-                        'completion': convergence,
-                        'duration': 20
-                    }
-                    
-                    if pattern['confidence'] > 0.6:
-                        return pattern
-            
-            return None
-            
+            return self._detect_pattern(hist, 'ascending_triangle')
         except Exception as e:
             logging.error(f"Error detecting ascending triangle: {e}")
             return None
 
+    def _screen_ascending_triangle(self, highs, lows):
+        """Window ends from index 20 whose preceding 20 bars could hold an ascending triangle"""
+        highs = np.asarray(highs, dtype=float)
+        n = highs.shape[-1]
+        
+        # Windows cover the 20 bars before i, for i in 20..n-1
+        high_windows = sliding_window_view(highs, 20, axis=-1)[..., :n - 20, :]
+        resistance_touches = self._touch_counts(high_windows, side='resistance')
+        
+        support_slope, _ = self._rolling_linregress(lows, 20)
+        support_slope = support_slope[..., :n - 20]
+        tolerance = self._slope_tolerance(lows)
+        
+        confidence = self._triangle_confidence_bound(resistance_touches, np.abs(support_slope) + tolerance)
+        return (resistance_touches >= 2) & (support_slope > -tolerance) & (confidence > 0.6)
+
+    def _build_ascending_triangle(self, hist, highs, lows, i):
+        """Exact ascending triangle check and pattern dict for the 20 bars before index i"""
+        period_highs = highs[i-20:i]
+        period_lows = lows[i-20:i]
+        
+        # Find resistance level (horizontal)
+        resistance_touches = self.find_resistance_touches(period_highs)
+        
+        # Find support trend (ascending)
+        support_slope = self.calculate_support_slope(period_lows)
+        
+        if not (len(resistance_touches) >= 2 and support_slope > 0):
+            return None
+        
+        convergence = self.calculate_triangle_convergence(period_highs, period_lows)
+        
+        pattern = {
+            'type': 'ascending_triangle',
+            'start_date': hist.index[i-20],
+            'current_date': hist.index[-1],
+            'resistance_level': np.mean([period_highs[j] for j in resistance_touches]),
+            'support_slope': support_slope,
+            'convergence_progress': convergence,
+            'confidence': self.calculate_triangle_confidence(resistance_touches, support_slope),
+            'stage': 'building' if convergence < 0.8 else 'apex_approaching',
+            'completion': convergence,
+            'duration': 20
+        }
+        
+        return pattern if pattern['confidence'] > 0.6 else None
+
     def detect_descending_triangle(self, hist):
         """Detect descending triangle pattern"""
         try:
-            highs = hist['High'].values
-            lows = hist['Low'].values
-            closes = hist['Close'].values
-            
-            if len(closes) < 20:
-                return None
-            
-            # Look for horizontal support and descending resistance
-            for i in range(20, len(closes)):
-                period_data = closes[i-20:i]
-                period_highs = highs[i-20:i]
-                period_lows = lows[i-20:i]
-                
-                # Find support level (horizontal)
-                support_touches = self.find_support_touches(period_lows)
-                
-                # Find resistance trend (descending)
-                resistance_slope = self.calculate_resistance_slope(period_highs)
-                
-                if len(support_touches) >= 2 and resistance_slope < 0:
-                    convergence = self.calculate_triangle_convergence(period_highs, period_lows)
-                    
-                    pattern = {
-                        'type': 'descending_triangle',
-                        'start_date': hist.index[i-20],
-                        'current_date': hist.index[-1],
-                        'support_level': np.mean([period_lows[j] for j in support_touches]),
-                        'resistance_slope': resistance_slope,
-                        'convergence_progress': convergence,
-                        'confidence': self.calculate_triangle_confidence(support_touches, abs(resistance_slope)),
-                        'stage': 'building' if convergence < 0.8 else 'apex_approaching',
-                        'completion': convergence,
-                        'duration': 20
-                    }
-                    
-                    if pattern['confidence'] > 0.6:
-                        return pattern
-            
-            return None
-            
+            return self._detect_pattern(hist, 'descending_triangle')
         except Exception as e:
             logging.error(f"Error detecting descending triangle: {e}")
             return None
 
+    def _screen_descending_triangle(self, highs, lows):
+        """Window ends from index 20 whose preceding 20 bars could hold a descending triangle"""
+        lows = np.asarray(lows, dtype=float)
+        n = lows.shape[-1]
+        
+        # Windows cover the 20 bars before i, for i in 20..n-1
+        low_windows = sliding_window_view(lows, 20, axis=-1)[..., :n - 20, :]
+        support_touches = self._touch_counts(low_windows, side='support')
+        
+        resistance_slope, _ = self._rolling_linregress(highs, 20)
+        resistance_slope = resistance_slope[..., :n - 20]
+        tolerance = self._slope_tolerance(highs)
+        
+        confidence = self._triangle_confidence_bound(support_touches, np.abs(resistance_slope) + tolerance)
+        return (support_touches >= 2) & (resistance_slope < tolerance) & (confidence > 0.6)
+
+    def _build_descending_triangle(self, hist, highs, lows, i):
+        """Exact descending triangle check and pattern dict for the 20 bars before index i"""
+        period_highs = highs[i-20:i]
+        period_lows = lows[i-20:i]
+        
+        # Find support level (horizontal)
+        support_touches = self.find_support_touches(period_lows)
+        
+        # Find resistance trend (descending)
+        resistance_slope = self.calculate_resistance_slope(period_highs)
+        
+        if not (len(support_touches) >= 2 and resistance_slope < 0):
+            return None
+        
+        convergence = self.calculate_triangle_convergence(period_highs, period_lows)
+        
+        pattern = {
+            'type': 'descending_triangle',
+            'start_date': hist.index[i-20],
+            'current_date': hist.index[-1],
+            'support_level': np.mean([period_lows[j] for j in support_touches]),
+            'resistance_slope': resistance_slope,
+            'convergence_progress': convergence,
+            'confidence': self.calculate_triangle_confidence(support_touches, abs(resistance_slope)),
+            'stage': 'building' if convergence < 0.8 else 'apex_approaching',
+            'completion': convergence,
+            'duration': 20
+        }
+        
+        return pattern if pattern['confidence'] > 0.6 else None
+
     def detect_symmetrical_triangle(self, hist):
         """Detect symmetrical triangle pattern"""
         try:
-            highs = hist['High'].values
-            lows = hist['Low'].values
-            closes = hist['Close'].values
-            
-            if len(closes) < 15:
-                return None
-            
-            # Look for converging trendlines
-            for i in range(15, len(closes)):
-                period_highs = highs[i-15:i]
-                period_lows = lows[i-15:i]
-                
-                # Calculate trendline slopes
-                resistance_slope = self.calculate_resistance_slope(period_highs)
-                support_slope = self.calculate_support_slope(period_lows)
-                
-                # Check for convergence (negative resistance slope, positive support slope)
-                if resistance_slope < -0.001 and support_slope > 0.001:
-                    convergence = self.calculate_triangle_convergence(period_highs, period_lows)
-                    
-                    pattern = {
-                        'type': 'symmetrical_triangle',
-                        'start_date': hist.index[i-15],
-                        'current_date': hist.index[-1],
-                        'resistance_slope': resistance_slope,
-                        'support_slope': support_slope,
-                        'convergence_progress': convergence,
-                        'confidence': self.calculate_symmetrical_triangle_confidence(resistance_slope, support_slope),
-                        'stage': 'building' if convergence < 0.7 else 'apex_approaching',
-                        'completion': convergence,
-                        'duration': 15
-                    }
-                    
-                    if pattern['confidence'] > 0.6:
-                        return pattern
-            
-            return None
-            
+            return self._detect_pattern(hist, 'symmetrical_triangle')
         except Exception as e:
             logging.error(f"Error detecting symmetrical triangle: {e}")
             return None
 
-    def calculate_pattern_evolution(self, hist, pattern):
+    def _screen_symmetrical_triangle(self, highs, lows):
+        """Window ends from index 15 whose preceding 15 bars could hold a symmetrical triangle"""
+        n = np.shape(highs)[-1]
+        
+        # Windows cover the 15 bars before i, for i in 15..n-1
+        resistance_slope, _ = self._rolling_linregress(highs, 15)
+        support_slope, _ = self._rolling_linregress(lows, 15)
+        resistance_slope = resistance_slope[..., :n - 15]
+        support_slope = support_slope[..., :n - 15]
+        tolerance = np.maximum(self._slope_tolerance(highs), self._slope_tolerance(lows))
+        
+        # Upper bound of calculate_symmetrical_triangle_confidence
+        slope_balance = np.maximum(0, np.abs(np.abs(resistance_slope) - np.abs(support_slope)) - 2 * tolerance)
+        avg_slope = (np.abs(resistance_slope) + np.abs(support_slope)) / 2 + tolerance
+        confidence = (np.maximum(0, 50 - (slope_balance * 50000)) + np.minimum(avg_slope * 25000, 50)) / 100
+        
+        return (resistance_slope < -0.001 + tolerance) & (support_slope > 0.001 - tolerance) & (confidence > 0.6)
+
+    def _build_symmetrical_triangle(self, hist, highs, lows, i):
+        """Exact symmetrical triangle check and pattern dict for the 15 bars before index i"""
+        period_highs = highs[i-15:i]
+        period_lows = lows[i-15:i]
+        
+        # Calculate trendline slopes
+        resistance_slope = self.calculate_resistance_slope(period_highs)
+        support_slope = self.calculate_support_slope(period_lows)
+        
+        # Check for convergence (negative resistance slope, positive support slope)
+        if not (resistance_slope < -0.001 and support_slope > 0.001):
+            return None
+        
+        convergence = self.calculate_triangle_convergence(period_highs, period_lows)
+        
+        pattern = {
+            'type': 'symmetrical_triangle',
+            'start_date': hist.index[i-15],
+            'current_date': hist.index[-1],
+            'resistance_slope': resistance_slope,
+            'support_slope': support_slope,
+            'convergence_progress': convergence,
+            'confidence': self.calculate_symmetrical_triangle_confidence(resistance_slope, support_slope),
+            'stage': 'building' if convergence < 0.7 else 'apex_approaching',
+            'completion': convergence,
+            'duration': 15
+        }
+        
+        return pattern if pattern['confidence'] > 0.6 else None
+
+    def fetch_universe_history(self, symbols, period="6mo"):
+        """Download daily bars for every symbol in batched requests"""
+        return download_histories(symbols, period)
+
+    def scan_universe(self, symbols=None, histories=None, pattern_types=None, period="6mo", workers=None):
+        """Run the pattern detectors across a whole universe at once; returns active patterns per symbol"""
+        if histories is None:
+            histories = self.fetch_universe_history(symbols, period)
+        pattern_types = pattern_types or list(self.pattern_scans)
+        
+        workers = min(workers or 1, os.cpu_count() or 1)
+        if workers > 1 and len(histories) > workers:
+            return self._scan_universe_parallel(histories, pattern_types, workers)
+        return self._scan_histories(histories, pattern_types)
+
+    def update_universe_scan(self, universe_size=500, workers=None):
+        """Batch job: scan the market universe and store every symbol's active patterns in pattern_scans"""
+        from app import app
+        from models import PatternScan
+        from stock_scanner import StockScanner
+        
+        try:
+            symbols = StockScanner().get_comprehensive_market_universe(universe_size)
+            universe_patterns = self.scan_universe(symbols, workers=workers)
+            scanned_at = datetime.utcnow()
+            # Dates inside the patterns are stored as strings
+            rows = [{'symbol': symbol, 'patterns': json.loads(json.dumps(self._serialize_patterns(patterns), default=str)),
+                     'scanned_at': scanned_at}
+                    for symbol, patterns in universe_patterns.items()]
+            with app.app_context():
+                stored = PatternScan.replace_scan(rows)
+            matched = sum(1 for row in rows if row['patterns'])
+            logging.info(f"Stored pattern scan for {stored} of {len(symbols)} symbols ({matched} with active patterns)")
+            return {'symbols': len(symbols), 'stored': stored, 'matched': matched}
+        except Exception as e:
+            logging.error(f"Error updating universe pattern scan: {e}")
+            return None
+
+    def _scan_universe_parallel(self, histories, pattern_types, workers):
+        """Shard the universe across a process pool"""
+        symbols = list(histories)
+        shards = [{symbol: histories[symbol] for symbol in symbols[k::workers]} for k in range(workers)]
+        
+        shard_results = {}
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for result in executor.map(_scan_universe_shard, shards, [pattern_types] * workers):
+                    shard_results.update(result)
+        except Exception as e:
+            logging.error(f"Parallel universe scan failed, scanning in-process: {e}")
+            return self._scan_histories(histories, pattern_types)
+        
+        return {symbol: shard_results[symbol] for symbol in symbols if symbol in shard_results}
+
+    def _stack_histories(self, histories, symbols, field, length):
+        """Right-align one field of every history into a (symbols, bars) matrix, NaN-padded in front"""
+        matrix = np.full((len(symbols), length), np.nan)
+        for row, symbol in enumerate(symbols):
+            values = histories[symbol][field].values
+            matrix[row, length - len(values):] = values
+        return matrix
+
+    def _scan_histories(self, histories, pattern_types):
+        """Screen every symbol's windows in one pass per pattern, then confirm candidates per symbol"""
+        symbols = [symbol for symbol, hist in histories.items() if hist is not None and not hist.empty]
+        results = {symbol: [] for symbol in symbols}
+        if not symbols:
+            return results
+        
+        # Padding windows are NaN and never pass screening, so row positions map straight back to each history
+        length = max(len(histories[symbol]) for symbol in symbols)
+        matrices = {}
+        
+        for pattern_type in pattern_types:
+            screen, build, fields, first_index, min_bars = self.pattern_scans[pattern_type]
+            if length < min_bars:
+                continue
+            
+            try:
+                for field in fields:
+                    if field not in matrices:
+                        matrices[field] = self._stack_histories(histories, symbols, field, length)
+                candidates = getattr(self, screen)(*[matrices[field] for field in fields])
+            except Exception as e:
+                logging.error(f"Error screening universe for {pattern_type}: {e}")
+                continue
+            
+            for row, symbol in enumerate(symbols):
+                hist = histories[symbol]
+                padding = length - len(hist)
+                arrays = [hist[field].values for field in fields]
+                try:
+                    for i in np.flatnonzero(candidates[row]) + first_index - padding:
+                        pattern = getattr(self, build)(hist, *arrays, i)
+                        if pattern:
+                            results[symbol].append(pattern)
+                            break
+                except Exception as e:
+                    logging.error(f"Error detecting {pattern_type} for {symbol}: {e}")
+        
+        return results
+
+    def build_feature_frame(self, hist):
+        """Per-symbol features computed once and shared by every evolution and timing calculation on these bars"""
+        closes = hist['Close']
+        volumes = hist['Volume']
+        returns = closes.pct_change()
+        highs = hist['High'].values
+        lows = hist['Low'].values
+        
+        high_volume = (volumes > volumes.rolling(20).mean() * 1.5).values
+        
+        return {
+            'index': hist.index,
+            'closes': closes.values,
+            'highs': highs,
+            'lows': lows,
+            'volumes': volumes.values,
+            'returns': returns.values,
+            'volatility_10': returns.rolling(10).std().values,
+            'historical_volatility': returns.rolling(50).std().mean(),
+            'rsi': ta.momentum.rsi(closes).values,
+            'current_price': closes.iloc[-1],
+            'volume_ma_10': volumes.values[-10:].mean(),
+            'volume_ma_30': volumes.values[-30:].mean(),
+            'range_5': highs[-5:].max() - lows[-5:].min(),
+            'range_30': highs[-30:].max() - lows[-30:].min(),
+            'high_20': highs[-20:].max(),
+            'low_20': lows[-20:].min(),
+            'volume_resistance': highs[high_volume].max() if high_volume.any() else None,
+            'volume_support': lows[high_volume].min() if high_volume.any() else None,
+            'recent_trend': self.calculate_recent_trend(hist, 20)
+        }
+
+    def _pattern_start_position(self, features, pattern):
+        """Index of the first bar on or after the pattern start, or None if the pattern has no start"""
+        pattern_start = pattern.get('start_date')
+        if not pattern_start:
+            return None
+        return int(features['index'].searchsorted(pd.Timestamp(pattern_start)))
+
+    def calculate_pattern_evolution(self, hist, pattern, features=None):
         """Calculate how the pattern has evolved over time"""
         try:
+            features = features or self.build_feature_frame(hist)
             evolution = {
                 'pattern_age_days': pattern['duration'],
-                'volatility_trend': self.calculate_volatility_trend(hist, pattern),
-                'volume_trend': self.calculate_volume_trend_in_pattern(hist, pattern),
-                'momentum_change': self.calculate_momentum_change(hist, pattern),
-                'support_resistance_strength': self.calculate_sr_strength(hist, pattern),
-                'breakout_probability_trend': self.calculate_breakout_probability_trend(hist, pattern)
+                'volatility_trend': self.calculate_volatility_trend(features, pattern),
+                'volume_trend': self.calculate_volume_trend_in_pattern(features, pattern),
+                'momentum_change': self.calculate_momentum_change(features, pattern),
+                'support_resistance_strength': self.calculate_sr_strength(pattern),
+                'breakout_probability_trend': self.calculate_breakout_probability_trend(pattern)
             }
             
             return evolution
@@ -428,35 +755,36 @@ class PatternEvolutionTracker:
             logging.error(f"Error calculating pattern evolution: {e}")
             return {}
 
-    def predict_breakout_timing(self, hist, pattern, evolution):
+    def predict_breakout_timing(self, hist, pattern, evolution, features=None):
         """Predict when a breakout is likely to occur with advanced timing analysis"""
         try:
+            features = features or self.build_feature_frame(hist)
             current_stage = pattern.get('stage', 'unknown')
             completion = pattern.get('completion', 0)
+            current_price = features['current_price']
             
             # Advanced volatility compression analysis
-            recent_volatility = hist['Close'].pct_change().rolling(10).std().iloc[-1]
-            historical_volatility = hist['Close'].pct_change().rolling(50).std().mean()
+            recent_volatility = features['volatility_10'][-1]
+            historical_volatility = features['historical_volatility']
             volatility_compression = max(0, 1 - (recent_volatility / historical_volatility)) if historical_volatility > 0 else 0
             
             # Volume pattern analysis for breakout timing
-            volume_ma_short = hist['Volume'][-10:].mean()
-            volume_ma_long = hist['Volume'][-30:].mean()
+            volume_ma_short = features['volume_ma_10']
+            volume_ma_long = features['volume_ma_30']
             volume_ratio = volume_ma_short / volume_ma_long if volume_ma_long > 0 else 1
             
             # Price action tightening analysis
-            price_range_recent = (hist['High'][-5:].max() - hist['Low'][-5:].min()) / hist['Close'].iloc[-1]
-            price_range_historical = (hist['High'][-30:].max() - hist['Low'][-30:].min()) / hist['Close'].iloc[-1]
+            price_range_recent = features['range_5'] / current_price
+            price_range_historical = features['range_30'] / current_price
             price_tightening = max(0, 1 - (price_range_recent / price_range_historical)) if price_range_historical > 0 else 0
             
             # Support/Resistance test frequency for timing urgency
-            current_price = hist['Close'].iloc[-1]
             resistance_level = pattern.get('resistance_level', current_price * 1.02)
             support_level = pattern.get('support_level', current_price * 0.98)
             
             # Count recent tests of key levels (last 10 days)
-            recent_resistance_tests = sum(1 for price in hist['High'][-10:] if abs(price - resistance_level) / resistance_level < 0.015)
-            recent_support_tests = sum(1 for price in hist['Low'][-10:] if abs(price - support_level) / support_level < 0.015)
+            recent_resistance_tests = int(np.count_nonzero(np.abs(features['highs'][-10:] - resistance_level) / resistance_level < 0.015))
+            recent_support_tests = int(np.count_nonzero(np.abs(features['lows'][-10:] - support_level) / support_level < 0.015))
             level_test_frequency = recent_resistance_tests + recent_support_tests
             
             # Pattern-specific urgency calculation
@@ -487,7 +815,7 @@ class PatternEvolutionTracker:
             breakout_prob_10_days = min(0.98, breakout_prob_5_days * 1.25)
             
             # Enhanced direction bias with multiple factors
-            direction_bias = self.calculate_enhanced_direction_bias(hist, pattern, evolution)
+            direction_bias = self.calculate_enhanced_direction_bias(features, pattern, evolution)
             
             # Advanced timing confidence
             timing_confidence = self.calculate_advanced_timing_confidence(
@@ -495,10 +823,10 @@ class PatternEvolutionTracker:
             )
             
             # Comprehensive breakout levels
-            key_levels = self.identify_comprehensive_breakout_levels(hist, pattern, current_price)
+            key_levels = self.identify_comprehensive_breakout_levels(features, pattern, current_price)
             
             # Breakout catalyst identification
-            catalysts = self.identify_breakout_catalysts(hist, pattern, evolution, volatility_compression)
+            catalysts = self.identify_breakout_catalysts(features, pattern, evolution, volatility_compression)
             
             prediction = {
                 'estimated_days_to_breakout': adjusted_days,
@@ -581,11 +909,11 @@ class PatternEvolutionTracker:
         except Exception:
             return 0.5
 
-    def calculate_enhanced_direction_bias(self, hist, pattern, evolution):
+    def calculate_enhanced_direction_bias(self, features, pattern, evolution):
         """Calculate enhanced direction bias with trend and momentum analysis"""
         try:
             # Recent trend analysis
-            recent_trend = self.calculate_recent_trend(hist, 20)
+            recent_trend = features['recent_trend']
             
             # Pattern-specific bias
             pattern_type = pattern.get('type', '')
@@ -648,7 +976,7 @@ class PatternEvolutionTracker:
         except Exception:
             return 0.5
 
-    def identify_comprehensive_breakout_levels(self, hist, pattern, current_price):
+    def identify_comprehensive_breakout_levels(self, features, pattern, current_price):
         """Identify comprehensive breakout and breakdown levels"""
         try:
             levels = {}
@@ -657,22 +985,21 @@ class PatternEvolutionTracker:
             if 'resistance_level' in pattern:
                 levels['resistance'] = pattern['resistance_level']
             else:
-                levels['resistance'] = hist['High'][-20:].max()
+                levels['resistance'] = features['high_20']
                 
             if 'support_level' in pattern:
                 levels['support'] = pattern['support_level']
             else:
-                levels['support'] = hist['Low'][-20:].min()
+                levels['support'] = features['low_20']
             
             # Confirmation levels (beyond pattern levels)
             levels['breakout_confirmation'] = levels['resistance'] * 1.02
             levels['breakdown_confirmation'] = levels['support'] * 0.98
             
             # Volume-based confirmation levels
-            high_volume_days = hist[hist['Volume'] > hist['Volume'].rolling(20).mean() * 1.5]
-            if not high_volume_days.empty:
-                levels['volume_resistance'] = high_volume_days['High'].max()
-                levels['volume_support'] = high_volume_days['Low'].min()
+            if features['volume_resistance'] is not None:
+                levels['volume_resistance'] = features['volume_resistance']
+                levels['volume_support'] = features['volume_support']
             
             # Fibonacci levels around current price
             price_range = levels['resistance'] - levels['support']
@@ -684,7 +1011,7 @@ class PatternEvolutionTracker:
         except Exception:
             return {'resistance': current_price * 1.02, 'support': current_price * 0.98}
 
-    def identify_breakout_catalysts(self, hist, pattern, evolution, volatility_compression):
+    def identify_breakout_catalysts(self, features, pattern, evolution, volatility_compression):
         """Identify potential breakout catalysts"""
         try:
             catalysts = []
@@ -725,7 +1052,7 @@ class PatternEvolutionTracker:
                 })
             
             # Support/resistance test catalyst
-            current_price = hist['Close'].iloc[-1]
+            current_price = features['current_price']
             if 'resistance_level' in pattern:
                 distance_to_resistance = abs(current_price - pattern['resistance_level']) / current_price
                 if distance_to_resistance < 0.02:
@@ -1017,26 +1344,30 @@ class PatternEvolutionTracker:
         else:
             return 0.0  # Mixed signals
 
-    def calculate_volatility_trend(self, hist, pattern):
+    def calculate_volatility_trend(self, features, pattern):
         """Calculate volatility trend within pattern timeframe"""
-        pattern_start = pattern.get('start_date')
-        if not pattern_start:
+        start = self._pattern_start_position(features, pattern)
+        if start is None:
             return 0
         
         try:
-            pattern_data = hist[hist.index >= pattern_start]
-            returns = pattern_data['Close'].pct_change().dropna()
+            # Returns inside the pattern start one bar after its first bar
+            returns = features['returns'][start + 1:]
+            returns = returns[~np.isnan(returns)]
             
             # Calculate rolling volatility
             window = min(10, len(returns) // 2)
             if window < 3:
                 return 0
             
-            rolling_vol = returns.rolling(window=window).std()
+            if window == 10 and len(returns) == len(features['returns']) - start - 1:
+                # Reuse the shared 10-bar volatility for windows that lie inside the pattern
+                y = features['volatility_10'][start + window:]
+            else:
+                y = pd.Series(returns).rolling(window=window).std().dropna().values
             
             # Calculate trend in volatility
-            x = np.arange(len(rolling_vol.dropna()))
-            y = rolling_vol.dropna().values
+            x = np.arange(len(y))
             
             if len(x) < 3:
                 return 0
@@ -1048,15 +1379,14 @@ class PatternEvolutionTracker:
             logging.error(f"Error calculating volatility trend: {e}")
             return 0
 
-    def calculate_volume_trend_in_pattern(self, hist, pattern):
+    def calculate_volume_trend_in_pattern(self, features, pattern):
         """Calculate volume trend within pattern timeframe"""
-        pattern_start = pattern.get('start_date')
-        if not pattern_start:
+        start = self._pattern_start_position(features, pattern)
+        if start is None:
             return 0
         
         try:
-            pattern_data = hist[hist.index >= pattern_start]
-            volumes = pattern_data['Volume'].values
+            volumes = features['volumes'][start:]
             
             return self.calculate_volume_trend(volumes)
             
@@ -1064,25 +1394,22 @@ class PatternEvolutionTracker:
             logging.error(f"Error calculating volume trend in pattern: {e}")
             return 0
 
-    def calculate_momentum_change(self, hist, pattern):
+    def calculate_momentum_change(self, features, pattern):
         """Calculate momentum change within pattern"""
-        pattern_start = pattern.get('start_date')
-        if not pattern_start:
+        start = self._pattern_start_position(features, pattern)
+        if start is None:
             return 0
         
         try:
-            pattern_data = hist[hist.index >= pattern_start]
-            closes = pattern_data['Close']
+            # RSI over the pattern's bars, read from the symbol-wide RSI so it is already warmed up
+            rsi = features['rsi'][start:]
+            y = rsi[~np.isnan(rsi)]
             
-            # Calculate RSI trend
-            rsi = ta.momentum.rsi(closes)
-            
-            if len(rsi.dropna()) < 5:
+            if len(y) < 5:
                 return 0
             
             # Calculate trend in RSI
-            x = np.arange(len(rsi.dropna()))
-            y = rsi.dropna().values
+            x = np.arange(len(y))
             
             slope, _, r_value, _, _ = stats.linregress(x, y)
             return slope * r_value ** 2 / 100  # Normalize to 0-1 range
@@ -1091,7 +1418,7 @@ class PatternEvolutionTracker:
             logging.error(f"Error calculating momentum change: {e}")
             return 0
 
-    def calculate_sr_strength(self, hist, pattern):
+    def calculate_sr_strength(self, pattern):
         """Calculate support/resistance strength"""
         try:
             pattern_type = pattern['type']
@@ -1110,7 +1437,7 @@ class PatternEvolutionTracker:
             logging.error(f"Error calculating S/R strength: {e}")
             return 0.5
 
-    def calculate_breakout_probability_trend(self, hist, pattern):
+    def calculate_breakout_probability_trend(self, pattern):
         """Calculate trend in breakout probability over time"""
         try:
             completion = pattern.get('completion', 0)
@@ -1150,4 +1477,8 @@ class PatternEvolutionTracker:
         elif len(flag_data) < 12:
             return 'building'
         else:
-            return 'mature'
\ No newline at end of file
+            return 'mature'
+
+def _scan_universe_shard(histories, pattern_types):
+    """Process pool entry point: scan one shard of the universe"""
+    return PatternEvolutionTracker()._scan_histories(histories, pattern_types)
@@ -0,0 +1,133 @@
+"""
+Pattern Result Cache
+Cross-process cache of pattern tracking results keyed by symbol, pattern type, last bar and template version
+"""
+
+import json
+import os
+import hashlib
+import time
+import logging
+from datetime import datetime, timedelta, time as dt_time
+from typing import Dict, List, Optional
+
+import pandas as pd
+
+class PatternResultCache:
+    def __init__(self, cache_dir: str = "pattern_cache", intraday_ttl: int = 300):
+        self.cache_dir = cache_dir
+        self.intraday_ttl = intraday_ttl  # the current session's bar keeps changing until the close
+        self.market_open = dt_time(9, 30)
+        self.market_close = dt_time(16, 0)
+        self.hits = 0
+        self.misses = 0
+
+        os.makedirs(self.cache_dir, exist_ok=True)
+
+    @staticmethod
+    def template_version(*templates: Dict) -> str:
+        """Short content hash of the detector templates; changing a template invalidates every entry"""
+        payload = json.dumps(templates, sort_keys=True, default=str)
+        return hashlib.sha1(payload.encode('utf-8')).hexdigest()[:12]
+
+    @staticmethod
+    def session_key(last_bar) -> str:
+        """Session date of a daily bar; tz-aware Ticker.history and tz-naive yf.download bars share one key"""
+        return pd.Timestamp(last_bar).date().isoformat()
+
+    def _cache_file(self, symbol: str, pattern_type: Optional[str]) -> str:
+        return os.path.join(self.cache_dir, f"{symbol}__{pattern_type or 'all'}.json")
+
+    def _read(self, symbol: str, pattern_type: Optional[str]) -> Optional[Dict]:
+        try:
+            with open(self._cache_file(symbol, pattern_type), 'r') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return None
+
+    def latest_session_date(self, now: Optional[datetime] = None):
+        """Date of the most recent daily bar the provider should have (weekends skipped, holidays not)"""
+        now = now or datetime.now()
+        session = now.date()
+        if now.time() < self.market_open:
+            session -= timedelta(days=1)
+        while session.weekday() >= 5:
+            session -= timedelta(days=1)
+        return session
+
+    def _is_fresh(self, entry: Dict, version: str) -> bool:
+        if entry.get('template_version') != version:
+            return False
+        # A bar from today's session is still forming until the close
+        bar_date = pd.Timestamp(entry['last_bar']).date()
+        now = datetime.now()
+        if bar_date >= now.date() and now.time() < self.market_close:
+            return time.time() - entry.get('cached_at', 0) < self.intraday_ttl
+        return True
+
+    def _covers_latest_session(self, entry: Optional[Dict], version: str) -> bool:
+        return bool(entry and self._is_fresh(entry, version) and
+                    pd.Timestamp(entry['last_bar']).date() >= self.latest_session_date())
+
+    def get(self, symbol: str, pattern_type: Optional[str], last_bar, version: str) -> Optional[Dict]:
+        """Cached result computed from a history ending on this last bar's session"""
+        entry = self._read(symbol, pattern_type)
+        if (entry and self.session_key(entry['last_bar']) == self.session_key(last_bar)
+                and self._is_fresh(entry, version)):
+            self.hits += 1
+            return entry['result']
+        self.misses += 1
+        return None
+
+    def get_current(self, symbol: str, pattern_type: Optional[str], version: str) -> Optional[Dict]:
+        """Cached result that already covers the latest session, so no download is needed"""
+        entry = self._read(symbol, pattern_type)
+        if self._covers_latest_session(entry, version):
+            self.hits += 1
+            return entry['result']
+        self.misses += 1
+        return None
+
+    def put(self, symbol: str, pattern_type: Optional[str], last_bar, version: str, result: Dict):
+        """Atomically replace the entry so concurrent readers never see a partial file"""
+        entry = {
+            'symbol': symbol,
+            'pattern_type': pattern_type or 'all',
+            'last_bar': self.session_key(last_bar),
+            'template_version': version,
+            'cached_at': time.time(),
+            'result': result
+        }
+        cache_file = self._cache_file(symbol, pattern_type)
+        tmp_file = f"{cache_file}.{os.getpid()}.tmp"
+        try:
+            with open(tmp_file, 'w') as f:
+                json.dump(entry, f, default=str)
+            os.replace(tmp_file, cache_file)
+        except Exception as e:
+            logging.error(f"Error caching pattern results for {symbol}: {e}")
+            if os.path.exists(tmp_file):
+                os.remove(tmp_file)
+
+    def stale_symbols(self, symbols: List[str], pattern_type: Optional[str], version: str) -> List[str]:
+        """Symbols whose cached results do not cover the latest session yet"""
+        return [symbol for symbol in symbols
+                if not self._covers_latest_session(self._read(symbol, pattern_type), version)]
+
+    def clear(self):
+        """Remove every cached result"""
+        try:
+            for filename in os.listdir(self.cache_dir):
+                if filename.endswith('.json'):
+                    os.remove(os.path.join(self.cache_dir, filename))
+        except Exception as e:
+            logging.error(f"Error clearing pattern cache: {e}")
+
+    def get_stats(self) -> Dict:
+        lookups = self.hits + self.misses
+        return {
+            'entries': len([f for f in os.listdir(self.cache_dir) if f.endswith('.json')]),
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / lookups, 3) if lookups else 0.0
+        }
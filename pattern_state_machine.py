@@ -0,0 +1,291 @@
+"""
+Pattern State Machine
+Persisted per-symbol pattern candidates advanced bar by bar, with stage transitions recorded as events
+"""
+
+import logging
+from datetime import datetime
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import pandas as pd
+import yfinance as yf
+
+from pattern_evolution_tracker import PatternEvolutionTracker
+
+TERMINAL_STAGES = ('breakout', 'breakdown', 'expired')
+
+def naive_timestamp(value) -> pd.Timestamp:
+    """Exchange-local wall-clock timestamp without a timezone, so Ticker.history and yf.download bars compare equal"""
+    timestamp = pd.Timestamp(value)
+    return timestamp.tz_localize(None) if timestamp.tzinfo is not None else timestamp
+
+class PatternStateMachine:
+    def __init__(self, tracker: Optional[PatternEvolutionTracker] = None, max_pattern_bars: int = 60):
+        self.tracker = tracker or PatternEvolutionTracker()
+        self.max_pattern_bars = max_pattern_bars  # bars after the anchor before an unresolved pattern expires
+        self.price_confirmation = self.tracker.breakout_signals['price_confirmation']
+
+        # Bars between the newest complete window of each detector and the latest bar
+        self.latest_window_offsets = {
+            'bull_flag': 16,
+            'cup_and_handle': 21,
+            'ascending_triangle': 1,
+            'descending_triangle': 1,
+            'symmetrical_triangle': 1
+        }
+        # Bars from the pattern start to the detector's candidate index
+        self.start_offsets = {
+            'bull_flag': 20,
+            'cup_and_handle': 30,
+            'ascending_triangle': 20,
+            'descending_triangle': 20,
+            'symmetrical_triangle': 15
+        }
+
+    # Pure state transitions
+
+    def advance(self, symbol: str, hist: pd.DataFrame, state: Optional[Dict] = None) -> Tuple[Dict, List[Dict]]:
+        """Feed every bar newer than the state's last bar through the machine; returns the new state and events"""
+        state = {
+            'last_bar': state.get('last_bar') if state else None,
+            'patterns': dict(state.get('patterns', {})) if state else {}
+        }
+        events = []
+        if hist is None or hist.empty:
+            return state, events
+
+        # Ticker.history bars are tz-aware, yf.download bars are not; everything stored is tz-naive
+        if hist.index.tz is not None:
+            hist = hist.copy()
+            hist.index = hist.index.tz_localize(None)
+
+        if state['last_bar']:
+            new_positions = np.flatnonzero(hist.index > naive_timestamp(state['last_bar']))
+        else:
+            # First sighting: replay the history so the state matches what a bar-by-bar feed would have built
+            new_positions = np.arange(len(hist))
+
+        arrays = {field: hist[field].values for field in ('High', 'Low', 'Close', 'Volume')}
+        for k in new_positions:
+            self._step(symbol, hist, arrays, int(k), state['patterns'], events)
+
+        state['last_bar'] = hist.index[-1].isoformat()
+        return state, events
+
+    def _step(self, symbol: str, hist: pd.DataFrame, arrays: Dict, k: int, patterns: Dict, events: List[Dict]):
+        """Advance active candidates to bar k, then look for a pattern completing at k"""
+        bar_date = hist.index[k]
+
+        for pattern_type, entry in list(patterns.items()):
+            advanced = self._advance_entry(hist, arrays, k, entry)
+            if advanced['stage'] != entry['stage']:
+                events.append(self._event(symbol, pattern_type, entry['stage'], advanced, bar_date))
+            if advanced['stage'] in TERMINAL_STAGES:
+                del patterns[pattern_type]
+            else:
+                patterns[pattern_type] = advanced
+
+        for pattern_type, offset in self.latest_window_offsets.items():
+            if pattern_type in patterns:
+                continue
+            entry = self._detect_at(hist, arrays, k, pattern_type, offset)
+            if entry:
+                patterns[pattern_type] = entry
+                events.append(self._event(symbol, pattern_type, None, entry, bar_date))
+
+    def _detect_at(self, hist: pd.DataFrame, arrays: Dict, k: int, pattern_type: str, offset: int) -> Optional[Dict]:
+        """Run the exact detector check for the one window that bar k completes"""
+        _, build, fields, first_index, min_bars = self.tracker.pattern_scans[pattern_type]
+        n = k + 1
+        i = n - offset
+        if n < min_bars or i < first_index:
+            return None
+
+        try:
+            pattern = getattr(self.tracker, build)(hist.iloc[:n], *[arrays[field][:n] for field in fields], i)
+        except Exception as e:
+            logging.error(f"Error checking {pattern_type} at {hist.index[k]}: {e}")
+            return None
+        if not pattern:
+            return None
+
+        start = i - self.start_offsets[pattern_type]
+        closes, highs, lows = arrays['Close'], arrays['High'], arrays['Low']
+        if pattern_type == 'bull_flag':
+            resistance, support = max(closes[i:i + 15]), min(closes[i:i + 15])
+        elif pattern_type == 'cup_and_handle':
+            resistance, support = max(closes[start:i]), min(closes[i:i + 15])
+        elif pattern_type == 'ascending_triangle':
+            resistance, support = pattern['resistance_level'], min(lows[i - 5:i])
+        elif pattern_type == 'descending_triangle':
+            resistance, support = max(highs[i - 5:i]), pattern['support_level']
+        else:
+            resistance, support = max(highs[i - 5:i]), min(lows[i - 5:i])
+
+        return {
+            'type': pattern_type,
+            'start': hist.index[start].isoformat(),
+            'anchor': hist.index[i].isoformat(),
+            'detected_on': hist.index[k].isoformat(),
+            'stage': pattern['stage'],
+            'confidence': float(pattern['confidence']),
+            'resistance': float(resistance),
+            'support': float(support),
+            'bars_in_pattern': int(n - start)
+        }
+
+    def _advance_entry(self, hist: pd.DataFrame, arrays: Dict, k: int, entry: Dict) -> Dict:
+        """Re-evaluate one candidate over its own bars only"""
+        entry = dict(entry)
+        try:
+            start = hist.index.get_loc(naive_timestamp(entry['start']))
+            anchor = hist.index.get_loc(naive_timestamp(entry['anchor']))
+        except KeyError:
+            # The pattern's bars are no longer in the supplied history
+            entry['stage'] = 'expired'
+            return entry
+
+        close = arrays['Close'][k]
+        entry['bars_in_pattern'] = int(k + 1 - start)
+
+        if close > entry['resistance'] * (1 + self.price_confirmation):
+            entry['stage'] = 'breakout'
+        elif close < entry['support'] * (1 - self.price_confirmation):
+            entry['stage'] = 'breakdown'
+        elif k - anchor > self.max_pattern_bars:
+            entry['stage'] = 'expired'
+        else:
+            entry.update(self._current_stage(arrays, start, anchor, k, entry['type']))
+
+        return entry
+
+    def _current_stage(self, arrays: Dict, start: int, anchor: int, k: int, pattern_type: str) -> Dict:
+        """Stage, and for triangles touches and confidence, over the pattern's bars up to k"""
+        tracker = self.tracker
+        if pattern_type == 'bull_flag':
+            return {'stage': tracker.determine_flag_stage(None, arrays['Close'][anchor:k + 1])}
+        if pattern_type == 'cup_and_handle':
+            return {'stage': 'handle_formation' if k + 1 - anchor < 15 else 'mature'}
+
+        highs = arrays['High'][start:k + 1]
+        lows = arrays['Low'][start:k + 1]
+        convergence = tracker.calculate_triangle_convergence(highs, lows)
+
+        if pattern_type == 'ascending_triangle':
+            touches = tracker.find_resistance_touches(highs)
+            confidence = tracker.calculate_triangle_confidence(touches, tracker.calculate_support_slope(lows))
+            stage = 'building' if convergence < 0.8 else 'apex_approaching'
+        elif pattern_type == 'descending_triangle':
+            touches = tracker.find_support_touches(lows)
+            confidence = tracker.calculate_triangle_confidence(touches, abs(tracker.calculate_resistance_slope(highs)))
+            stage = 'building' if convergence < 0.8 else 'apex_approaching'
+        else:
+            touches = tracker.find_resistance_touches(highs)
+            confidence = tracker.calculate_symmetrical_triangle_confidence(
+                tracker.calculate_resistance_slope(highs), tracker.calculate_support_slope(lows))
+            stage = 'building' if convergence < 0.7 else 'apex_approaching'
+
+        return {
+            'stage': stage,
+            'touches': len(touches),
+            'convergence': float(convergence),
+            'confidence': float(confidence)
+        }
+
+    def _event(self, symbol: str, pattern_type: str, from_stage: Optional[str], entry: Dict, bar_date) -> Dict:
+        return {
+            'symbol': symbol,
+            'pattern_type': pattern_type,
+            'from_stage': from_stage,
+            'to_stage': entry['stage'],
+            'confidence': entry.get('confidence'),
+            'bar_date': bar_date.isoformat()
+        }
+
+    # Persistence (requires an application context)
+
+    def fetch_history(self, symbol: str, period: str = "3mo") -> pd.DataFrame:
+        """Recent daily bars covering every window the machine needs"""
+        return yf.Ticker(symbol).history(period=period, interval="1d")
+
+    def update_symbol(self, symbol: str, hist: Optional[pd.DataFrame] = None) -> Optional[Dict]:
+        """Advance a symbol's stored state with any new bars and record stage transitions"""
+        from app import db
+        from models import PatternState
+
+        try:
+            if hist is None:
+                hist = self.fetch_history(symbol)
+
+            record = PatternState.query.filter_by(symbol=symbol).first()
+            state, events = self.advance(symbol, hist, record.state if record else None)
+
+            if record is None:
+                record = PatternState(symbol=symbol)
+                db.session.add(record)
+            record.state = state
+            record.updated_at = datetime.utcnow()
+            self._record_events(events)
+            db.session.commit()
+
+            return {'symbol': symbol, 'active_patterns': state['patterns'], 'events': events}
+
+        except Exception as e:
+            logging.error(f"Error updating pattern state for {symbol}: {e}")
+            db.session.rollback()
+            return None
+
+    def get_state(self, symbol: str) -> Optional[Dict]:
+        """Stored state without advancing it"""
+        from models import PatternState
+
+        record = PatternState.query.filter_by(symbol=symbol).first()
+        if record is None:
+            return None
+        return {'symbol': symbol, 'active_patterns': record.state.get('patterns', {}), 'events': []}
+
+    def update_universe(self, histories: Dict[str, pd.DataFrame]) -> Dict[str, Dict]:
+        """Advance every symbol from already downloaded histories"""
+        updates = {}
+        for symbol, hist in histories.items():
+            update = self.update_symbol(symbol, hist)
+            if update:
+                updates[symbol] = update
+        return updates
+
+    def _record_events(self, events: List[Dict]):
+        from app import db
+        from models import PatternStageEvent
+
+        for event in events:
+            db.session.add(PatternStageEvent(
+                symbol=event['symbol'],
+                pattern_type=event['pattern_type'],
+                from_stage=event['from_stage'],
+                to_stage=event['to_stage'],
+                confidence=event['confidence'],
+                bar_date=naive_timestamp(event['bar_date']).to_pydatetime()
+            ))
+        if events:
+            logging.info(f"Recorded {len(events)} pattern stage transitions for {events[0]['symbol']}")
+
+    def get_events(self, symbol: str, limit: int = 50) -> List[Dict]:
+        """Most recent stage transitions for a symbol"""
+        from models import PatternStageEvent
+
+        events = PatternStageEvent.query.filter_by(symbol=symbol).order_by(
+            PatternStageEvent.bar_date.desc(), PatternStageEvent.id.desc()
+        ).limit(limit).all()
+
+        return [{
+            'pattern_type': event.pattern_type,
+            'from_stage': event.from_stage,
+            'to_stage': event.to_stage,
+            'confidence': event.confidence,
+            'bar_date': event.bar_date.isoformat(),
+            'recorded_at': event.created_at.isoformat()
+        } for event in events]
+
+# Global instance
+pattern_state_machine = PatternStateMachine()
@@ -0,0 +1,330 @@
+"""
+Pattern Parameter Sweep
+Evaluate grids of detector thresholds across a universe in one vectorized pass per detector
+"""
+
+import os
+import json
+import time
+import logging
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional
+
+import numpy as np
+from numpy.lib.stride_tricks import sliding_window_view
+
+from pattern_evolution_tracker import PatternEvolutionTracker
+
+class PatternParameterSweep:
+    def __init__(self, tracker: Optional[PatternEvolutionTracker] = None, horizons=(5, 10, 20)):
+        self.tracker = tracker or PatternEvolutionTracker()
+        self.horizons = tuple(horizons)
+
+        # Thresholds the live detectors use today
+        self.live_parameters = {
+            'bull_flag': {'flagpole_min_gain': 0.15, 'flag_max_range': 0.08, 'min_confidence': 0.6},
+            'cup_and_handle': {'cup_min_depth': 0.12, 'cup_max_depth': 0.35, 'handle_max_depth': 0.15, 'min_confidence': 0.6},
+            'ascending_triangle': {'min_touches': 2, 'min_confidence': 0.6},
+            'descending_triangle': {'min_touches': 2, 'min_confidence': 0.6},
+            'symmetrical_triangle': {'min_slope': 0.001, 'min_confidence': 0.6}
+        }
+
+        # Every grid contains the live thresholds so each report has a baseline row
+        self.default_grids = {
+            'bull_flag': {
+                'flagpole_min_gain': [0.10, 0.15, 0.20, 0.25],
+                'flag_max_range': [0.05, 0.08, 0.12],
+                'min_confidence': [0.5, 0.6, 0.7]
+            },
+            'cup_and_handle': {
+                'cup_min_depth': [0.08, 0.12, 0.15],
+                'cup_max_depth': [0.30, 0.35, 0.40],
+                'handle_max_depth': [0.10, 0.15, 0.20],
+                'min_confidence': [0.6, 0.7]
+            },
+            'ascending_triangle': {'min_touches': [2, 3, 4], 'min_confidence': [0.5, 0.6, 0.7]},
+            'descending_triangle': {'min_touches': [2, 3, 4], 'min_confidence': [0.5, 0.6, 0.7]},
+            'symmetrical_triangle': {'min_slope': [0.0005, 0.001, 0.002], 'min_confidence': [0.5, 0.6, 0.7]}
+        }
+
+        # Bars from the detector's candidate index to the first bar on which the detector can report it
+        self.detection_lags = {
+            'bull_flag': 15,
+            'cup_and_handle': 20,
+            'ascending_triangle': 0,
+            'descending_triangle': 0,
+            'symmetrical_triangle': 0
+        }
+
+    # Per-window metrics, computed once per detector and independent of the thresholds
+
+    def _metrics_bull_flag(self, matrices: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        closes, volumes = matrices['Close'], matrices['Volume']
+        n = closes.shape[-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            flagpole_gain = (closes[..., 20:n - 15] - closes[..., :n - 35]) / closes[..., :n - 35]
+            flag_windows = sliding_window_view(closes, 15, axis=-1)[..., 20:n - 15, :]
+            flag_high = flag_windows.max(axis=-1)
+            flag_range = (flag_high - flag_windows.min(axis=-1)) / flag_high
+
+        slopes, r_squared = self.tracker._rolling_linregress(volumes, 10)
+        volume_trend = (slopes * r_squared)[..., 20:n - 15]
+
+        # calculate_bull_flag_confidence
+        confidence = (np.minimum(flagpole_gain * 100, 40) +
+                      np.maximum(0, 30 - (flag_range * 1000)) +
+                      np.where(volume_trend < -0.05, 30, np.where(volume_trend < 0, 15, 0)))
+        return {
+            'flagpole_gain': flagpole_gain,
+            'flag_range': flag_range,
+            'confidence': np.minimum(confidence / 100, 1.0)
+        }
+
+    def _metrics_cup_and_handle(self, matrices: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        closes = matrices['Close']
+        n = closes.shape[-1]
+        with np.errstate(divide='ignore', invalid='ignore'):
+            cup_windows = sliding_window_view(closes, 30, axis=-1)[..., :n - 50, :]
+            cup_high = cup_windows.max(axis=-1)
+            cup_depth = (cup_high - cup_windows.min(axis=-1)) / cup_high
+
+            handle_windows = sliding_window_view(closes, 15, axis=-1)[..., 30:n - 20, :]
+            handle_high = handle_windows.max(axis=-1)
+            handle_depth = (handle_high - handle_windows.min(axis=-1)) / handle_high
+
+        # calculate_cup_handle_confidence with a full 30-day cup
+        confidence = (np.where((cup_depth >= 0.15) & (cup_depth <= 0.25), 40,
+                               np.where((cup_depth >= 0.12) & (cup_depth <= 0.35), 25, 0)) +
+                      np.where(handle_depth < 0.10, 30, np.where(handle_depth < 0.15, 20, 0)) + 30)
+        return {
+            'cup_depth': cup_depth,
+            'handle_depth': handle_depth,
+            'confidence': np.minimum(confidence / 100, 1.0)
+        }
+
+    def _metrics_triangle(self, matrices: Dict[str, np.ndarray], touch_field: str, slope_field: str,
+                          side: str) -> Dict[str, np.ndarray]:
+        touch_values = matrices[touch_field]
+        n = touch_values.shape[-1]
+        windows = sliding_window_view(touch_values, 20, axis=-1)[..., :n - 20, :]
+        touches = self.tracker._touch_counts(windows, side=side)
+
+        slope, _ = self.tracker._rolling_linregress(matrices[slope_field], 20)
+        slope = slope[..., :n - 20]
+        return {
+            'touches': touches,
+            'slope': slope,
+            'confidence': np.minimum(self.tracker._triangle_confidence_bound(touches, slope), 1.0)
+        }
+
+    def _metrics_ascending_triangle(self, matrices: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        return self._metrics_triangle(matrices, 'High', 'Low', 'resistance')
+
+    def _metrics_descending_triangle(self, matrices: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        return self._metrics_triangle(matrices, 'Low', 'High', 'support')
+
+    def _metrics_symmetrical_triangle(self, matrices: Dict[str, np.ndarray]) -> Dict[str, np.ndarray]:
+        n = matrices['High'].shape[-1]
+        resistance_slope, _ = self.tracker._rolling_linregress(matrices['High'], 15)
+        support_slope, _ = self.tracker._rolling_linregress(matrices['Low'], 15)
+        resistance_slope = resistance_slope[..., :n - 15]
+        support_slope = support_slope[..., :n - 15]
+
+        # calculate_symmetrical_triangle_confidence
+        slope_balance = np.abs(np.abs(resistance_slope) - np.abs(support_slope))
+        avg_slope = (np.abs(resistance_slope) + np.abs(support_slope)) / 2
+        confidence = (np.maximum(0, 50 - (slope_balance * 50000)) + np.minimum(avg_slope * 25000, 50)) / 100
+        return {
+            'resistance_slope': resistance_slope,
+            'support_slope': support_slope,
+            'confidence': np.minimum(confidence, 1.0)
+        }
+
+    def _detection_mask(self, pattern_type: str, metrics: Dict[str, np.ndarray], params: Dict) -> np.ndarray:
+        """Windows passing one parameter set; NaN metrics compare False so padding never detects"""
+        with np.errstate(invalid='ignore'):
+            confident = metrics['confidence'] > params['min_confidence']
+            if pattern_type == 'bull_flag':
+                return ((metrics['flagpole_gain'] > params['flagpole_min_gain']) &
+                        (metrics['flag_range'] < params['flag_max_range']) & confident)
+            if pattern_type == 'cup_and_handle':
+                return ((metrics['cup_depth'] >= params['cup_min_depth']) &
+                        (metrics['cup_depth'] <= params['cup_max_depth']) &
+                        (metrics['handle_depth'] < params['handle_max_depth']) & confident)
+            if pattern_type == 'ascending_triangle':
+                return (metrics['touches'] >= params['min_touches']) & (metrics['slope'] > 0) & confident
+            if pattern_type == 'descending_triangle':
+                return (metrics['touches'] >= params['min_touches']) & (metrics['slope'] < 0) & confident
+            return ((metrics['resistance_slope'] < -params['min_slope']) &
+                    (metrics['support_slope'] > params['min_slope']) & confident)
+
+    # Forward returns
+
+    def forward_returns(self, closes: np.ndarray) -> Dict[int, np.ndarray]:
+        """Close-to-close return h bars after every bar; NaN where the future is not in the data"""
+        returns = {}
+        for horizon in self.horizons:
+            values = np.full(closes.shape, np.nan)
+            with np.errstate(divide='ignore', invalid='ignore'):
+                values[..., :-horizon] = closes[..., horizon:] / closes[..., :-horizon] - 1
+            returns[horizon] = values
+        return returns
+
+    def detection_onsets(self, mask: np.ndarray) -> np.ndarray:
+        """First window of each run of consecutive detections, so one setup counts once"""
+        previous = np.zeros_like(mask)
+        previous[..., 1:] = mask[..., :-1]
+        return mask & ~previous
+
+    # Sweep
+
+    def parameter_sets(self, grid: Dict[str, List]) -> List[Dict]:
+        names = sorted(grid)
+        return [dict(zip(names, values)) for values in itertools.product(*[grid[name] for name in names])]
+
+    def _sweep_histories(self, histories: Dict, grids: Dict[str, Dict]) -> Dict:
+        """Raw detection counts and return sums per parameter set; shards merge by addition"""
+        symbols = [symbol for symbol, hist in histories.items() if hist is not None and not hist.empty]
+        totals = {}
+        if not symbols:
+            return totals
+
+        length = max(len(histories[symbol]) for symbol in symbols)
+        matrices = {field: self.tracker._stack_histories(histories, symbols, field, length)
+                    for field in ('Close', 'High', 'Low', 'Volume')}
+        forward = self.forward_returns(matrices['Close'])
+
+        for pattern_type, grid in grids.items():
+            _, _, _, first_index, min_bars = self.tracker.pattern_scans[pattern_type]
+            if length < min_bars:
+                continue
+
+            try:
+                metrics = getattr(self, f"_metrics_{pattern_type}")(matrices)
+            except Exception as e:
+                logging.error(f"Error computing sweep metrics for {pattern_type}: {e}")
+                continue
+
+            windows = metrics['confidence'].shape[-1]
+            entry = first_index + self.detection_lags[pattern_type]
+            entry_returns = {horizon: values[:, entry:entry + windows] for horizon, values in forward.items()}
+
+            rows = []
+            for params in self.parameter_sets(grid):
+                events = self.detection_onsets(self._detection_mask(pattern_type, metrics, params))
+                row = {
+                    'params': params,
+                    'detections': int(events.sum()),
+                    'symbols_with_detections': int(events.any(axis=-1).sum()),
+                    'returns': {}
+                }
+                for horizon, values in entry_returns.items():
+                    realized = values[events]
+                    realized = realized[~np.isnan(realized)]
+                    row['returns'][horizon] = [
+                        int(realized.size), float(realized.sum()),
+                        float((realized ** 2).sum()), int((realized > 0).sum())
+                    ]
+                rows.append(row)
+            totals[pattern_type] = rows
+
+        return totals
+
+    def _merge(self, merged: Dict, shard: Dict):
+        for pattern_type, rows in shard.items():
+            if pattern_type not in merged:
+                merged[pattern_type] = rows
+                continue
+            for total, row in zip(merged[pattern_type], rows):
+                total['detections'] += row['detections']
+                total['symbols_with_detections'] += row['symbols_with_detections']
+                for horizon, sums in row['returns'].items():
+                    total['returns'][horizon] = [a + b for a, b in zip(total['returns'][horizon], sums)]
+
+    def _summarize(self, pattern_type: str, rows: List[Dict]) -> List[Dict]:
+        live = self.live_parameters.get(pattern_type)
+        summary = []
+        for row in rows:
+            returns = {}
+            for horizon, (count, total, total_sq, wins) in row['returns'].items():
+                mean = total / count if count else None
+                variance = max(total_sq / count - mean ** 2, 0.0) if count else None
+                returns[f"{horizon}d"] = {
+                    'count': count,
+                    'mean_return': round(mean, 5) if count else None,
+                    'std_return': round(float(np.sqrt(variance)), 5) if count else None,
+                    'win_rate': round(wins / count, 3) if count else None
+                }
+            summary.append({
+                'params': row['params'],
+                'is_live': row['params'] == live,
+                'detections': row['detections'],
+                'symbols_with_detections': row['symbols_with_detections'],
+                'forward_returns': returns
+            })
+        return summary
+
+    def sweep(self, symbols: Optional[List[str]] = None, histories: Optional[Dict] = None,
+              grids: Optional[Dict[str, Dict]] = None, period: str = "5y",
+              workers: Optional[int] = None) -> Dict:
+        """Detection counts and forward-return statistics for every parameter set of every detector"""
+        started = time.time()
+        if histories is None:
+            histories = self.tracker.fetch_universe_history(symbols or [], period)
+        grids = grids or self.default_grids
+        workers = workers if workers is not None else (os.cpu_count() or 1)
+
+        if workers > 1 and len(histories) > workers:
+            totals = self._sweep_parallel(histories, grids, workers)
+        else:
+            totals = self._sweep_histories(histories, grids)
+
+        results = {pattern_type: self._summarize(pattern_type, rows) for pattern_type, rows in totals.items()}
+        parameter_sets = sum(len(rows) for rows in results.values())
+        duration = time.time() - started
+        logging.info(f"Pattern sweep: {parameter_sets} parameter sets over {len(histories)} symbols in {duration:.1f}s")
+
+        return {
+            'symbols': len(histories),
+            'horizons': list(self.horizons),
+            'parameter_sets': parameter_sets,
+            'results': results,
+            'duration_seconds': round(duration, 2),
+            'timestamp': time.strftime('%Y-%m-%dT%H:%M:%S')
+        }
+
+    def _sweep_parallel(self, histories: Dict, grids: Dict[str, Dict], workers: int) -> Dict:
+        """Shard the universe across a process pool and add the shards' sums together"""
+        symbols = list(histories)
+        shards = [{symbol: histories[symbol] for symbol in symbols[k::workers]} for k in range(workers)]
+
+        merged = {}
+        try:
+            with ProcessPoolExecutor(max_workers=workers) as executor:
+                for shard in executor.map(_sweep_shard, shards, [grids] * workers, [self.horizons] * workers):
+                    self._merge(merged, shard)
+        except Exception as e:
+            logging.error(f"Parallel pattern sweep failed, sweeping in-process: {e}")
+            return self._sweep_histories(histories, grids)
+
+        return merged
+
+    def best_parameters(self, report: Dict, pattern_type: str, horizon: int = 10, min_detections: int = 30) -> Optional[Dict]:
+        """Parameter set with the highest mean forward return among those with enough detections"""
+        key = f"{horizon}d"
+        rows = [row for row in report['results'].get(pattern_type, [])
+                if row['forward_returns'][key]['count'] >= min_detections]
+        if not rows:
+            return None
+        return max(rows, key=lambda row: row['forward_returns'][key]['mean_return'])
+
+def _sweep_shard(histories, grids, horizons):
+    """Process pool entry point: sweep one shard of the universe"""
+    return PatternParameterSweep(horizons=horizons)._sweep_histories(histories, grids)
+
+if __name__ == "__main__":
+    # Offline sweep over the scanner's market universe
+    from stock_scanner import StockScanner
+    logging.basicConfig(level=logging.INFO)
+    print(json.dumps(PatternParameterSweep().sweep(StockScanner().get_comprehensive_market_universe(500)), indent=2))
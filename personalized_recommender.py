@@ -12,14 +12,17 @@ import logging
 from sklearn.feature_extraction.text import TfidfVectorizer
 from sklearn.metrics.pairwise import cosine_similarity
 from sklearn.cluster import KMeans
-import openai
-import os
+
+from insight_service import insight_service as default_insight_service
+from market_data_engine import download_histories
+from fundamentals_cache import fundamentals_cache
 
 class PersonalizedRecommender:
     """Advanced stock recommendation engine with personalization"""
     
-    def __init__(self):
-        self.openai_client = openai.OpenAI(api_key=os.environ.get("OPENAI_API_KEY"))
+    def __init__(self, insight_service=None):
+        # LLM insights go through the shared cached, rate-budgeted service
+        self.insight_service = insight_service or default_insight_service
         self.user_profiles = {}
         self.market_sectors = [
             'Technology', 'Healthcare', 'Financial', 'Consumer Discretionary',
@@ -402,159 +405,157 @@ class PersonalizedRecommender:
     
     def _score_candidates(self, candidates: List[str], user_profile: Dict, market_analysis: Dict) -> List[Dict]:
         """Score and rank candidate stocks"""
-        scored_candidates = []
-        
-        for symbol in candidates:
-            try:
-                score_data = self._calculate_stock_score(symbol, user_profile, market_analysis)
-                if score_data:
-                    scored_candidates.append(score_data)
-            except Exception as e:
-                logging.error(f"Error scoring {symbol}: {e}")
-                continue
-        
-        # Sort by total score descending
-        return sorted(scored_candidates, key=lambda x: x['total_score'], reverse=True)
-    
-    def _calculate_stock_score(self, symbol: str, user_profile: Dict, market_analysis: Dict) -> Optional[Dict]:
-        """Calculate comprehensive score for a stock"""
         try:
-            ticker = yf.Ticker(symbol)
-            hist = ticker.history(period='3mo')
-            info = ticker.info
-            
-            if hist.empty:
-                return None
-            
-            # Calculate various scoring components
-            technical_score = self._calculate_technical_score(hist, user_profile)
-            fundamental_score = self._calculate_fundamental_score(info, user_profile)
-            sentiment_score = self._calculate_sentiment_score(symbol, market_analysis)
-            fit_score = self._calculate_user_fit_score(symbol, info, user_profile)
-            
-            total_score = (
-                technical_score * 0.3 +
-                fundamental_score * 0.25 +
-                sentiment_score * 0.2 +
-                fit_score * 0.25
+            histories, infos = self._fetch_candidate_data(candidates)
+            frame = self._build_candidate_frame(candidates, histories, infos)
+            if frame.empty:
+                return []
+            
+            # Every scoring component is a column computed for all candidates at once
+            frame['technical_score'] = self._calculate_technical_scores(frame, user_profile)
+            frame['fundamental_score'] = self._calculate_fundamental_scores(frame, user_profile)
+            frame['sentiment_score'] = self._calculate_sentiment_score(market_analysis)
+            frame['fit_score'] = self._calculate_user_fit_scores(frame, user_profile)
+            frame['total_score'] = (
+                frame['technical_score'] * 0.3 +
+                frame['fundamental_score'] * 0.25 +
+                frame['sentiment_score'] * 0.2 +
+                frame['fit_score'] * 0.25
             )
-            
-            return {
-                'symbol': symbol,
-                'total_score': total_score,
-                'technical_score': technical_score,
-                'fundamental_score': fundamental_score,
-                'sentiment_score': sentiment_score,
-                'fit_score': fit_score,
-                'current_price': hist['Close'].iloc[-1],
-                'volume': hist['Volume'].iloc[-1],
-                'market_cap': info.get('marketCap', 0),
-                'sector': info.get('sector', 'Unknown'),
-                'beta': info.get('beta', 1.0),
-                'pe_ratio': info.get('trailingPE', 0),
-                'recommendation_reason': self._generate_recommendation_reason(
-                    symbol, technical_score, fundamental_score, sentiment_score, fit_score
-                )
-            }
+            frame = frame.sort_values('total_score', ascending=False, kind='stable')
+            
+            scored_candidates = []
+            for symbol, row in frame.iterrows():
+                info = infos.get(symbol, {})
+                scored_candidates.append({
+                    'symbol': symbol,
+                    'total_score': row['total_score'],
+                    'technical_score': row['technical_score'],
+                    'fundamental_score': row['fundamental_score'],
+                    'sentiment_score': row['sentiment_score'],
+                    'fit_score': row['fit_score'],
+                    'current_price': row['current_price'],
+                    'volume': row['volume'],
+                    'market_cap': info.get('marketCap', 0),
+                    'sector': info.get('sector', 'Unknown'),
+                    'beta': info.get('beta', 1.0),
+                    'pe_ratio': info.get('trailingPE', 0),
+                    'recommendation_reason': self._generate_recommendation_reason(
+                        symbol, row['technical_score'], row['fundamental_score'], row['sentiment_score'], row['fit_score']
+                    )
+                })
+            return scored_candidates
             
         except Exception as e:
-            logging.error(f"Error calculating score for {symbol}: {e}")
-            return None
+            logging.error(f"Error scoring candidates: {e}")
+            return []
     
-    def _calculate_technical_score(self, hist: pd.DataFrame, user_profile: Dict) -> float:
-        """Calculate technical analysis score"""
-        try:
+    def _calculate_stock_score(self, symbol: str, user_profile: Dict, market_analysis: Dict) -> Optional[Dict]:
+        """Calculate comprehensive score for a stock"""
+        scored = self._score_candidates([symbol], user_profile, market_analysis)
+        return scored[0] if scored else None
+    
+    def _fetch_candidate_data(self, symbols: List[str]) -> Tuple[Dict[str, pd.DataFrame], Dict[str, Dict]]:
+        """3 months of bars in one batched download; fundamentals come from the daily cache, never ticker.info"""
+        if not symbols:
+            return {}, {}
+        return self._fetch_histories(symbols), fundamentals_cache.get_many(symbols)
+    
+    def _fetch_histories(self, symbols: List[str]) -> Dict[str, pd.DataFrame]:
+        return download_histories(symbols, '3mo')
+    
+    def _build_candidate_frame(self, symbols: List[str], histories: Dict[str, pd.DataFrame],
+                               infos: Dict[str, Dict]) -> pd.DataFrame:
+        """One row per candidate with data: the latest indicator values and the fundamentals the scores read"""
+        rows = {}
+        for symbol in symbols:
+            hist = histories.get(symbol)
+            if hist is None or hist.empty:
+                continue
+            closes = hist['Close']
+            
             # RSI
-            delta = hist['Close'].diff()
+            delta = closes.diff()
             gain = (delta.where(delta > 0, 0)).rolling(window=14).mean()
             loss = (-delta.where(delta < 0, 0)).rolling(window=14).mean()
             rs = gain / loss
             rsi = 100 - (100 / (1 + rs))
-            current_rsi = rsi.iloc[-1]
-            
-            # Moving averages
-            ma_20 = hist['Close'].rolling(20).mean()
-            ma_50 = hist['Close'].rolling(50).mean()
-            current_price = hist['Close'].iloc[-1]
-            
-            # Volume trend
-            avg_volume = hist['Volume'].rolling(20).mean().iloc[-1]
-            recent_volume = hist['Volume'].iloc[-1]
-            volume_ratio = recent_volume / avg_volume if avg_volume > 0 else 1
-            
-            # Scoring
-            score = 50  # Base score
-            
-            # RSI scoring (prefer 30-70 range)
-            if 30 <= current_rsi <= 70:
-                score += 20
-            elif current_rsi < 30:
-                score += 15  # Oversold can be good
-            elif current_rsi > 70:
-                score += 5   # Overbought is risky
-            
-            # Moving average trend
-            if current_price > ma_20.iloc[-1]:
-                score += 15
-            if current_price > ma_50.iloc[-1]:
-                score += 10
             
-            # Volume confirmation
-            if volume_ratio > 1.2:
-                score += 10
-            elif volume_ratio > 1.0:
-                score += 5
-            
-            return min(100, max(0, score))
-            
-        except Exception as e:
-            logging.error(f"Technical score calculation error: {e}")
-            return 50
+            info = infos.get(symbol, {})
+            rows[symbol] = {
+                'current_price': closes.iloc[-1],
+                'volume': hist['Volume'].iloc[-1],
+                'rsi': rsi.iloc[-1],
+                'ma_20': closes.rolling(20).mean().iloc[-1],
+                'ma_50': closes.rolling(50).mean().iloc[-1],
+                'avg_volume': hist['Volume'].rolling(20).mean().iloc[-1],
+                'pe_ratio': info.get('trailingPE'),
+                'market_cap': info.get('marketCap'),
+                'debt_to_equity': info.get('debtToEquity'),
+                'return_on_equity': info.get('returnOnEquity'),
+                'earnings_growth': info.get('earningsGrowth'),
+                'sector': info.get('sector', ''),
+                'quoted_price': info.get('currentPrice', info.get('regularMarketPrice')),
+                'beta': info.get('beta')
+            }
+        
+        frame = pd.DataFrame.from_dict(rows, orient='index')
+        if frame.empty:
+            return frame
+        numeric = ['pe_ratio', 'market_cap', 'debt_to_equity', 'return_on_equity', 'earnings_growth',
+                   'quoted_price', 'beta']
+        frame[numeric] = frame[numeric].apply(pd.to_numeric, errors='coerce')
+        return frame
     
-    def _calculate_fundamental_score(self, info: Dict, user_profile: Dict) -> float:
-        """Calculate fundamental analysis score"""
-        try:
-            score = 50  # Base score
-            
-            # P/E Ratio
-            pe_ratio = info.get('trailingPE', 0)
-            if 0 < pe_ratio < 15:
-                score += 20
-            elif 15 <= pe_ratio < 25:
-                score += 15
-            elif 25 <= pe_ratio < 35:
-                score += 5
-            
-            # Market Cap preference alignment
-            market_cap = info.get('marketCap', 0)
-            user_cap_pref = user_profile.get('market_cap_preference', 'large')
-            
-            if user_cap_pref == 'large' and market_cap > 10e9:
-                score += 15
-            elif user_cap_pref == 'mid' and 2e9 <= market_cap <= 10e9:
-                score += 15
-            elif user_cap_pref == 'small' and market_cap < 2e9:
-                score += 15
-            
-            # Financial health indicators
-            if info.get('debtToEquity', 100) < 50:
-                score += 10
-            
-            if info.get('returnOnEquity', 0) > 15:
-                score += 10
-            
-            # Growth metrics
-            if info.get('earningsGrowth', 0) > 0.1:
-                score += 10
-            
-            return min(100, max(0, score))
-            
-        except Exception as e:
-            logging.error(f"Fundamental score calculation error: {e}")
-            return 50
+    def _calculate_technical_scores(self, frame: pd.DataFrame, user_profile: Dict) -> pd.Series:
+        """Calculate technical analysis score"""
+        rsi = frame['rsi']
+        volume_ratio = (frame['volume'] / frame['avg_volume']).where(frame['avg_volume'] > 0, 1)
+        
+        score = pd.Series(50.0, index=frame.index)  # Base score
+        
+        # RSI scoring (prefer 30-70 range); oversold can be good, overbought is risky
+        score += np.select([(rsi >= 30) & (rsi <= 70), rsi < 30, rsi > 70], [20, 15, 5], 0)
+        
+        # Moving average trend
+        score += np.where(frame['current_price'] > frame['ma_20'], 15, 0)
+        score += np.where(frame['current_price'] > frame['ma_50'], 10, 0)
+        
+        # Volume confirmation
+        score += np.select([volume_ratio > 1.2, volume_ratio > 1.0], [10, 5], 0)
+        
+        return score.clip(0, 100)
     
-    def _calculate_sentiment_score(self, symbol: str, market_analysis: Dict) -> float:
-        """Calculate market sentiment score"""
+    def _calculate_fundamental_scores(self, frame: pd.DataFrame, user_profile: Dict) -> pd.Series:
+        """Calculate fundamental analysis score; missing fields count as absent"""
+        score = pd.Series(50.0, index=frame.index)  # Base score
+        
+        # P/E Ratio
+        pe_ratio = frame['pe_ratio'].fillna(0)
+        score += np.select([(pe_ratio > 0) & (pe_ratio < 15), (pe_ratio >= 15) & (pe_ratio < 25),
+                            (pe_ratio >= 25) & (pe_ratio < 35)], [20, 15, 5], 0)
+        
+        # Market Cap preference alignment
+        market_cap = frame['market_cap'].fillna(0)
+        user_cap_pref = user_profile.get('market_cap_preference', 'large')
+        if user_cap_pref == 'large':
+            score += np.where(market_cap > 10e9, 15, 0)
+        elif user_cap_pref == 'mid':
+            score += np.where((market_cap >= 2e9) & (market_cap <= 10e9), 15, 0)
+        elif user_cap_pref == 'small':
+            score += np.where(market_cap < 2e9, 15, 0)
+        
+        # Financial health indicators
+        score += np.where(frame['debt_to_equity'].fillna(100) < 50, 10, 0)
+        score += np.where(frame['return_on_equity'].fillna(0) > 15, 10, 0)
+        
+        # Growth metrics
+        score += np.where(frame['earnings_growth'].fillna(0) > 0.1, 10, 0)
+        
+        return score.clip(0, 100)
+    
+    def _calculate_sentiment_score(self, market_analysis: Dict) -> float:
+        """Calculate market sentiment score; it depends only on the market, so one value serves every candidate"""
         try:
             base_score = 50
             
@@ -581,42 +582,31 @@ class PersonalizedRecommender:
             logging.error(f"Sentiment score calculation error: {e}")
             return 50
     
-    def _calculate_user_fit_score(self, symbol: str, info: Dict, user_profile: Dict) -> float:
-        """Calculate how well stock fits user's profile"""
-        try:
-            score = 50
-            
-            # Sector preference
-            stock_sector = info.get('sector', '')
-            preferred_sectors = user_profile.get('preferred_sectors', [])
-            if stock_sector in preferred_sectors:
-                score += 25
-            
-            # Price range preference
-            current_price = info.get('currentPrice', info.get('regularMarketPrice', 0))
-            price_prefs = user_profile.get('preferred_price_range', {})
-            min_price = price_prefs.get('min', 0)
-            max_price = price_prefs.get('max', 1000)
-            
-            if min_price <= current_price <= max_price:
-                score += 15
-            
-            # Risk tolerance alignment
-            beta = info.get('beta', 1.0)
-            risk_tolerance = user_profile.get('risk_tolerance', 'moderate')
-            
-            if risk_tolerance == 'conservative' and beta < 1.2:
-                score += 10
-            elif risk_tolerance == 'moderate' and 0.8 <= beta <= 1.5:
-                score += 10
-            elif risk_tolerance == 'aggressive' and beta > 1.2:
-                score += 10
-            
-            return min(100, max(0, score))
-            
-        except Exception as e:
-            logging.error(f"User fit score calculation error: {e}")
-            return 50
+    def _calculate_user_fit_scores(self, frame: pd.DataFrame, user_profile: Dict) -> pd.Series:
+        """Calculate how well each stock fits user's profile"""
+        score = pd.Series(50.0, index=frame.index)
+        
+        # Sector preference
+        score += np.where(frame['sector'].isin(user_profile.get('preferred_sectors', [])), 25, 0)
+        
+        # Price range preference
+        current_price = frame['quoted_price'].fillna(0)
+        price_prefs = user_profile.get('preferred_price_range', {})
+        min_price = price_prefs.get('min', 0)
+        max_price = price_prefs.get('max', 1000)
+        score += np.where((current_price >= min_price) & (current_price <= max_price), 15, 0)
+        
+        # Risk tolerance alignment
+        beta = frame['beta'].fillna(1.0)
+        risk_tolerance = user_profile.get('risk_tolerance', 'moderate')
+        if risk_tolerance == 'conservative':
+            score += np.where(beta < 1.2, 10, 0)
+        elif risk_tolerance == 'moderate':
+            score += np.where((beta >= 0.8) & (beta <= 1.5), 10, 0)
+        elif risk_tolerance == 'aggressive':
+            score += np.where(beta > 1.2, 10, 0)
+        
+        return score.clip(0, 100)
     
     def _generate_recommendation_reason(self, symbol: str, tech_score: float, 
                                       fund_score: float, sent_score: float, fit_score: float) -> str:
@@ -670,9 +660,15 @@ class PersonalizedRecommender:
         """Enhance recommendations with AI-generated insights"""
         enhanced = []
         
-        for rec in recommendations:
+        # All insights in one concurrent, cached batch rather than one blocking call per recommendation
+        try:
+            insights = self.insight_service.generate_many(recommendations, user_profile)
+        except Exception as e:
+            logging.error(f"Error generating AI insights: {e}")
+            insights = [f"Strong recommendation based on {rec['recommendation_reason']}." for rec in recommendations]
+        
+        for rec, ai_insight in zip(recommendations, insights):
             try:
-                ai_insight = self._generate_ai_insight(rec, user_profile)
                 rec['ai_insight'] = ai_insight
                 rec['confidence_level'] = self._calculate_individual_confidence(rec)
                 rec['risk_assessment'] = self._assess_individual_risk(rec, user_profile)
@@ -685,41 +681,6 @@ class PersonalizedRecommender:
         
         return enhanced
     
-    def _generate_ai_insight(self, recommendation: Dict, user_profile: Dict) -> str:
-        """Generate AI-powered insight for recommendation"""
-        try:
-            prompt = f"""
-            Analyze this stock recommendation for a trader:
-            
-            Stock: {recommendation['symbol']}
-            Sector: {recommendation.get('sector', 'Unknown')}
-            Current Price: ${recommendation.get('current_price', 0):.2f}
-            Technical Score: {recommendation['technical_score']}/100
-            Fundamental Score: {recommendation['fundamental_score']}/100
-            P/E Ratio: {recommendation.get('pe_ratio', 'N/A')}
-            Beta: {recommendation.get('beta', 'N/A')}
-            
-            User Profile:
-            Risk Tolerance: {user_profile['risk_tolerance']}
-            Trading Style: {user_profile['trading_style']}
-            Preferred Sectors: {', '.join(user_profile['preferred_sectors'])}
-            
-            Provide a concise 2-3 sentence insight explaining why this stock fits the user's profile and what to watch for. Focus on actionable insights.
-            """
-            
-            response = self.openai_client.chat.completions.create(
-                model="gpt-4o",  # the newest OpenAI model is "gpt-4o" which was released May 13, 2024. do not change this unless explicitly requested by the user
-                messages=[{"role": "user", "content": prompt}],
-                max_tokens=150,
-                temperature=0.7
-            )
-            
-            return response.choices[0].message.content.strip()
-            
-        except Exception as e:
-            logging.error(f"Error generating AI insight: {e}")
-            return f"Strong recommendation based on {recommendation['recommendation_reason']}."
-    
     def _calculate_individual_confidence(self, recommendation: Dict) -> str:
         """Calculate confidence level for individual recommendation"""
         total_score = recommendation['total_score']
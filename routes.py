@@ -3,7 +3,7 @@ from flask_login import LoginManager, login_user, logout_user, login_required, c
 from werkzeug.security import generate_password_hash, check_password_hash
 from app import app, db
 from models import (Stock, TradeJournal, ForecastPath, AIAnalysis, PatternEvolution, 
-                   User, StockRecommendation, ScanResult)
+                   User, StockRecommendation, ScanResult, PatternScan)
 from auth_forms import RegistrationForm, LoginForm
 from stock_scanner import StockScanner
 from forecasting_engine import ForecastingEngine
@@ -16,10 +16,13 @@ from pdf_generator import PDFGenerator
 from stock_widgets import StockWidgets
 from market_data_engine import MarketDataEngine
 from background_scanner import background_scanner
+from pattern_state_machine import pattern_state_machine
+from analog_index import analog_index
+from fundamentals_cache import fundamentals_cache
 import json
 import logging
 import pandas as pd
-from datetime import datetime
+from datetime import datetime, timedelta
 from threading import Thread
 
 # Initialize Flask-Login
@@ -246,6 +249,7 @@ def scan_stocks():
             results = stock_scanner.scan_stocks(symbols=ticker_list)
         
         # Update database with scan results and calculate confidence scores
+        fundamentals = fundamentals_cache.get_many([result['symbol'] for result in results])
         for result in results:
             # Calculate confidence score using the result data
             confidence_score = confidence_scorer.calculate_score(result)
@@ -256,7 +260,10 @@ def scan_stocks():
                 stock.symbol = result['symbol']
                 db.session.add(stock)
             
-            stock.name = result.get('name', '')
+            stock_fundamentals = fundamentals.get(result['symbol'], {})
+            stock.name = stock_fundamentals.get('longName', result.get('name', ''))
+            stock.sector = stock_fundamentals.get('sector', stock.sector)
+            stock.market_cap = stock_fundamentals.get('marketCap', stock.market_cap)
             stock.price = float(result.get('price', 0))
             stock.rsi = float(result.get('rsi', 0))
             stock.volume_spike = float(result.get('volume_spike', 0))
@@ -354,18 +361,35 @@ def api_background_scan_status():
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+def background_scan_not_modified(etag, snapshot):
+    """Empty 304 response for clients that already hold the current scan snapshot"""
+    response = app.response_class(status=304)
+    response.set_etag(etag)
+    response.headers['X-Results-Version'] = str(snapshot.version)
+    return response
+
 @app.route('/api/background-scan/opportunities')
 def api_background_scan_opportunities():
     """API endpoint for top trading opportunities from background scanner"""
     try:
         limit = request.args.get('limit', 10, type=int)
-        opportunities = background_scanner.get_top_opportunities(limit)
+        snapshot = background_scanner.get_snapshot()
+        etag = f"{snapshot.etag}-{limit}"
         
-        return jsonify({
+        # Skip re-analysing opportunities when the client already has this snapshot
+        if request.if_none_match.contains(etag):
+            return background_scan_not_modified(etag, snapshot)
+        
+        opportunities = background_scanner.get_top_opportunities(limit, snapshot=snapshot)
+        
+        response = jsonify({
             'success': True,
             'opportunities': opportunities,
-            'total_found': len(opportunities)
+            'total_found': len(opportunities),
+            'version': snapshot.version
         })
+        response.set_etag(etag)
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -373,12 +397,25 @@ def api_background_scan_opportunities():
 def api_background_scan_results(scan_type):
     """API endpoint for specific background scan results"""
     try:
-        results = background_scanner.get_latest_results(scan_type)
-        return jsonify({
+        snapshot = background_scanner.get_snapshot()
+        etag = snapshot.etag_for(scan_type)
+        
+        if request.if_none_match.contains(etag):
+            return background_scan_not_modified(etag, snapshot)
+        
+        if scan_type == 'all':
+            results = dict(snapshot.results)
+        else:
+            results = snapshot.results.get(scan_type, {})
+        
+        response = jsonify({
             'success': True,
             'scan_type': scan_type,
-            'results': results
+            'results': results,
+            'version': snapshot.version
         })
+        response.set_etag(etag)
+        return response
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
@@ -560,9 +597,12 @@ def forecast(symbol):
             confidence_scorer = ConfidenceScorer()
             confidence_score = confidence_scorer.calculate_score(stock_data)
             
+            fundamentals = fundamentals_cache.get(symbol)
             stock = Stock(
                 symbol=symbol,
-                name=stock_data.get('name', 'Unknown Company'),
+                name=fundamentals.get('longName', stock_data.get('name', 'Unknown Company')),
+                sector=fundamentals.get('sector'),
+                market_cap=fundamentals.get('marketCap'),
                 price=stock_data.get('price', 0),
                 rsi=stock_data.get('rsi', 50),
                 volume_spike=stock_data.get('volume_spike', 0),
@@ -573,9 +613,9 @@ def forecast(symbol):
             db.session.add(stock)
             db.session.commit()
         
-        # Generate forecast paths
-        forecast_paths = forecasting_engine.generate_spaghetti_model(symbol)
+        # The coach's 3-month download also feeds the forecast fallback
         ai_analysis = ai_coach.analyze_setup(symbol)
+        forecast_paths = get_stored_forecast_paths(symbol, ai_coach.get_history(symbol))
         
         return render_template('forecast.html', stock=stock, forecast_paths=forecast_paths, ai_analysis=ai_analysis)
         
@@ -611,8 +651,12 @@ def forecast_enhanced(symbol):
             
             confidence_score = confidence_scorer.calculate_score(data)
             
+            fundamentals = fundamentals_cache.get(symbol)
             stock = Stock(
                 symbol=symbol,
+                name=fundamentals.get('longName'),
+                sector=fundamentals.get('sector'),
+                market_cap=fundamentals.get('marketCap'),
                 price=data['current_price'],
                 rsi=data['rsi'],
                 volume_spike=data['volume_surge'],
@@ -625,7 +669,7 @@ def forecast_enhanced(symbol):
         
         # Generate comprehensive analysis data with error handling
         try:
-            forecast_paths = forecasting_engine.generate_spaghetti_model(symbol)
+            forecast_paths = get_stored_forecast_paths(symbol)
         except Exception as e:
             logging.warning(f"Forecast generation failed for {symbol}: {e}")
             forecast_paths = []
@@ -723,6 +767,23 @@ def forecast_enhanced(symbol):
                              error_message=error_message,
                              suggestions=suggestions)
 
+def get_stored_forecast_paths(symbol, hist=None):
+    """Latest forecast written by the batch job; missing or stale forecasts are simulated and stored"""
+    # Stale once older than a day or, when the caller has bars, behind the latest session
+    min_session = hist.index[-1].date() if hist is not None and not hist.empty else None
+    paths = ForecastPath.latest_paths(symbol, max_age=timedelta(hours=20), min_session=min_session)
+    if paths:
+        return paths
+    
+    forecast = forecasting_engine.simulate_forecast(symbol, hist=hist)
+    if not forecast:
+        return ForecastPath.latest_paths(symbol) or []
+    try:
+        forecasting_engine.store_forecasts({symbol: forecast})
+    except Exception as e:
+        logging.warning(f"Could not store forecast for {symbol}: {e}")
+    return forecast['paths']
+
 # Helper functions for enhanced forecast analysis
 def generate_enhanced_technical_analysis(symbol):
     """Generate comprehensive technical analysis data"""
@@ -920,9 +981,12 @@ def calculate_risk_level(symbol):
         returns = hist['Close'].pct_change().dropna()
         volatility = returns.std() * (252 ** 0.5)  # Annualized
         
-        if volatility > 0.4:
+        # Beta from the daily fundamentals cache; unknown beta leaves the volatility call alone
+        beta = fundamentals_cache.get(symbol).get('beta')
+        
+        if volatility > 0.4 or (beta is not None and beta > 1.5):
             return "High"
-        elif volatility < 0.2:
+        elif volatility < 0.2 and (beta is None or beta < 1.2):
             return "Low"
         else:
             return "Medium"
@@ -1089,23 +1153,11 @@ def generate_forecast():
         if not symbol:
             return jsonify({'error': 'Symbol required'}), 400
         
-        # Generate forecast paths
-        paths = forecasting_engine.generate_spaghetti_model(symbol)
-        
-        # Store in database
-        ForecastPath.query.filter_by(symbol=symbol).delete()
-        
-        for path in paths:
-            forecast_path = ForecastPath(
-                symbol=symbol,
-                path_type=path['type'],
-                probability=path['probability'],
-                price_targets=path['targets'],
-                risk_zones=path['risk_zones']
-            )
-            db.session.add(forecast_path)
-        
-        db.session.commit()
+        # Generate forecast paths and replace the stored ones
+        forecast = forecasting_engine.simulate_forecast(symbol)
+        paths = forecast['paths'] if forecast else []
+        if forecast:
+            forecasting_engine.store_forecasts({symbol: forecast})
         
         return jsonify({'success': True, 'paths': paths})
     
@@ -1321,95 +1373,80 @@ def chart_story(symbol):
         logging.error(f"Error getting chart story: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/chart_stories')
+def chart_stories():
+    """Chart story comments for several symbols over a longer period in one batched call"""
+    try:
+        symbols = [s.strip().upper() for s in request.args.get('symbols', '').split(',') if s.strip()]
+        if not symbols or len(symbols) > 50:
+            return jsonify({'error': 'symbols must list between 1 and 50 tickers'}), 400
+        bars = request.args.get('bars', type=int)
+        
+        stories = ai_coach.generate_chart_stories(symbols, period=request.args.get('period', '1y'), bars=bars)
+        return jsonify({'success': True, 'stories': stories})
+    
+    except Exception as e:
+        logging.error(f"Error getting chart stories: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/pattern_evolution/<symbol>')
 def pattern_evolution_analysis(symbol):
     """Get pattern evolution tracking and breakout timing predictions"""
     try:
-        evolution_data = pattern_tracker.track_pattern_evolution(symbol)
+        # Cached results covering the latest session need no download at all
+        hist = None
+        if pattern_tracker.stale_symbols([symbol]):
+            hist = pattern_state_machine.fetch_history(symbol, period="6mo")
+        evolution_data = pattern_tracker.track_pattern_evolution(symbol, hist=hist)
+        
+        # Advance the stored pattern state with any new bars and record stage transitions
+        if hist is not None:
+            pattern_state = pattern_state_machine.update_symbol(symbol, hist)
+        else:
+            pattern_state = pattern_state_machine.get_state(symbol)
         
         if evolution_data:
-            # Store in database
-            for pattern in evolution_data['patterns']:
-                existing = PatternEvolution.query.filter_by(
-                    symbol=symbol, 
-                    pattern_type=pattern['pattern_type']
-                ).first()
-                
-                breakout_pred = pattern['breakout_prediction']
-                evolution = pattern['evolution']
-                
-                if existing:
-                    # Update existing record with numpy conversion
-                    existing.confidence_score = float(pattern['confidence'])
-                    existing.stage = pattern['current_stage']
-                    existing.completion_percentage = float(pattern['completion_percentage'])
-                    existing.time_in_pattern = int(pattern['time_in_pattern'])
-                    existing.volatility_trend = float(evolution.get('volatility_trend', 0))
-                    existing.volume_trend = float(evolution.get('volume_trend', 0))
-                    existing.momentum_change = float(evolution.get('momentum_change', 0))
-                    existing.support_resistance_strength = float(evolution.get('support_resistance_strength', 0))
-                    existing.estimated_days_to_breakout = int(breakout_pred.get('estimated_days_to_breakout', 7))
-                    existing.breakout_probability_5_days = float(breakout_pred.get('breakout_probability_next_5_days', 0))
-                    existing.breakout_probability_10_days = float(breakout_pred.get('breakout_probability_next_10_days', 0))
-                    existing.direction_bias = float(breakout_pred.get('direction_bias', 0.5))
-                    existing.timing_confidence = float(breakout_pred.get('timing_confidence', 0.5))
-                    existing.updated_at = datetime.utcnow()
-                else:
-                    # Create new record with numpy conversion
-                    new_evolution = PatternEvolution(
-                        symbol=symbol,
-                        pattern_type=pattern['pattern_type'],
-                        confidence_score=float(pattern['confidence']),
-                        stage=pattern['current_stage'],
-                        completion_percentage=float(pattern['completion_percentage']),
-                        time_in_pattern=int(pattern['time_in_pattern']),
-                        volatility_trend=float(evolution.get('volatility_trend', 0)),
-                        volume_trend=float(evolution.get('volume_trend', 0)),
-                        momentum_change=float(evolution.get('momentum_change', 0)),
-                        support_resistance_strength=float(evolution.get('support_resistance_strength', 0)),
-                        estimated_days_to_breakout=int(breakout_pred.get('estimated_days_to_breakout', 7)),
-                        breakout_probability_5_days=float(breakout_pred.get('breakout_probability_next_5_days', 0)),
-                        breakout_probability_10_days=float(breakout_pred.get('breakout_probability_next_10_days', 0)),
-                        direction_bias=float(breakout_pred.get('direction_bias', 0.5)),
-                        timing_confidence=float(breakout_pred.get('timing_confidence', 0.5)),
-                        pattern_data=breakout_pred.get('key_levels', {})
-                    )
-                    db.session.add(new_evolution)
-                
-                db.session.commit()
+            # Store in database with a single upsert for all detected patterns
+            PatternEvolution.bulk_upsert(PatternEvolution.rows_from_evolution(symbol, evolution_data))
             
-            return jsonify({'success': True, 'evolution': evolution_data})
+            return jsonify({'success': True, 'evolution': evolution_data, 'pattern_state': pattern_state})
         else:
-            return jsonify({'success': False, 'message': 'No patterns detected'})
+            return jsonify({'success': False, 'message': 'No patterns detected', 'pattern_state': pattern_state})
             
     except Exception as e:
         logging.error(f"Error analyzing pattern evolution for {symbol}: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/pattern_evolution/<symbol>/events')
+def pattern_stage_events(symbol):
+    """Get recorded pattern stage transitions for a symbol"""
+    try:
+        limit = request.args.get('limit', 50, type=int)
+        return jsonify({'success': True, 'symbol': symbol, 'events': pattern_state_machine.get_events(symbol, limit)})
+        
+    except Exception as e:
+        logging.error(f"Error getting pattern stage events for {symbol}: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/pattern_evolution/all')
 def all_pattern_evolutions():
     """Get pattern evolution data for all tracked stocks"""
     try:
-        tracked_stocks = Stock.query.filter_by(is_tracked=True).all()
         all_evolutions = {}
         
-        for stock in tracked_stocks:
-            latest_evolution = PatternEvolution.query.filter_by(
-                symbol=stock.symbol
-            ).order_by(PatternEvolution.updated_at.desc()).first()
-            
-            if latest_evolution:
-                all_evolutions[stock.symbol] = {
-                    'pattern_type': latest_evolution.pattern_type,
-                    'confidence_score': latest_evolution.confidence_score,
-                    'stage': latest_evolution.stage,
-                    'completion_percentage': latest_evolution.completion_percentage,
-                    'estimated_days_to_breakout': latest_evolution.estimated_days_to_breakout,
-                    'breakout_probability_5_days': latest_evolution.breakout_probability_5_days,
-                    'direction_bias': latest_evolution.direction_bias,
-                    'timing_confidence': latest_evolution.timing_confidence,
-                    'updated_at': latest_evolution.updated_at.isoformat()
-                }
+        # One windowed query for the latest evolution of every tracked stock
+        for stock, latest_evolution in PatternEvolution.latest_with_stocks(tracked_only=True):
+            all_evolutions[stock.symbol] = {
+                'pattern_type': latest_evolution.pattern_type,
+                'confidence_score': latest_evolution.confidence_score,
+                'stage': latest_evolution.stage,
+                'completion_percentage': latest_evolution.completion_percentage,
+                'estimated_days_to_breakout': latest_evolution.estimated_days_to_breakout,
+                'breakout_probability_5_days': latest_evolution.breakout_probability_5_days,
+                'direction_bias': latest_evolution.direction_bias,
+                'timing_confidence': latest_evolution.timing_confidence,
+                'updated_at': latest_evolution.updated_at.isoformat()
+            }
         
         return jsonify({'success': True, 'evolutions': all_evolutions})
         
@@ -1461,7 +1498,12 @@ def scanner_dashboard():
             ScanResult.confidence_score >= 70
         ).order_by(ScanResult.confidence_score.desc()).limit(10).all()
         
-        monitor_status = "Running" if monitor_instance else "Stopped"
+        if monitor_instance is None:
+            monitor_status = "Stopped"
+        elif background_scanner.leader.is_leader:
+            monitor_status = "Running"
+        else:
+            monitor_status = "Standby"
         
         return render_template('scanner_dashboard.html', 
                              recent_scans=recent_scans[:20],
@@ -1562,17 +1604,22 @@ def update_pattern_evolutions():
     """Update pattern evolution data for all tracked stocks"""
     try:
         tracked_stocks = Stock.query.filter_by(is_tracked=True).all()
-        updated_count = 0
         
-        for stock in tracked_stocks:
-            try:
-                evolution_data = pattern_tracker.track_pattern_evolution(stock.symbol)
-                if evolution_data and evolution_data['patterns']:
-                    updated_count += 1
-                
-            except Exception as stock_error:
-                logging.error(f"Error updating pattern evolution for {stock.symbol}: {stock_error}")
-                continue
+        symbols = [stock.symbol for stock in tracked_stocks]
+        
+        # One batched download and one universe-wide detector pass instead of a 6mo fetch per stock;
+        # symbols whose cached results already cover the latest session are not fetched at all
+        histories = pattern_tracker.fetch_universe_history(pattern_tracker.stale_symbols(symbols))
+        evolutions = pattern_tracker.track_universe_evolution(symbols, histories=histories)
+        updated_count = sum(1 for evolution_data in evolutions.values() if evolution_data['patterns'])
+        
+        rows = []
+        for symbol, evolution_data in evolutions.items():
+            rows.extend(PatternEvolution.rows_from_evolution(symbol, evolution_data))
+        PatternEvolution.bulk_upsert(rows)
+        
+        # Carry each symbol's pattern state forward from the same bars
+        pattern_state_machine.update_universe(histories)
         
         return jsonify({
             'success': True, 
@@ -1584,25 +1631,47 @@ def update_pattern_evolutions():
         logging.error(f"Error updating pattern evolutions: {e}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/api/patterns/universe-scan')
+def pattern_universe_scan():
+    """Active patterns across the market universe from the latest scheduled scan, e.g. ?pattern=bull_flag"""
+    try:
+        pattern_type = request.args.get('pattern')
+        limit = max(1, min(request.args.get('limit', 500, type=int), 500))
+        
+        if pattern_type and pattern_type not in pattern_tracker.pattern_scans:
+            return jsonify({'error': f'Unknown pattern type: {pattern_type}'}), 400
+        
+        records = PatternScan.query.order_by(PatternScan.symbol).all()
+        matches = {}
+        for record in records:
+            patterns = [pattern for pattern in record.patterns or []
+                        if not pattern_type or pattern.get('type') == pattern_type]
+            if patterns:
+                matches[record.symbol] = patterns
+                if len(matches) >= limit:
+                    break
+        
+        return jsonify({
+            'success': True,
+            'pattern_type': pattern_type or 'all',
+            'symbols_scanned': len(records),
+            'scanned_at': records[0].scanned_at.isoformat() if records else None,
+            'matches': matches
+        })
+        
+    except Exception as e:
+        logging.error(f"Error loading universe pattern scan: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/pattern_dashboard')
 def pattern_dashboard():
     """Pattern evolution dashboard page"""
     try:
         # Get all stocks with pattern evolution data
-        pattern_stocks = []
-        
-        all_stocks = Stock.query.all()
-        
-        for stock in all_stocks:
-            recent_evolution = PatternEvolution.query.filter_by(
-                symbol=stock.symbol
-            ).order_by(PatternEvolution.updated_at.desc()).first()
-            
-            if recent_evolution:
-                pattern_stocks.append({
-                    'stock': stock,
-                    'evolution': recent_evolution
-                })
+        pattern_stocks = [
+            {'stock': stock, 'evolution': recent_evolution}
+            for stock, recent_evolution in PatternEvolution.latest_with_stocks()
+        ]
         
         return render_template('pattern_dashboard.html', pattern_stocks=pattern_stocks)
         
@@ -1818,13 +1887,49 @@ def get_widget_chart_types():
         logging.error(f"Error getting chart types: {e}")
         return jsonify({'success': False, 'error': str(e)})
 
+@app.route('/api/analogs/<symbol>')
+def similar_historical_setups(symbol):
+    """Find the most similar historical setups to a symbol's latest bars"""
+    try:
+        limit = request.args.get('limit', 20, type=int)
+        result = analog_index.find_similar_setups(symbol.upper(), k=limit)
+        
+        return jsonify({
+            'success': bool(result['matches']),
+            'index': analog_index.get_stats(),
+            **result
+        })
+        
+    except Exception as e:
+        logging.error(f"Error finding similar setups for {symbol}: {e}")
+        return jsonify({'error': str(e)}), 500
+
+@app.route('/api/forecast/<symbol>')
+def multi_horizon_forecast(symbol):
+    """Forecast bands and scenarios for several horizons from one shared simulation"""
+    try:
+        horizons = [int(h) for h in request.args.get('horizons', '5,10,20').split(',') if h.strip()]
+        if not horizons or min(horizons) < 1 or max(horizons) > 60:
+            return jsonify({'error': 'horizons must be between 1 and 60 days'}), 400
+
+        forecast = forecasting_engine.simulate_horizons(symbol.upper(), horizons)
+        if not forecast:
+            return jsonify({'success': False, 'message': f'No forecast available for {symbol.upper()}'}), 404
+
+        return jsonify({'success': True, **forecast})
+
+    except ValueError:
+        return jsonify({'error': 'horizons must be a comma-separated list of day counts'}), 400
+    except Exception as e:
+        logging.error(f"Error generating multi-horizon forecast for {symbol}: {e}")
+        return jsonify({'error': str(e)}), 500
+
 @app.route('/api/historical-comparison/<symbol>')
 def get_historical_comparison_api(symbol):
     """Get enhanced historical comparison with comprehensive scoring"""
     try:
-        from historical_comparison_engine import HistoricalComparisonEngine
+        from historical_comparison_engine import historical_comparison_engine as engine
         
-        engine = HistoricalComparisonEngine()
         matches = engine.find_historical_matches(symbol.upper(), lookback_days=504)
         
         if not matches:
@@ -0,0 +1,264 @@
+"""
+Scan Result Journal
+Append-only, segmented JSONL journal of scan snapshots with an atomically replaced index of the latest snapshot per scan type
+"""
+
+import json
+import os
+import shutil
+import threading
+import logging
+from datetime import datetime
+from typing import Dict, Iterator, List, Optional
+
+class ScanJournal:
+    def __init__(self, journal_dir: str = "scan_journal", max_segment_bytes: int = 16 * 1024 * 1024):
+        self.journal_dir = journal_dir
+        self.max_segment_bytes = max_segment_bytes
+        self.index_file = os.path.join(journal_dir, "latest.json")
+        self._lock = threading.Lock()
+        self._index = None
+
+        os.makedirs(self.journal_dir, exist_ok=True)
+
+    # Segment helpers
+
+    def _segment_names(self) -> List[str]:
+        """Segment file names in write order"""
+        return sorted(f for f in os.listdir(self.journal_dir)
+                      if f.startswith("segment-") and f.endswith(".jsonl"))
+
+    def _segment_path(self, name: str) -> str:
+        return os.path.join(self.journal_dir, name)
+
+    def _segment_name(self, number: int) -> str:
+        return f"segment-{number:06d}.jsonl"
+
+    def _active_segment(self) -> str:
+        """Segment new records go to, rolling over once the current one is full"""
+        segments = self._segment_names()
+        if not segments:
+            return self._segment_name(1)
+
+        current = segments[-1]
+        path = self._segment_path(current)
+        self._repair_tail(path)
+        if os.path.getsize(path) >= self.max_segment_bytes:
+            return self._segment_name(int(current[8:14]) + 1)
+        return current
+
+    def _repair_tail(self, path: str):
+        """Drop a partially written final record left behind by a crash"""
+        size = os.path.getsize(path)
+        if size == 0:
+            return
+        with open(path, 'rb+') as f:
+            f.seek(-1, os.SEEK_END)
+            if f.read(1) == b'\n':
+                return
+            f.seek(0)
+            content = f.read()
+            last_newline = content.rfind(b'\n')
+            f.truncate(last_newline + 1)
+            f.flush()
+            os.fsync(f.fileno())
+        logging.warning(f"Truncated torn record at end of {path}")
+
+    @staticmethod
+    def _fsync_dir(path: str):
+        """Persist directory entries after a rename"""
+        try:
+            fd = os.open(path, os.O_RDONLY)
+        except OSError:
+            return
+        try:
+            os.fsync(fd)
+        except OSError:
+            pass
+        finally:
+            os.close(fd)
+
+    # Index helpers
+
+    def _write_index(self, index: Dict):
+        """Atomically replace the latest-snapshot index"""
+        tmp_file = f"{self.index_file}.tmp"
+        with open(tmp_file, 'w') as f:
+            json.dump(index, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, self.index_file)
+        self._fsync_dir(self.journal_dir)
+
+    def _read_index(self) -> Dict:
+        if self._index is not None:
+            return self._index
+        try:
+            with open(self.index_file, 'r') as f:
+                self._index = json.load(f)
+        except (OSError, ValueError):
+            # Persisted again by the next append
+            self._index = self._rebuild_index()
+        return self._index
+
+    def _rebuild_index(self) -> Dict:
+        """Recover the index by scanning every segment (only needed if the index file is lost)"""
+        index = {'seq': 0, 'latest': {}}
+        for name in self._segment_names():
+            offset = 0
+            with open(self._segment_path(name), 'rb') as f:
+                for line in f:
+                    length = len(line)
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        offset += length
+                        continue
+                    seq = record.get('seq', 0)
+                    previous = index['latest'].get(record['scan_type'])
+                    if previous and previous['seq'] >= seq:
+                        offset += length
+                        continue
+                    index['seq'] = max(index['seq'], seq)
+                    index['latest'][record['scan_type']] = {
+                        'segment': name, 'offset': offset, 'length': length, 'seq': seq
+                    }
+                    offset += length
+        if index['latest']:
+            logging.info(f"Rebuilt scan journal index with {len(index['latest'])} scan types")
+        return index
+
+    # Public API
+
+    def append(self, scan_type: str, snapshot: Dict) -> int:
+        """Durably append a snapshot and point the index at it; returns its sequence number"""
+        with self._lock:
+            index = self._read_index()
+            seq = index['seq'] + 1
+            record = {
+                'seq': seq,
+                'scan_type': scan_type,
+                'written_at': datetime.now().isoformat(),
+                'snapshot': snapshot
+            }
+            line = (json.dumps(record) + '\n').encode('utf-8')
+
+            segment = self._active_segment()
+            path = self._segment_path(segment)
+            with open(path, 'ab') as f:
+                offset = f.tell()
+                f.write(line)
+                f.flush()
+                os.fsync(f.fileno())
+
+            latest = dict(index['latest'])
+            latest[scan_type] = {'segment': segment, 'offset': offset, 'length': len(line), 'seq': seq}
+            new_index = {'seq': seq, 'latest': latest}
+            self._write_index(new_index)
+            self._index = new_index
+            return seq
+
+    def load_latest(self) -> Dict[str, Dict]:
+        """Latest snapshot per scan type, read directly from the offsets in the index"""
+        with self._lock:
+            self._index = None
+            index = self._read_index()
+            snapshots = {}
+            for scan_type, entry in index['latest'].items():
+                try:
+                    with open(self._segment_path(entry['segment']), 'rb') as f:
+                        f.seek(entry['offset'])
+                        record = json.loads(f.read(entry['length']))
+                    snapshots[scan_type] = record['snapshot']
+                except (OSError, ValueError, KeyError) as e:
+                    logging.warning(f"Could not read journaled {scan_type} snapshot: {e}")
+            return snapshots
+
+    def index_mtime(self) -> Optional[float]:
+        """Modification time of the index, used by readers to detect new snapshots"""
+        try:
+            return os.path.getmtime(self.index_file)
+        except OSError:
+            return None
+
+    def iter_snapshots(self, scan_type: Optional[str] = None) -> Iterator[Dict]:
+        """Replay every journaled record in write order, optionally for a single scan type"""
+        last_seq = 0
+        for name in self._segment_names():
+            with open(self._segment_path(name), 'rb') as f:
+                for line in f:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    # Skip copies left behind if a compaction was interrupted
+                    if record.get('seq', 0) <= last_seq:
+                        continue
+                    last_seq = record.get('seq', 0)
+                    if scan_type is None or record.get('scan_type') == scan_type:
+                        yield record
+
+    def reset_latest(self):
+        """Forget the latest snapshots without discarding journal history"""
+        with self._lock:
+            index = self._read_index()
+            new_index = {'seq': index['seq'], 'latest': {}}
+            self._write_index(new_index)
+            self._index = new_index
+
+    def compact(self, target_segment_bytes: Optional[int] = None) -> int:
+        """Merge runs of closed segments into larger ones via write-then-rename; returns segments removed"""
+        target = target_segment_bytes or self.max_segment_bytes * 4
+        with self._lock:
+            segments = self._segment_names()[:-1]  # never touch the active segment
+            groups = []
+            current, current_size = [], 0
+            for name in segments:
+                size = os.path.getsize(self._segment_path(name))
+                if current and current_size + size > target:
+                    groups.append(current)
+                    current, current_size = [], 0
+                current.append(name)
+                current_size += size
+            if current:
+                groups.append(current)
+
+            removed = 0
+            for group in groups:
+                if len(group) < 2:
+                    continue
+                merged_name = group[0]
+                tmp_path = self._segment_path(f"{merged_name}.compact")
+                shifted = {}
+                with open(tmp_path, 'wb') as out:
+                    for name in group:
+                        shifted[name] = out.tell()
+                        with open(self._segment_path(name), 'rb') as f:
+                            shutil.copyfileobj(f, out)
+                    out.flush()
+                    os.fsync(out.fileno())
+
+                # The merged file starts with the original first segment, so existing
+                # index offsets stay valid until the index is repointed below
+                os.replace(tmp_path, self._segment_path(merged_name))
+                self._fsync_dir(self.journal_dir)
+
+                index = self._read_index()
+                latest = {}
+                for scan_type, entry in index['latest'].items():
+                    entry = dict(entry)
+                    if entry['segment'] in shifted:
+                        entry['offset'] += shifted[entry['segment']]
+                        entry['segment'] = merged_name
+                    latest[scan_type] = entry
+                self._index = {'seq': index['seq'], 'latest': latest}
+                self._write_index(self._index)
+
+                for name in group[1:]:
+                    os.remove(self._segment_path(name))
+                self._fsync_dir(self.journal_dir)
+                removed += len(group) - 1
+
+            if removed:
+                logging.info(f"Compacted scan journal: merged away {removed} segments")
+            return removed
@@ -0,0 +1,325 @@
+"""
+Unified Scan Scheduler
+Single scheduling subsystem for background and monitor scans with a shared provider-call budget and result store
+"""
+
+import os
+import threading
+import time
+import logging
+from collections import deque
+from datetime import datetime, timedelta
+from typing import Any, Callable, Dict, List, Optional
+
+class ProviderBudget:
+    """Sliding one-minute window limiting calls to the market data provider"""
+
+    def __init__(self, calls_per_minute: int = 300):
+        self.calls_per_minute = calls_per_minute
+        self.window = 60.0
+        self._calls = deque()
+        self._condition = threading.Condition()
+        self.total_calls = 0
+        self.total_wait_seconds = 0.0
+
+    def _expire(self, now: float):
+        while self._calls and now - self._calls[0] >= self.window:
+            self._calls.popleft()
+
+    def acquire(self, timeout: Optional[float] = None, calls: int = 1) -> bool:
+        """Block until the given number of provider calls fits in the budget; False if the timeout expires first"""
+        calls = max(1, min(calls, self.calls_per_minute))
+        start = time.monotonic()
+        with self._condition:
+            while True:
+                now = time.monotonic()
+                self._expire(now)
+                excess = len(self._calls) + calls - self.calls_per_minute
+                if excess <= 0:
+                    self._calls.extend([now] * calls)
+                    self.total_calls += calls
+                    self.total_wait_seconds += now - start
+                    return True
+
+                # Wait for enough of the oldest calls to leave the window
+                wait = self.window - (now - self._calls[excess - 1])
+                if timeout is not None:
+                    remaining = timeout - (now - start)
+                    if remaining <= 0:
+                        return False
+                    wait = min(wait, remaining)
+                self._condition.wait(wait)
+
+    def remaining(self) -> int:
+        """Provider calls still available in the current window"""
+        with self._condition:
+            self._expire(time.monotonic())
+            return self.calls_per_minute - len(self._calls)
+
+    def get_stats(self) -> Dict:
+        return {
+            'calls_per_minute': self.calls_per_minute,
+            'calls_last_minute': self.calls_per_minute - self.remaining(),
+            'total_calls': self.total_calls,
+            'total_wait_seconds': round(self.total_wait_seconds, 2)
+        }
+
+class SharedResults:
+    """Timestamped results any job can publish and any other job can reuse"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._entries = {}
+
+    def put(self, key: str, value: Any):
+        with self._lock:
+            self._entries[key] = (time.time(), value)
+
+    def get(self, key: str, max_age: Optional[float] = None) -> Any:
+        """Stored value, or None if missing or older than max_age seconds"""
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            return None
+        stored_at, value = entry
+        if max_age is not None and time.time() - stored_at > max_age:
+            return None
+        return value
+
+    def age(self, key: str) -> Optional[float]:
+        """Seconds since the key was last published"""
+        with self._lock:
+            entry = self._entries.get(key)
+        return time.time() - entry[0] if entry else None
+
+    def get_or_compute(self, key: str, max_age: float, compute: Callable[[], Any]) -> Any:
+        """Reuse a fresh value or compute and publish a new one"""
+        value = self.get(key, max_age)
+        if value is None:
+            value = compute()
+            if value is not None:
+                self.put(key, value)
+        return value
+
+    def prune(self, max_age: float):
+        """Drop entries nobody could still consider fresh"""
+        cutoff = time.time() - max_age
+        with self._lock:
+            stale = [key for key, (stored_at, _) in self._entries.items() if stored_at < cutoff]
+            for key in stale:
+                del self._entries[key]
+
+    def __len__(self):
+        return len(self._entries)
+
+OVERLAP_SKIP = 'skip'  # drop a run while the previous one is still going
+OVERLAP_COALESCE = 'coalesce'  # queue at most one run to start as soon as the current one ends
+OVERLAP_CONCURRENT = 'concurrent'  # allow up to max_concurrent runs at once, drop beyond that
+
+class ScanJob:
+    def __init__(self, name: str, func: Callable[[], Any], interval: float,
+                 provides: Optional[str] = None, satisfied_by: Optional[List[str]] = None,
+                 max_age: Optional[float] = None, cost: int = 0,
+                 condition: Optional[Callable[[], bool]] = None,
+                 first_run: Optional[datetime] = None,
+                 overlap: str = OVERLAP_SKIP, max_concurrent: int = 1):
+        if overlap not in (OVERLAP_SKIP, OVERLAP_COALESCE, OVERLAP_CONCURRENT):
+            raise ValueError(f"Unknown overlap policy: {overlap}")
+
+        self.name = name
+        self.func = func
+        self.interval = interval  # seconds
+        self.provides = provides or name  # shared result key published after each run
+        self.satisfied_by = satisfied_by or []  # keys whose fresh results make this run unnecessary
+        self.max_age = max_age if max_age is not None else interval
+        self.cost = cost  # estimated provider calls per run
+        self.condition = condition  # e.g. only during market hours
+
+        self.overlap = overlap
+        self.max_concurrent = max_concurrent if overlap == OVERLAP_CONCURRENT else 1
+
+        # Fixed-rate cadence: slots sit on a grid anchored at the first run, independent of run duration
+        self.next_run = first_run or datetime.now()
+        self.defer_until = None
+        self.running = 0
+        self.pending = False
+        self.last_run = None
+        self.last_duration = None
+        self.run_count = 0
+        self.skip_count = 0
+        self.overlap_skip_count = 0
+        self.missed_count = 0
+        self.max_lateness = 0.0
+
+    @property
+    def is_running(self) -> bool:
+        return self.running > 0
+
+def next_time_at(hour: int, minute: int, weekday: Optional[int] = None) -> datetime:
+    """Next wall-clock occurrence of hour:minute, optionally on a given weekday (0=Monday)"""
+    now = datetime.now()
+    candidate = now.replace(hour=hour, minute=minute, second=0, microsecond=0)
+    if weekday is not None:
+        candidate += timedelta(days=(weekday - now.weekday()) % 7)
+    if candidate <= now:
+        candidate += timedelta(days=7 if weekday is not None else 1)
+    return candidate
+
+class ScanScheduler:
+    def __init__(self, budget: ProviderBudget, tick_interval: float = 1.0):
+        self.budget = budget
+        self.results = SharedResults()
+        self.tick_interval = tick_interval
+        self.budget_retry_delay = 30  # seconds to defer a job the budget cannot cover yet
+        self.start_share = 0.25  # fraction of the per-minute budget that must be free before a costly job starts
+        self.lateness_warning = 5  # seconds late before a start is logged
+        self.jobs = {}
+        self._lock = threading.Lock()
+        self._thread = None
+        self.is_running = False
+
+    def register(self, job: ScanJob):
+        """Add or replace a job by name"""
+        with self._lock:
+            self.jobs[job.name] = job
+        logging.info(f"Scheduled {job.name} every {job.interval}s (cost ~{job.cost} provider calls)")
+
+    def unregister(self, name: str):
+        with self._lock:
+            self.jobs.pop(name, None)
+
+    def start(self):
+        if self.is_running:
+            return
+        self.is_running = True
+        self._thread = threading.Thread(target=self._run_loop, daemon=True)
+        self._thread.start()
+        logging.info("Scan scheduler started")
+
+    def stop(self):
+        self.is_running = False
+
+    def _run_loop(self):
+        while self.is_running:
+            try:
+                now = datetime.now()
+                with self._lock:
+                    due = [job for job in self.jobs.values()
+                           if job.next_run <= now and (job.defer_until is None or job.defer_until <= now)]
+                for job in due:
+                    self._dispatch(job, now)
+                self.results.prune(7 * 24 * 3600)
+            except Exception as e:
+                logging.error(f"Scan scheduler error: {e}")
+            time.sleep(self.tick_interval)
+
+    def _fresh_source(self, job: ScanJob) -> Optional[str]:
+        """Name of another job's result fresh enough to stand in for this run"""
+        for key in job.satisfied_by:
+            age = self.results.age(key)
+            if age is not None and age < job.max_age:
+                return key
+        return None
+
+    def _start_threshold(self, job: ScanJob) -> int:
+        """Free budget needed to start a job; its calls then pace themselves through acquire()"""
+        # Capped at a share of the window so costly jobs are not starved by frequent cheap ones
+        return max(1, min(job.cost, int(self.budget.calls_per_minute * self.start_share)))
+
+    def _advance(self, job: ScanJob, slot: datetime, missed: int):
+        """Move to the next grid slot; slots that passed while we were busy are not replayed"""
+        job.next_run = slot + timedelta(seconds=job.interval * (missed + 1))
+        job.defer_until = None
+
+    def _dispatch(self, job: ScanJob, now: datetime):
+        slot = job.next_run
+        lateness = (now - slot).total_seconds()
+        missed = int(lateness // job.interval)
+
+        if job.condition and not job.condition():
+            self._advance(job, slot, missed)
+            return
+
+        fresh_source = self._fresh_source(job)
+        if not fresh_source and job.cost and self.budget.remaining() < self._start_threshold(job):
+            # Keep the slot and skip the accounting, so the eventual start reports its backlog once
+            job.defer_until = now + timedelta(seconds=self.budget_retry_delay)
+            logging.info(f"Deferring {job.name}: provider budget exhausted for this minute")
+            return
+
+        self._advance(job, slot, missed)
+        if missed:
+            job.missed_count += missed
+            logging.warning(f"{job.name} fell behind: missed {missed} run(s), {lateness:.0f}s behind schedule")
+        elif lateness > self.lateness_warning:
+            logging.info(f"{job.name} starting {lateness:.1f}s late")
+        job.max_lateness = max(job.max_lateness, lateness)
+
+        if fresh_source:
+            job.skip_count += 1
+            logging.info(f"Skipping {job.name}: fresh results from {fresh_source}")
+            return
+
+        with self._lock:
+            if job.running >= job.max_concurrent:
+                if job.overlap == OVERLAP_COALESCE:
+                    job.pending = True
+                    logging.info(f"{job.name} still running; coalescing into one follow-up run")
+                else:
+                    job.overlap_skip_count += 1
+                    logging.info(f"Skipping {job.name}: {job.running} run(s) still in progress")
+                return
+            job.running += 1
+
+        threading.Thread(target=self._run_job, args=(job,), daemon=True).start()
+
+    def _run_job(self, job: ScanJob):
+        while True:
+            started = time.monotonic()
+            try:
+                result = job.func()
+                # Jobs that swallow their own errors return None and publish nothing
+                if result is not None:
+                    self.results.put(job.provides, result)
+                job.run_count += 1
+            except Exception as e:
+                logging.error(f"Scheduled job {job.name} failed: {e}")
+            finally:
+                job.last_run = datetime.now()
+                job.last_duration = time.monotonic() - started
+
+            with self._lock:
+                if job.pending:
+                    job.pending = False
+                    continue
+                job.running -= 1
+                return
+
+    def get_stats(self) -> Dict:
+        with self._lock:
+            jobs = list(self.jobs.values())
+        return {
+            'is_running': self.is_running,
+            'provider_budget': self.budget.get_stats(),
+            'shared_results': len(self.results),
+            'jobs': {
+                job.name: {
+                    'interval': job.interval,
+                    'next_run': job.next_run.isoformat(),
+                    'last_run': job.last_run.isoformat() if job.last_run else None,
+                    'last_duration': round(job.last_duration, 2) if job.last_duration is not None else None,
+                    'runs': job.run_count,
+                    'skipped': job.skip_count,
+                    'overlap_policy': job.overlap,
+                    'overlap_skipped': job.overlap_skip_count,
+                    'missed_runs': job.missed_count,
+                    'max_lateness_seconds': round(job.max_lateness, 1),
+                    'running': job.running
+                }
+                for job in jobs
+            }
+        }
+
+# Global instances
+provider_budget = ProviderBudget(int(os.environ.get('SCANNER_PROVIDER_CALLS_PER_MINUTE', 300)))
+scan_scheduler = ScanScheduler(provider_budget)
@@ -5,13 +5,13 @@ Automated scanning system with configurable intervals and alert thresholds
 """
 import os
 import time
-import schedule
 import logging
 from datetime import datetime, timedelta
-from threading import Thread
 import json
 from stock_scanner import StockScanner
 from confidence_scorer import ConfidenceScorer
+from background_scanner import background_scanner
+from scan_scheduler import scan_scheduler, ScanJob, next_time_at, OVERLAP_SKIP, OVERLAP_COALESCE
 from app import app, db
 from models import Stock, ScanResult
 
@@ -28,7 +28,7 @@ logger = logging.getLogger(__name__)
 
 class ScannerMonitor:
     def __init__(self):
-        self.scanner = StockScanner()
+        self.scanner = StockScanner(shared_results=scan_scheduler.results)
         self.confidence_scorer = ConfidenceScorer()
         self.is_market_hours = self.check_market_hours()
         self.alert_threshold = 75  # High confidence threshold for alerts
@@ -59,6 +59,7 @@ class ScannerMonitor:
                 
                 self.save_scan_results(results, "quick")
                 logger.info(f"Quick scan #{self.scan_count} completed. Found {len(results)} stocks, {len(high_confidence_stocks)} high confidence")
+                return results
                 
         except Exception as e:
             logger.error(f"Quick scan failed: {e}")
@@ -77,6 +78,7 @@ class ScannerMonitor:
                 
                 self.save_scan_results(results, "comprehensive")
                 logger.info(f"Comprehensive scan completed. Found {len(results)} stocks, {len(high_confidence_stocks)} above 60% confidence")
+                return results
                 
         except Exception as e:
             logger.error(f"Comprehensive scan failed: {e}")
@@ -95,6 +97,7 @@ class ScannerMonitor:
                 
                 self.save_scan_results(results, "after_hours")
                 logger.info(f"After-hours scan completed. Found {len(gap_candidates)} gap candidates")
+                return results
                 
         except Exception as e:
             logger.error(f"After-hours scan failed: {e}")
@@ -138,19 +141,37 @@ class ScannerMonitor:
         # For now, we'll just log the alerts
     
     def setup_schedule(self):
-        """Setup scanning schedule based on market hours"""
-        # Market hours schedule (9:30 AM - 4:00 PM EST)
-        schedule.every(5).minutes.do(self.quick_scan).tag('market_hours')
-        schedule.every(30).minutes.do(self.comprehensive_scan).tag('market_hours')
+        """Register scanning jobs with the shared scan scheduler"""
+        # Market hours schedule (9:30 AM - 4:00 PM EST); a fresher, larger scan stands in for a smaller one
+        scan_scheduler.register(ScanJob(
+            'monitor_quick', self.quick_scan, 5 * 60,
+            satisfied_by=['monitor_comprehensive', 'monitor_weekly_deep'],
+            cost=100, condition=self.check_market_hours, overlap=OVERLAP_SKIP
+        ))
+        scan_scheduler.register(ScanJob(
+            'monitor_comprehensive', self.comprehensive_scan, 30 * 60,
+            satisfied_by=['monitor_weekly_deep'],
+            cost=500, condition=self.check_market_hours, overlap=OVERLAP_COALESCE
+        ))
         
         # After hours schedule
-        schedule.every().hour.do(self.after_hours_scan).tag('after_hours')
+        scan_scheduler.register(ScanJob(
+            'monitor_after_hours', self.after_hours_scan, 60 * 60,
+            satisfied_by=['monitor_comprehensive', 'monitor_weekly_deep'],
+            cost=200, condition=lambda: not self.check_market_hours(), overlap=OVERLAP_SKIP
+        ))
         
         # Daily summary at market close
-        schedule.every().day.at("16:05").do(self.daily_summary)
+        scan_scheduler.register(ScanJob(
+            'monitor_daily_summary', self.daily_summary, 24 * 60 * 60,
+            first_run=next_time_at(16, 5)
+        ))
         
         # Weekly deep scan on Sunday
-        schedule.every().sunday.at("08:00").do(self.weekly_deep_scan)
+        scan_scheduler.register(ScanJob(
+            'monitor_weekly_deep', self.weekly_deep_scan, 7 * 24 * 60 * 60,
+            cost=1000, first_run=next_time_at(8, 0, weekday=6), overlap=OVERLAP_SKIP
+        ))
         
         logger.info("Scanner schedule configured:")
         logger.info("  - Quick scans: Every 5 minutes during market hours")
@@ -199,50 +220,25 @@ class ScannerMonitor:
             with app.app_context():
                 results = self.scanner.scan_stocks(max_results=100)
                 logger.info(f"Weekly deep scan completed. Analyzed {len(results)} stocks")
+                return results
                 
         except Exception as e:
             logger.error(f"Weekly deep scan failed: {e}")
     
-    def run_scheduler(self):
-        """Run the scheduler in a separate thread"""
-        while True:
-            try:
-                # Update market hours status
-                self.is_market_hours = self.check_market_hours()
-                
-                # Clear inappropriate schedules
-                if self.is_market_hours:
-                    schedule.clear('after_hours')
-                    # Re-add market hours schedules if needed
-                    if not schedule.get_jobs('market_hours'):
-                        schedule.every(5).minutes.do(self.quick_scan).tag('market_hours')
-                        schedule.every(30).minutes.do(self.comprehensive_scan).tag('market_hours')
-                else:
-                    schedule.clear('market_hours')
-                    # Re-add after hours schedule if needed
-                    if not schedule.get_jobs('after_hours'):
-                        schedule.every().hour.do(self.after_hours_scan).tag('after_hours')
-                
-                schedule.run_pending()
-                time.sleep(60)  # Check every minute
-                
-            except Exception as e:
-                logger.error(f"Scheduler error: {e}")
-                time.sleep(60)
-
 def start_monitor():
     """Start the scanner monitor"""
     monitor = ScannerMonitor()
     monitor.setup_schedule()
     
-    # Start scheduler in background thread
-    scheduler_thread = Thread(target=monitor.run_scheduler, daemon=True)
-    scheduler_thread.start()
+    # Jobs only run in the elected scanner leader, alongside the background scans
+    if background_scanner.leader.is_leader:
+        scan_scheduler.start()
     
     logger.info("Stock Scanner Monitor started successfully")
     return monitor
 
 if __name__ == "__main__":
+    background_scanner.leader.try_acquire()
     monitor = start_monitor()
     
     try:
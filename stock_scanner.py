@@ -8,9 +8,13 @@ import os
 import time
 from pattern_evolution_tracker import PatternEvolutionTracker
 from confidence_scorer import ConfidenceScorer
+from scan_scheduler import provider_budget
 
 class StockScanner:
-    def __init__(self):
+    def __init__(self, shared_results=None, analysis_max_age=300):
+        # Scheduled scanners pass the scheduler's SharedResults so per-symbol analyses are reused across jobs
+        self.shared_results = shared_results
+        self.analysis_max_age = analysis_max_age
         self.api_key = os.environ.get('ALPHA_VANTAGE_API_KEY')
         self.base_url = 'https://www.alphavantage.co/query'
         self.pattern_tracker = PatternEvolutionTracker()
@@ -101,6 +105,7 @@ class StockScanner:
     def get_stock_data(self, symbol, period="3mo"):
         """Get historical stock data with enhanced error handling"""
         try:
+            provider_budget.acquire()
             ticker = yf.Ticker(symbol)
             hist = ticker.history(period=period)
             
@@ -121,6 +126,14 @@ class StockScanner:
     
     def analyze_stock(self, symbol):
         """Comprehensive stock analysis with multiple timeframes"""
+        if self.shared_results is not None:
+            return self.shared_results.get_or_compute(
+                f"analysis:{symbol}", self.analysis_max_age, lambda: self._analyze_stock(symbol)
+            )
+        return self._analyze_stock(symbol)
+    
+    def _analyze_stock(self, symbol):
+        """Run the analysis against fresh provider data"""
         try:
             hist = self.get_stock_data(symbol)
             if hist is None:
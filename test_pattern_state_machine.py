@@ -0,0 +1,54 @@
+import numpy as np
+import pandas as pd
+
+from pattern_state_machine import PatternStateMachine
+
+def make_history(bars=160, seed=3):
+    rng = np.random.default_rng(seed)
+    closes = 100 * np.exp(np.cumsum(rng.normal(0, 0.015, bars)))
+    index = pd.date_range('2026-01-02', periods=bars, freq='B')
+    return pd.DataFrame({
+        'Open': closes,
+        'High': closes * 1.01,
+        'Low': closes * 0.99,
+        'Close': closes,
+        'Volume': rng.integers(100000, 1000000, bars).astype(float)
+    }, index=index)
+
+def as_ticker_history(hist):
+    """Ticker.history-style bars: midnight New York time, tz-aware"""
+    hist = hist.copy()
+    hist.index = hist.index.tz_localize('America/New_York')
+    return hist
+
+def feed(machine, hist, sources, start=100, window=63):
+    """Advance one bar at a time through trailing windows, taking each window from the given source"""
+    state, events = None, []
+    for k, source in zip(range(start, len(hist) + 1), sources):
+        bars = hist.iloc[max(0, k - window):k]
+        state, new_events = machine.advance('TEST', source(bars), state)
+        events.extend(new_events)
+    return state, events
+
+def test_alternating_history_sources_match_a_single_source():
+    machine = PatternStateMachine()
+    hist = make_history()
+    steps = len(hist) - 100 + 1
+    naive = [lambda bars: bars] * steps
+    alternating = [as_ticker_history if step % 2 else (lambda bars: bars) for step in range(steps)]
+
+    expected_state, expected_events = feed(machine, hist, naive)
+    state, events = feed(machine, hist, alternating)
+
+    assert expected_events
+    assert state == expected_state
+    assert events == expected_events
+
+def test_tz_aware_state_advances_with_tz_naive_bars():
+    machine = PatternStateMachine()
+    hist = make_history()
+
+    state, _ = machine.advance('TEST', as_ticker_history(hist.iloc[:120]))
+    state, _ = machine.advance('TEST', hist.iloc[60:121], state)
+
+    assert state['last_bar'] == hist.index[120].isoformat()